@@ -0,0 +1,43 @@
+﻿from __future__ import annotations
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+
+from ..config import get_settings
+from ..models.schemas import MaintenanceReport, ProfileInfo
+from ..services import maintenance
+from ..utils import profiling
+from ..utils.auth import admin_token_valid
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)) -> None:
+    if not get_settings().admin_token:
+        raise HTTPException(status_code=403, detail="未配置 ADMIN_TOKEN，管理接口已禁用")
+    if not admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="管理员令牌无效")
+
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/profiles", response_model=List[ProfileInfo])
+def list_profiles():
+    return [ProfileInfo(**entry) for entry in profiling.list_profiles()]
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str):
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=profile_id)
+
+
+@router.post("/maintenance", response_model=MaintenanceReport)
+def run_maintenance(
+    dryRun: bool = Query(False, description="report what would be removed without removing it"),
+    fullVacuum: bool = Query(False, description="rewrite the whole database instead of an incremental vacuum"),
+):
+    return maintenance.run_maintenance(dry_run=dryRun, full_vacuum=fullVacuum)
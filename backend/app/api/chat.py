@@ -1,6 +1,8 @@
 ﻿from __future__ import annotations
 
-from fastapi import APIRouter, Query
+from typing import FrozenSet, Optional
+
+from fastapi import APIRouter, Depends, Query
 
 from ..models.schemas import (
     ChatMessageResponse,
@@ -11,6 +13,7 @@ from ..models.schemas import (
     SendChatMessageRequest,
 )
 from ..services import chat
+from .projection import citation_fields, projected
 
 router = APIRouter(prefix="/chat/sessions", tags=["Chat"])
 
@@ -26,8 +29,11 @@ def create_session(payload: CreateChatSessionRequest):
 
 
 @router.get("/{session_id}", response_model=ChatSessionDetailResponse)
-def get_session(session_id: str):
-    return chat.get_session_detail(session_id)
+def get_session(session_id: str, dropped: Optional[FrozenSet[str]] = Depends(citation_fields)):
+    detail = chat.get_session_detail(session_id)
+    if not dropped:
+        return detail
+    return projected(detail, {"messages": {"__all__": {"citations": {"__all__": set(dropped)}}}})
 
 
 @router.delete("/{session_id}", status_code=204)
@@ -36,5 +42,8 @@ def delete_session(session_id: str):
 
 
 @router.post("/{session_id}/messages", response_model=ChatMessageResponse)
-def send_message(session_id: str, payload: SendChatMessageRequest):
-    return chat.send_message(session_id, payload)
+def send_message(
+    session_id: str, payload: SendChatMessageRequest, dropped: Optional[FrozenSet[str]] = Depends(citation_fields)
+):
+    response = chat.send_message(session_id, payload)
+    return projected(response, {"message": {"citations": {"__all__": set(dropped)}}} if dropped else None)
@@ -1,9 +1,20 @@
 ﻿from __future__ import annotations
 
-from fastapi import APIRouter, UploadFile
+import logging
+from typing import List, Optional
 
-from ..models.schemas import DocumentTaskStatusResponse
-from ..services import documents
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from pydantic import ValidationError
+
+from ..models.schemas import (
+    DocumentBatchResponse,
+    DocumentTaskStatusResponse,
+    DocumentVersionResponse,
+    VectorStoreConfig,
+)
+from ..services import documents, vector_stores, versions
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
 
@@ -13,6 +24,45 @@ async def upload_document(file: UploadFile):
     return documents.create_document_task(file)
 
 
+@router.post("/batch", response_model=DocumentBatchResponse, status_code=201)
+def upload_documents(
+    files: List[UploadFile] = File(...),
+    vectorStoreConfig: Optional[str] = Form(None),
+):
+    store_config = None
+    if vectorStoreConfig:
+        try:
+            store_config = VectorStoreConfig.model_validate_json(vectorStoreConfig)
+        except ValidationError as exc:
+            raise HTTPException(status_code=422, detail=exc.errors(include_url=False)) from exc
+
+    batch = documents.create_document_batch(files)
+    passed = [item.taskId for item in batch.items if item.status == "success"]
+    if store_config is None or not passed:
+        return batch
+    try:
+        record = vector_stores.build_vector_store(passed, store_config)
+    except Exception as exc:
+        logger.exception("Building vector store for batch %s failed: %s", batch.batchId, exc)
+        return documents.attach_batch_store(batch.batchId, None, f"向量库构建失败: {exc}")
+    return documents.attach_batch_store(batch.batchId, record.store_id)
+
+
+@router.get("/batches/{batch_id}", response_model=DocumentBatchResponse)
+def get_document_batch(batch_id: str):
+    return documents.get_document_batch(batch_id)
+
+
 @router.get("/{task_id}", response_model=DocumentTaskStatusResponse)
 async def get_document_task(task_id: str):
     return documents.get_document_task(task_id)
+
+
+@router.post("/{task_id}/versions", response_model=DocumentVersionResponse, status_code=201)
+def upload_document_version(task_id: str, file: UploadFile):
+    return versions.create_document_version(task_id, file)
+
+
+@router.get("/{task_id}/versions", response_model=List[DocumentVersionResponse])
+def list_document_versions(task_id: str):
+    return versions.list_document_versions(task_id)
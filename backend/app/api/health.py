@@ -1,6 +1,12 @@
-﻿from fastapi import APIRouter
+﻿from typing import List
+
+from fastapi import APIRouter
+from fastapi.responses import Response
 
 from ..config import get_settings
+from ..models.schemas import EmbeddingBackendStatus
+from ..services import vector_stores
+from ..utils import metrics
 
 router = APIRouter()
 
@@ -9,3 +15,13 @@ router = APIRouter()
 def healthz():
     settings = get_settings()
     return {"status": "ok", "service": settings.app_name}
+
+
+@router.get("/healthz/embeddings", response_model=List[EmbeddingBackendStatus])
+def embedding_health():
+    return [EmbeddingBackendStatus(**entry) for entry in vector_stores.embedding_router().status()]
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
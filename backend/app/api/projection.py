@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from typing import Any, Dict, FrozenSet, Optional
+
+from fastapi import HTTPException, Query
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from ..models.schemas import DocumentSnippet
+
+SNIPPET_FIELDS: FrozenSet[str] = frozenset(DocumentSnippet.model_fields)
+
+
+def citation_fields(
+    fields: Optional[str] = Query(
+        default=None,
+        description="Comma-separated citation fields to return (id,title,similarity,content,metadata); default all",
+    ),
+) -> Optional[FrozenSet[str]]:
+    """Dependency returning the citation fields to drop, or None to return citations unchanged."""
+
+    if fields is None:
+        return None
+    wanted = {part.strip() for part in fields.split(",") if part.strip()}
+    unknown = wanted - SNIPPET_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"fields 包含未知字段: {', '.join(sorted(unknown))}")
+    return SNIPPET_FIELDS - wanted
+
+
+def projected(model: BaseModel, exclude: Optional[Dict[str, Any]] = None) -> Response:
+    """Serialise straight to JSON bytes with pydantic, leaving out ``exclude`` (a pydantic exclude spec).
+
+    ``debug`` is only returned to requests that asked for it; every other null field is kept as before.
+    """
+
+    exclude = dict(exclude or {})
+    if "debug" in type(model).model_fields and getattr(model, "debug") is None:
+        exclude["debug"] = True
+    return Response(model.model_dump_json(exclude=exclude), media_type="application/json")
@@ -0,0 +1,59 @@
+﻿from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, File, Form, UploadFile
+from fastapi.responses import StreamingResponse
+
+from ..models.entities import QaBatchJob
+from ..models.schemas import QaBatchJobResponse
+from ..services import qa_batch
+
+router = APIRouter(prefix="/qa-jobs", tags=["QaJobs"])
+
+
+def _map_job(job: QaBatchJob) -> QaBatchJobResponse:
+    return QaBatchJobResponse(
+        id=job.job_id,
+        storeId=job.store_id,
+        status=job.status,
+        total=job.total,
+        completed=job.completed,
+        failed=job.failed,
+        concurrency=job.concurrency,
+        rateLimit=job.rate_limit,
+        message=job.message,
+        resultsUrl=f"/api/v1/qa-jobs/{job.job_id}/results",
+        createdAt=job.created_at,
+        updatedAt=job.updated_at,
+    )
+
+
+@router.post("", response_model=QaBatchJobResponse, status_code=202)
+def create_job(
+    file: UploadFile = File(...),
+    storeId: str = Form(...),
+    concurrency: int = Form(4),
+    rateLimit: Optional[float] = Form(None),
+):
+    return _map_job(qa_batch.create_job(file.file, storeId, concurrency, rateLimit))
+
+
+@router.get("/{job_id}", response_model=QaBatchJobResponse)
+def get_job(job_id: str):
+    return _map_job(qa_batch.get_job(job_id))
+
+
+@router.get("/{job_id}/results")
+def get_results(job_id: str):
+    return StreamingResponse(qa_batch.iter_results(job_id), media_type="application/x-ndjson")
+
+
+@router.post("/{job_id}/cancel", response_model=QaBatchJobResponse)
+def cancel_job(job_id: str):
+    return _map_job(qa_batch.cancel_job(job_id))
+
+
+@router.post("/{job_id}/resume", response_model=QaBatchJobResponse, status_code=202)
+def resume_job(job_id: str):
+    return _map_job(qa_batch.resume_job(job_id))
@@ -0,0 +1,21 @@
+﻿from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from ..models.schemas import UsageReport
+from ..services import usage
+
+router = APIRouter(prefix="/usage", tags=["Usage"])
+
+
+@router.get("", response_model=UsageReport)
+def usage_report(
+    groupBy: str = Query("day", description="day | session | store"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    kind: Optional[str] = Query(None, description="chat | qa_batch | build | rebuild | update"),
+):
+    return usage.usage_report(groupBy, since, until, kind)
@@ -1,17 +1,24 @@
 ﻿from __future__ import annotations
 
-from fastapi import APIRouter
+from typing import FrozenSet, Optional
 
+from fastapi import APIRouter, Depends, File, UploadFile
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+from ..models.entities import VectorStoreRecord
 from ..models.schemas import (
     CreateVectorStoreRequest,
     CreateVectorStoreResponse,
     RecallRequest,
     RecallResponse,
+    ShardRebuildResponse,
     VectorStore,
-    VectorStoreConfig,
     VectorStoreTaskStatusResponse,
 )
-from ..services import vector_stores
+from ..services import snapshots, vector_stores
+from .admin import require_admin
+from .projection import citation_fields, projected
 
 router = APIRouter(prefix="/vector-stores", tags=["VectorStores"])
 
@@ -26,18 +33,39 @@ def create_vector_store(payload: CreateVectorStoreRequest):
     )
 
 
-@router.get("/{store_id}", response_model=VectorStore)
-def get_vector_store(store_id: str):
-    record = vector_stores.get_vector_store(store_id)
+def _map_store(record: VectorStoreRecord) -> VectorStore:
     return VectorStore(
         id=record.store_id,
         name=record.name,
         status=record.status,
         documentTaskId=record.document_task_id,
-        config=VectorStoreConfig(**record.config),
+        config=vector_stores.stored_config(record),
         createdAt=record.created_at,
         updatedAt=record.updated_at,
         failureReason=record.failure_reason,
+        buildReport=record.build_report,
+    )
+
+
+# the index files of a snapshot are unpickled on load: only admins may import, and only signed snapshots
+@router.post("/import", response_model=VectorStore, status_code=201, dependencies=[Depends(require_admin)])
+def import_vector_store(file: UploadFile = File(...)):
+    return _map_store(snapshots.import_snapshot(file.file))
+
+
+@router.get("/{store_id}", response_model=VectorStore)
+def get_vector_store(store_id: str):
+    return _map_store(vector_stores.get_vector_store(store_id))
+
+
+@router.get("/{store_id}/export")
+def export_vector_store(store_id: str):
+    path = snapshots.export_snapshot(store_id)
+    return FileResponse(
+        path,
+        media_type="application/gzip",
+        filename=f"{store_id}.tar.gz",
+        background=BackgroundTask(path.unlink, missing_ok=True),
     )
 
 
@@ -53,6 +81,15 @@ def get_vector_store_task(store_id: str, task_id: str):
     )
 
 
+@router.post("/{store_id}/shards/{shard}/rebuild", response_model=ShardRebuildResponse)
+def rebuild_shard(store_id: str, shard: int):
+    chunks = vector_stores.rebuild_shard(store_id, shard)
+    return ShardRebuildResponse(storeId=store_id, shard=shard, chunks=chunks)
+
+
 @router.post("/{store_id}/recall", response_model=RecallResponse)
-def recall(store_id: str, payload: RecallRequest):
-    return vector_stores.recall(store_id, payload)
+def recall(
+    store_id: str, payload: RecallRequest, dropped: Optional[FrozenSet[str]] = Depends(citation_fields)
+):
+    response = vector_stores.recall(store_id, payload)
+    return projected(response, {"items": {"__all__": set(dropped)}} if dropped else None)
@@ -0,0 +1,87 @@
+"""Command-line tools that run against the local database and stores (no server needed).
+
+Usage (from ``backend/``)::
+
+    python -m app.cli qa-batch --store <storeId> --input questions.jsonl --output results.jsonl \
+        [--concurrency 8] [--rate 5]
+
+``qa-batch`` answers every question of a JSONL file through the RAG graph and appends one JSON
+line per result to ``--output``. Re-running the same command after an interruption only answers
+the questions that are not in the output yet.
+
+    python -m app.cli maintenance [--dry-run] [--full-vacuum]
+
+``maintenance`` applies the retention settings, removes orphaned store/document/job files and
+vacuums the database, then prints the report as JSON (``--dry-run`` only reports).
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+
+from .utils.logs import configure_logging
+
+
+def _qa_batch(args: argparse.Namespace) -> int:
+    from .models.db import init_db
+    from .services import qa_batch, vector_stores
+
+    init_db()
+    vector_stores.get_vector_store(args.store)
+    with Path(args.input).open("rb") as handle:
+        questions = qa_batch.parse_questions(handle)
+
+    def report(completed: int, failed: int) -> None:
+        print(f"\r{completed}/{len(questions)} answered, {failed} failed", end="", file=sys.stderr, flush=True)
+
+    completed, failed = qa_batch.run_questions(
+        questions, args.store, Path(args.output), args.concurrency, args.rate, on_progress=report
+    )
+    print(f"\r{completed}/{len(questions)} answered, {failed} failed -> {args.output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _maintenance(args: argparse.Namespace) -> int:
+    from .models.db import init_db
+    from .services import maintenance
+
+    init_db()
+    report = maintenance.run_maintenance(dry_run=args.dry_run, full_vacuum=args.full_vacuum)
+    print(report.model_dump_json(indent=2))
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="RAG backend command-line tools")
+    parser.add_argument("--log-level", default="WARNING")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    qa = commands.add_parser("qa-batch", help="answer a JSONL file of questions against a vector store")
+    qa.add_argument("--store", required=True, help="vector store id")
+    qa.add_argument("--input", required=True, help='JSONL file, one {"id": ..., "question": ...} per line')
+    qa.add_argument("--output", required=True, help="JSONL results file (appended to; enables resume)")
+    qa.add_argument("--concurrency", type=int, default=4)
+    qa.add_argument("--rate", type=float, default=None, help="max questions started per second")
+    qa.set_defaults(handler=_qa_batch)
+
+    upkeep = commands.add_parser("maintenance", help="purge expired data and orphaned files, vacuum the database")
+    upkeep.add_argument("--dry-run", action="store_true", help="only report what would be removed")
+    upkeep.add_argument("--full-vacuum", action="store_true", help="rewrite the whole database file")
+    upkeep.set_defaults(handler=_maintenance)
+
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level.upper())
+    try:
+        return args.handler(args)
+    except HTTPException as exc:
+        print(f"error: {exc.detail}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
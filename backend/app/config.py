@@ -1,7 +1,7 @@
 import json
 from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -34,6 +34,72 @@ class Settings(BaseSettings):
     allowed_extensions_raw: str = Field(default=".txt,.md,.pdf", alias="ALLOWED_EXTENSIONS")
     max_file_size_mb: int = 50
     min_document_length: int = 200
+    bulk_max_files: int = 1000
+    # worker processes for bulk validation/extraction (0 = min(4, cpu count))
+    ingest_workers: int = 0
+    # threads for parallel shard build/search (0 = cpu count)
+    vector_shard_workers: int = 0
+    # upper bound on the uncompressed size of an imported store snapshot
+    snapshot_max_size_mb: int = 2048
+    # HMAC-SHA256 key signing exported snapshots; imports are refused unless signed with this key
+    snapshot_signing_key: str | None = Field(default=None, alias="SNAPSHOT_SIGNING_KEY")
+    # loaded FAISS indexes kept in memory (each shard counts once; 0 disables)
+    vector_store_cache_size: int = 16
+
+    # two-stage recall: pick the N documents with the nearest centroids, then search only their chunks;
+    # used for stores with more than the minimum number of documents (0 documents = always flat search)
+    recall_coarse_documents: int = 20
+    recall_coarse_min_documents: int = 100
+    # default for config.dedupDistance: chunks whose 64-bit SimHash differs in at most this many bits from a
+    # kept chunk of the same document are dropped at build time; unset = exact duplicates only
+    dedup_max_distance: Optional[int] = None
+
+    # startup warm-up: build models eagerly and preload these stores before serving
+    warmup_models: bool = False
+    warmup_store_ids_raw: str = Field(default="", alias="WARMUP_STORE_IDS")
+
+    # responses of at least this many bytes are brotli/gzip compressed when the client accepts it
+    response_compression_min_bytes: int = 1024
+    response_gzip_level: int = 5
+    # used only when the optional brotli package is installed
+    response_brotli_quality: int = 4
+
+    # offline batch question answering
+    qa_job_dir: Path = Path("storage/qa_jobs")
+    qa_batch_max_concurrency: int = 32
+    # pick up jobs left running by a stopped or crashed process at startup
+    qa_batch_resume_on_startup: bool = True
+
+    # token prices (per 1000 tokens) used to turn recorded usage into cost in /usage reports
+    price_prompt_per_1k_tokens: float = 0.0
+    price_completion_per_1k_tokens: float = 0.0
+    price_embedding_per_1k_tokens: float = 0.0
+
+    # retention (days, 0 = keep forever) applied by the maintenance job: chat sessions by last activity,
+    # single messages by age, failed document tasks and failed/cancelled QA batch jobs by last update
+    retention_session_days: int = 0
+    retention_message_days: int = 0
+    retention_failed_task_days: int = 30
+    # orphaned store/document/job files younger than this are left alone (they may belong to a running write)
+    maintenance_min_age_seconds: int = 3600
+    # run the maintenance job in the server process every N hours; 0 = only on demand (admin API / CLI)
+    maintenance_interval_hours: float = 0
+
+    # logging: records are written by a background thread from a bounded queue; "json" or "text" lines
+    log_level: str = "INFO"
+    log_format: str = "json"
+    log_queue_size: int = 10000
+    # messages below ERROR longer than this are clipped and fingerprinted
+    log_max_field_chars: int = 2000
+    # per-logger sampling of records below WARNING, e.g. {"uvicorn.access": 0.1, "app.services.chat": 0.5}
+    log_sample_rates_raw: str = Field(default="", alias="LOG_SAMPLE_RATES")
+
+    # admin-only surfaces (profiling); disabled while no token is configured
+    admin_token: str | None = Field(default=None, alias="ADMIN_TOKEN")
+    profile_dir: Path = Path("storage/profiles")
+    profile_max_files: int = 200
+    # profile every vector store build, not only requests that ask for it
+    profile_builds: bool = False
 
     # langchain configuration
     model_name: str = Field(default="deepseek-chat")
@@ -43,6 +109,46 @@ class Settings(BaseSettings):
     deepseek_api_key: str | None = Field(default=None, alias="DEEPSEEK_API_KEY")
     embed_base_url: str | None = Field(default=None, alias="EMBED_BASE_URL")
     embed_api_key: str | None = Field(default=None, alias="EMBED_API_KEY")
+    # embedding backends in priority order, as a JSON list of {"name", "model", "baseUrl", "apiKey"} objects
+    # (an optional "space" marks backends serving the same model under different provider classes);
+    # empty = one "default" backend from the settings above. The local deterministic backend "fallback"
+    # is always appended last. Each store is only queried by backends in the vector space it was built in.
+    embed_backends_raw: str = Field(default="", alias="EMBED_BACKENDS")
+    # per-backend circuit breaker: traffic skips an open backend; one probe call is let through per cooldown
+    embed_breaker_failure_ratio: float = 0.5
+    embed_breaker_window: int = 10
+    embed_breaker_min_calls: int = 2
+    embed_breaker_cooldown_seconds: float = 15.0
+
+    # shared HTTP connection pool for every chat model and embedding provider call
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30.0
+    # needs the optional h2 package (pip install "httpx[http2]")
+    http2: bool = False
+    http_connect_timeout_seconds: float = 5.0
+    # read timeout for embedding calls; chat model calls use LLM_TIMEOUT_SECONDS
+    http_read_timeout_seconds: float = 30.0
+    # longest wait for a free pooled connection
+    http_pool_timeout_seconds: float = 10.0
+
+    # chat model scheduling
+    llm_max_in_flight: int = 16
+    llm_max_queue: int = 64
+    llm_timeout_seconds: float = 60.0
+    llm_breaker_failure_ratio: float = 0.5
+    llm_breaker_window: int = 20
+    llm_breaker_min_calls: int = 10
+    llm_breaker_cooldown_seconds: float = 30.0
+    # batch QA jobs get their own slots and queue so a large job cannot push interactive chat into 429s;
+    # their calls may wait longer for a slot
+    llm_batch_max_in_flight: int = 4
+    llm_batch_max_queue: int = 256
+    llm_batch_timeout_seconds: float = 300.0
+    # share one model call between concurrent identical prompts
+    chat_coalesce_answers: bool = False
+    # earlier messages of the session sent to the model with each question (0, the default, disables history)
+    chat_history_messages: int = 0
 
     model_config = SettingsConfigDict(
         env_file=_resolve_env_file(),
@@ -79,6 +185,20 @@ class Settings(BaseSettings):
             normalized.append(item.lower())
         return normalized or [".txt", ".md", ".pdf"]
 
+    @property
+    def embed_backends(self) -> List[dict]:
+        text = self.embed_backends_raw.strip()
+        return json.loads(text) if text else []
+
+    @property
+    def log_sample_rates(self) -> Dict[str, float]:
+        text = self.log_sample_rates_raw.strip()
+        return {name: float(rate) for name, rate in json.loads(text).items()} if text else {}
+
+    @property
+    def warmup_store_ids(self) -> List[str]:
+        return [part.strip() for part in self.warmup_store_ids_raw.split(",") if part.strip()]
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,22 +1,44 @@
 ﻿from __future__ import annotations
 
-import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .api import chat, documents, health, vector_stores
+from .api import admin, chat, documents, health, qa_jobs, usage, vector_stores
 from .config import get_settings
+from .middleware import CompressionMiddleware, MetricsMiddleware, ProfilingMiddleware, ServerTimingMiddleware
 from .models.db import init_db
+from .services import maintenance, qa_batch
+from .services.warmup import warm_up
+from .utils.logs import configure_logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(levelname)s %(name)s: %(message)s'
-)
+configure_logging()
 
 settings = get_settings()
 
-app = FastAPI(title=settings.app_name, openapi_url="/openapi.json", docs_url=settings.docs_url)
+
+def run_startup_jobs() -> None:
+    """Work done once per deployment rather than once per worker process."""
+
+    if settings.qa_batch_resume_on_startup:
+        qa_batch.resume_interrupted()
+    maintenance.start_schedule()
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    # under app.serve the master warms up before forking and its job process runs the startup jobs
+    prefork = getattr(application.state, "prefork", False)
+    if not prefork:
+        warm_up()
+        run_startup_jobs()
+    yield
+    if not prefork:
+        maintenance.stop_schedule()
+
+
+app = FastAPI(title=settings.app_name, openapi_url="/openapi.json", docs_url=settings.docs_url, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,6 +47,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ServerTimingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.response_compression_min_bytes,
+    gzip_level=settings.response_gzip_level,
+    brotli_quality=settings.response_brotli_quality,
+)
+app.add_middleware(MetricsMiddleware)
 
 init_db()
 
@@ -32,6 +63,9 @@ app.include_router(health.router)
 app.include_router(documents.router, prefix=settings.api_prefix)
 app.include_router(vector_stores.router, prefix=settings.api_prefix)
 app.include_router(chat.router, prefix=settings.api_prefix)
+app.include_router(qa_jobs.router, prefix=settings.api_prefix)
+app.include_router(usage.router, prefix=settings.api_prefix)
+app.include_router(admin.router, prefix=settings.api_prefix)
 
 
 @app.get("/")
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import time
+from typing import Set
+from urllib.parse import parse_qs
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: responses are gzip-compressed only
+    brotli = None
+
+from .utils import metrics, profiling, timing
+from .utils.auth import ADMIN_HEADER, admin_token_valid
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency, status counts and in-flight requests."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        metrics.HTTP_INFLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.HTTP_INFLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "GET")
+            metrics.HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=path)
+            metrics.HTTP_REQUESTS.inc(method=method, route=path, status=str(status_code))
+
+
+TIMING_HEADER = b"x-debug-timing"
+_TRUTHY = {"1", "true", "yes", "on"}
+
+
+PROFILE_HEADER = b"x-profile"
+
+
+def _flag_requested(scope: Scope, header: bytes, query_param: str) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == header:
+            return value.decode("latin-1").strip().lower() in _TRUTHY
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return any(value.lower() in _TRUTHY for value in query.get(query_param, []))
+
+
+def timing_requested(scope: Scope) -> bool:
+    return _flag_requested(scope, TIMING_HEADER, "debug")
+
+
+def profile_requested(scope: Scope) -> bool:
+    return _flag_requested(scope, PROFILE_HEADER, "profile")
+
+
+class ServerTimingMiddleware:
+    """Collects per-stage timings when a request opts in and reports them via ``Server-Timing``."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not timing_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        token = timing.activate()
+        timings = timing.current()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and timings is not None:
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            timing.deactivate(token)
+
+
+class ProfilingMiddleware:
+    """Lets admins capture a cProfile of one request with ``X-Profile: 1`` (or ``?profile=1``).
+
+    Services decorated with ``utils.profiling.profiled`` do the actual profiling in the thread that
+    runs them; the written profile ids come back in ``X-Profile-Id``.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        token_header = ADMIN_HEADER.encode("latin-1")
+        token = next((value.decode("latin-1") for name, value in scope["headers"] if name == token_header), None)
+        if not admin_token_valid(token):
+            await JSONResponse({"detail": "性能剖析需要有效的管理员令牌"}, status_code=403)(scope, receive, send)
+            return
+
+        profile_token = profiling.activate()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                profile_ids = profiling.captured()
+                if profile_ids:
+                    MutableHeaders(scope=message).append("X-Profile-Id", ", ".join(profile_ids))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiling.deactivate(profile_token)
+
+
+# compressing chunks this large inline would block the event loop
+_THREAD_MINIMUM_SIZE = 128 * 1024
+
+
+def accepted_encodings(scope: Scope) -> Set[str]:
+    """Content codings from ``Accept-Encoding``, without the ones refused with ``q=0``."""
+
+    accepted = set()
+    for part in Headers(scope=scope).get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        quality = params.strip().lower()
+        if coding.strip() and quality not in {"q=0", "q=0.0", "q=0.00", "q=0.000"}:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class _BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=quality)
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= _THREAD_MINIMUM_SIZE:
+            return await anyio.to_thread.run_sync(self._compress, body, more_body)
+        return self._compress(body, more_body)
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        data = self.compressor.process(body)
+        return data + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresses responses of at least ``minimum_size`` bytes, streams included.
+
+    Brotli is preferred when the client accepts it and the optional ``brotli`` package is installed;
+    otherwise gzip. Already-compressed media types (snapshots, images) are left alone.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int, gzip_level: int, brotli_quality: int) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=gzip_level)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and brotli is not None and "br" in accepted_encodings(scope):
+            await _BrotliResponder(self.app, self.minimum_size, self.brotli_quality)(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
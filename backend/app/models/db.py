@@ -1,20 +1,92 @@
-﻿from pathlib import Path
+﻿import logging
+import os
+import time
+from pathlib import Path
 
+from sqlalchemy import UniqueConstraint, event, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, SQLModel, create_engine
 
 from ..config import get_settings
+from ..utils import metrics, timing
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 settings.data_dir.mkdir(parents=True, exist_ok=True)
 db_path = settings.data_dir / "rag.db"
 engine = create_engine(f"sqlite:///{db_path}", echo=False, connect_args={"check_same_thread": False})
+# pooled SQLite connections must not be shared with forked server workers
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+
+@event.listens_for(engine, "connect")
+def _enable_incremental_vacuum(connection, _record) -> None:
+    # only takes effect on a new database; an existing one switches on its next full VACUUM
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+class InstrumentedSession(Session):
+    def __enter__(self) -> "InstrumentedSession":
+        self._opened_at = time.perf_counter()
+        metrics.DB_SESSIONS_INFLIGHT.inc()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            super().__exit__(*exc_info)
+        finally:
+            elapsed = time.perf_counter() - self._opened_at
+            metrics.DB_SESSIONS_INFLIGHT.dec()
+            metrics.DB_SESSION_LATENCY.observe(elapsed)
+            timing.record("db", elapsed)
 
 
 def init_db() -> None:
     from . import entities  # noqa: F401
 
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
+    _add_missing_unique_constraints()
+
+
+def _add_missing_columns() -> None:
+    """``create_all`` never alters existing tables; add nullable columns introduced since the DB was created."""
+
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    logger.warning("Cannot add NOT NULL column %s.%s to an existing table", table.name, column.name)
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+
+def _add_missing_unique_constraints() -> None:
+    """SQLite cannot add a constraint to an existing table; a unique index enforces the same rule."""
+
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        existing |= {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or constraint.name in existing:
+                continue
+            columns = ", ".join(f'"{column.name}"' for column in constraint.columns)
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(f'CREATE UNIQUE INDEX "{constraint.name}" ON "{table.name}" ({columns})'))
+            except IntegrityError:
+                logger.warning("Cannot add unique constraint %s: %s has duplicate rows", constraint.name, table.name)
+                continue
+            logger.info("Added unique constraint %s", constraint.name)
 
 
 def get_session() -> Session:
-    return Session(engine, expire_on_commit=False)
+    return InstrumentedSession(engine, expire_on_commit=False)
@@ -3,7 +3,7 @@
 from datetime import datetime
 from typing import Any, Optional
 
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, JSON, UniqueConstraint
 from sqlmodel import Field, SQLModel
 
 
@@ -20,6 +20,30 @@ class DocumentTask(SQLModel, table=True):
     file_path: str
 
 
+class DocumentVersion(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("task_id", "version", name="uq_documentversion_task_version"),)
+
+    version_id: str = Field(primary_key=True)
+    task_id: str = Field(index=True)
+    version: int
+    file_name: str
+    file_size: int
+    file_path: str
+    # storeId -> {"added", "removed", "unchanged"} (or {"error"}) for the stores updated in place
+    changes: dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    # "updating" while stores are patched, then "ready" or "failed"; null for rows written before it existed
+    status: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class DocumentBatch(SQLModel, table=True):
+    batch_id: str = Field(primary_key=True, index=True)
+    task_ids: list[str] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+    store_id: Optional[str] = None
+    message: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class VectorStoreRecord(SQLModel, table=True):
     store_id: str = Field(primary_key=True, index=True)
     name: str
@@ -27,6 +51,7 @@ class VectorStoreRecord(SQLModel, table=True):
     config: dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
     status: str = Field(default="building", index=True)
     failure_reason: Optional[str] = None
+    build_report: Optional[dict[str, Any]] = Field(default=None, sa_column=Column(JSON, nullable=True))
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -41,6 +66,22 @@ class VectorStoreTask(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class QaBatchJob(SQLModel, table=True):
+    job_id: str = Field(primary_key=True, index=True)
+    store_id: str = Field(index=True)
+    status: str = Field(default="queued", index=True)
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+    concurrency: int = 4
+    rate_limit: Optional[float] = None
+    # "<host>:<pid>" of the process executing the job
+    runner: Optional[str] = None
+    message: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class ChatSession(SQLModel, table=True):
     session_id: str = Field(primary_key=True, index=True)
     title: str
@@ -55,4 +96,23 @@ class ChatMessage(SQLModel, table=True):
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     citations: list[dict[str, Any]] = Field(default_factory=list, sa_column=Column(JSON, nullable=False))
+    # tokens spent producing an assistant message (see TokenUsageRecord)
+    usage: Optional[dict[str, Any]] = Field(default=None, sa_column=Column(JSON, nullable=True))
 
+
+class TokenUsageRecord(SQLModel, table=True):
+    usage_id: str = Field(primary_key=True)
+    # chat | qa_batch | build | rebuild | update
+    kind: str = Field(index=True)
+    session_id: Optional[str] = Field(default=None, index=True)
+    message_id: Optional[str] = None
+    store_id: Optional[str] = Field(default=None, index=True)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_tokens: int = 0
+    # chat counts are the local estimate rather than the provider-reported usage
+    estimated: bool = False
+    # chat counts are those of a model call another request made (CHAT_COALESCE_ANSWERS); billed once
+    coalesced: Optional[bool] = False
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
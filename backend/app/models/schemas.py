@@ -1,7 +1,7 @@
 ﻿from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -40,11 +40,54 @@ class DocumentTaskStatusResponse(BaseModel):
     updatedAt: datetime
 
 
+class StoreChunkChanges(BaseModel):
+    storeId: str
+    added: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    # new chunks not added because they repeat a chunk already in the store
+    deduplicated: int = 0
+    error: Optional[str] = None
+
+
+class DocumentVersionResponse(BaseModel):
+    taskId: str
+    version: int
+    fileName: str
+    fileSize: int
+    stores: List[StoreChunkChanges] = Field(default_factory=list)
+    # "updating" while stores are patched, "failed" when a store update failed or was interrupted
+    status: str = "ready"
+    createdAt: datetime
+
+
+class DocumentBatchResponse(BaseModel):
+    batchId: str
+    total: int
+    succeeded: int
+    failed: int
+    items: List[DocumentTaskStatusResponse]
+    vectorStoreId: Optional[str] = None
+    message: Optional[str] = None
+    createdAt: datetime
+
+
 class VectorStoreConfig(BaseModel):
     name: str
     chunkSize: int
     overlap: int
     topK: int
+    shards: int = Field(default=1, ge=1, le=64)
+    # drop chunks repeating an earlier chunk of the same document before embedding; near duplicates only
+    # when dedupDistance (or DEDUP_MAX_DISTANCE) is set
+    dedup: bool = True
+    dedupDistance: Optional[int] = Field(default=None, ge=0, le=16)
+
+
+class ShardRebuildResponse(BaseModel):
+    storeId: str
+    shard: int
+    chunks: int
 
 
 class CreateVectorStoreRequest(BaseModel):
@@ -58,6 +101,46 @@ class CreateVectorStoreResponse(BaseModel):
     statusUrl: str
 
 
+class EmbeddingBuildStats(BaseModel):
+    backend: str
+    texts: int
+    cacheHits: int
+    apiCalls: Optional[int] = None
+
+
+class TokenUsage(BaseModel):
+    promptTokens: int = 0
+    completionTokens: int = 0
+    embeddingTokens: int = 0
+    estimated: bool = False
+    # the counts are those of a model call shared with a concurrent identical request
+    coalesced: bool = False
+
+
+class DedupStats(BaseModel):
+    exact: int = 0
+    near: int = 0
+    # SimHash bit distance used for near duplicates; null when only exact duplicates are dropped
+    maxDistance: Optional[int] = None
+
+
+class BuildReport(BaseModel):
+    chunks: int
+    characters: int
+    tokens: int
+    dimension: Optional[int] = None
+    indexType: Optional[str] = None
+    shards: int = 1
+    diskBytes: int
+    memoryBytes: int
+    phases: Dict[str, float] = Field(default_factory=dict)
+    embedding: Optional[EmbeddingBuildStats] = None
+    # tokens of the initial build plus later shard rebuilds and document updates
+    usage: Optional[TokenUsage] = None
+    # chunks dropped as duplicates at build time and by later document updates
+    dedup: Optional[DedupStats] = None
+
+
 class VectorStore(BaseModel):
     id: str
     name: str
@@ -67,6 +150,7 @@ class VectorStore(BaseModel):
     createdAt: datetime
     updatedAt: datetime
     failureReason: Optional[str] = None
+    buildReport: Optional[BuildReport] = None
 
 
 class VectorStoreTaskStatusResponse(BaseModel):
@@ -84,15 +168,34 @@ class DocumentSnippet(BaseModel):
     metadata: dict[str, Any] = Field(default_factory=dict)
 
 
+class RecallFilter(BaseModel):
+    documentIds: Optional[List[str]] = None
+    pageFrom: Optional[int] = Field(default=None, ge=1)
+    pageTo: Optional[int] = Field(default=None, ge=1)
+    # substring of the chunk's nearest heading
+    section: Optional[str] = None
+    uploadedAfter: Optional[datetime] = None
+    uploadedBefore: Optional[datetime] = None
+
+
 class RecallRequest(BaseModel):
     query: str
     topK: int = 3
     withContent: bool = True
+    # documents searched after the centroid pre-selection; None = server default, 0 = flat search
+    coarseDocuments: Optional[int] = Field(default=None, ge=0)
+    filters: Optional[RecallFilter] = None
+
+
+class RequestDebug(BaseModel):
+    timings: dict[str, float] = Field(default_factory=dict)
+    notes: List[str] = Field(default_factory=list)
 
 
 class RecallResponse(BaseModel):
     storeId: str
     items: List[DocumentSnippet]
+    debug: Optional[RequestDebug] = None
 
 
 class ChatSession(BaseModel):
@@ -119,6 +222,7 @@ class ChatMessage(BaseModel):
     content: str
     timestamp: datetime
     citations: List[DocumentSnippet] = Field(default_factory=list)
+    usage: Optional[TokenUsage] = None
 
 
 class ChatSessionDetailResponse(BaseModel):
@@ -134,6 +238,70 @@ class SendChatMessageRequest(BaseModel):
 class ChatMessageResponse(BaseModel):
     sessionId: str
     message: ChatMessage
+    debug: Optional[RequestDebug] = None
+
+
+class QaBatchJobResponse(BaseModel):
+    id: str
+    storeId: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    concurrency: int
+    rateLimit: Optional[float] = None
+    message: Optional[str] = None
+    resultsUrl: str
+    createdAt: datetime
+    updatedAt: datetime
+
+
+class EmbeddingBackendStatus(BaseModel):
+    name: str
+    space: str
+    # circuit breaker state: closed (healthy), open (skipped until the next probe), half_open (probing)
+    state: str
+
+
+class UsageBucket(TokenUsage):
+    # day (YYYY-MM-DD), session id or store id; null groups usage with no session/store
+    key: Optional[str] = None
+    calls: int
+    # prompt + completion tokens of coalesced rows: the leader's row already counts that model call,
+    # so they are left out of the token sums and the cost
+    coalescedTokens: int = 0
+    cost: float
+
+
+class UsageReport(BaseModel):
+    groupBy: str
+    items: List[UsageBucket]
+    total: UsageBucket
+
+
+class MaintenanceReport(BaseModel):
+    dryRun: bool
+    sessions: int
+    messages: int
+    failedTasks: int
+    qaJobs: int
+    orphanedStores: List[str]
+    orphanedDocuments: List[str]
+    orphanedQaJobs: List[str]
+    freedFileBytes: int
+    dbBytesBefore: int
+    dbBytesAfter: int
+    dbFreePages: int
+    # "incremental", "full" or "skipped" (dry run, or auto-vacuum not enabled on this database yet)
+    vacuum: str
+    startedAt: datetime
+    durationSeconds: float
+
+
+class ProfileInfo(BaseModel):
+    name: str
+    size: int
+    createdAt: datetime
 
 
 class ErrorResponse(BaseModel):
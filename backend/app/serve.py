@@ -0,0 +1,310 @@
+"""Pre-fork multi-process server.
+
+Usage (from ``backend/``, POSIX only)::
+
+    python -m app.serve --workers 4 --port 8002 --preload-store <storeId> [--preload-all]
+
+The master imports the app, builds the chat model, embeddings and LangGraph executor and loads
+the hot vector stores, freezes the GC heap and only then forks the uvicorn workers onto one
+shared listening socket. Workers start with everything already in memory and share those pages
+copy-on-write instead of each loading its own copy.
+
+Signals sent to the master:
+
+- ``SIGHUP``: reload — re-read hot stores from disk in the master (rebuilt or newly imported
+  stores are picked up), then replace workers one at a time so the port never stops serving.
+- ``SIGTERM`` / ``SIGINT``: graceful shutdown of every worker.
+
+Once-per-deployment work (resuming interrupted batch QA jobs, the maintenance schedule) runs in
+one extra job process instead of in every worker, and ``/metrics`` on any worker reports the
+whole server: each process publishes its samples to a shared directory every
+``--metrics-interval`` seconds and scrapes merge them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import logging
+import os
+from pathlib import Path
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import uvicorn
+
+from .utils import metrics
+from .utils.logs import configure_logging, shutdown_logging
+
+logger = logging.getLogger("app.serve")
+
+_READY = b"1"
+# how often the job process looks for batch QA jobs orphaned by a stopped or replaced worker
+_RESUME_INTERVAL = 30.0
+
+
+class _ReadyServer(uvicorn.Server):
+    """uvicorn.Server that reports on a pipe once it is accepting connections."""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int) -> None:
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, _READY)
+        os.close(self.ready_fd)
+
+
+def preload_store_ids(store_ids: Sequence[str], preload_all: bool) -> List[str]:
+    from .config import get_settings
+    from .services import vector_stores
+
+    ids = [*get_settings().warmup_store_ids, *store_ids]
+    if preload_all:
+        ids += [record.store_id for record in vector_stores.list_vector_stores() if record.status == "ready"]
+    return list(dict.fromkeys(ids))
+
+
+def preload(store_ids: Sequence[str], preload_all: bool) -> None:
+    from .services.warmup import warm_up
+
+    gc.unfreeze()
+    start = time.perf_counter()
+    warm_up(models=True, store_ids=preload_store_ids(store_ids, preload_all))
+    # move everything loaded so far out of the collector's reach: GC passes would otherwise
+    # write to every object header and un-share the pages in each worker
+    gc.collect()
+    gc.freeze()
+    logger.info("Master preloaded in %.2fs (%d objects frozen)", time.perf_counter() - start, gc.get_freeze_count())
+
+
+class Master:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.app: Any = None
+        self.sock: Optional[socket.socket] = None
+        self.workers: Dict[int, int] = {}  # pid -> slot
+        self.jobs_pid: Optional[int] = None
+        self.metrics_dir = ""
+        self.retiring: set[int] = set()
+        self.reload_requested = False
+        self.stopping = False
+
+    def _spawn(self, slot: int) -> int:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # worker
+            os.close(read_fd)
+            code = 0
+            try:
+                self._run_worker(write_fd)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                self._exit(code)
+        os.close(write_fd)
+        self.workers[pid] = slot
+        ready = self._wait_ready(read_fd, self.args.ready_timeout)
+        logger.info("Worker %d (slot %d) %s", pid, slot, "ready" if ready else "did not report ready")
+        return pid
+
+    @staticmethod
+    def _exit(code: int) -> None:
+        try:
+            metrics.publish_shared()
+        finally:
+            shutdown_logging()
+            os._exit(code)
+
+    def _spawn_jobs(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_jobs()
+            except BaseException:
+                logger.exception("Job process %d crashed", os.getpid())
+                code = 1
+            finally:
+                self._exit(code)
+        self.jobs_pid = pid
+        logger.info("Job process %d started", pid)
+
+    def _run_jobs(self) -> None:
+        from .config import get_settings
+        from .main import run_startup_jobs
+        from .services import maintenance, qa_batch
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        metrics.share_across_processes(Path(self.metrics_dir), self.args.metrics_interval)
+        run_startup_jobs()
+        # jobs of replaced or crashed workers are picked up here instead of waiting for a restart
+        while not stop.wait(_RESUME_INTERVAL):
+            if get_settings().qa_batch_resume_on_startup:
+                qa_batch.resume_interrupted()
+        maintenance.stop_schedule()
+
+    def _run_worker(self, ready_fd: int) -> None:
+        # uvicorn installs its own SIGINT/SIGTERM handlers and re-raises the signal once it has shut
+        # down; exiting through _exit then publishes the final metrics. Reloads are the master's business
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: self._exit(0))
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        metrics.share_across_processes(Path(self.metrics_dir), self.args.metrics_interval)
+        config = uvicorn.Config(
+            self.app,
+            log_level=self.args.log_level.lower(),
+            # uvicorn's records (access log included) go through the root queue handler as well
+            log_config=None,
+            access_log=self.args.access_log,
+            timeout_graceful_shutdown=int(self.args.graceful_timeout),
+        )
+        _ReadyServer(config, ready_fd).run(sockets=[self.sock])
+
+    @staticmethod
+    def _wait_ready(read_fd: int, timeout: float) -> bool:
+        try:
+            readable, _, _ = select.select([read_fd], [], [], timeout)
+            return bool(readable) and os.read(read_fd, 1) == _READY
+        finally:
+            os.close(read_fd)
+
+    def _stop_worker(self, pid: int, timeout: float) -> None:
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+                time.sleep(0.05)
+            else:
+                logger.warning("Worker %d ignored SIGTERM for %.0fs, killing", pid, timeout)
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass  # already exited and reaped
+        finally:
+            self.workers.pop(pid, None)
+            self.retiring.discard(pid)
+            metrics.mark_process_dead(Path(self.metrics_dir), pid)
+
+    def _reap(self) -> None:
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            metrics.mark_process_dead(Path(self.metrics_dir), pid)
+            if pid == self.jobs_pid and not self.stopping:
+                logger.warning("Job process %d exited with status %d, restarting it", pid, status)
+                time.sleep(self.args.respawn_delay)
+                self._spawn_jobs()
+                continue
+            slot = self.workers.pop(pid, None)
+            if slot is None or pid in self.retiring or self.stopping:
+                continue
+            logger.warning("Worker %d exited with status %d, respawning slot %d", pid, status, slot)
+            time.sleep(self.args.respawn_delay)
+            self._spawn(slot)
+
+    def _reload(self) -> None:
+        logger.info("Reloading: refreshing preloaded stores, then replacing %d workers", len(self.workers))
+        preload(self.args.preload_store, self.args.preload_all)
+        for pid, slot in list(self.workers.items()):
+            self._spawn(slot)
+            self._stop_worker(pid, self.args.graceful_timeout)
+        logger.info("Reload complete")
+
+    def _on_signal(self, signum, _frame) -> None:
+        if signum == signal.SIGHUP:
+            self.reload_requested = True
+        else:
+            self.stopping = True
+
+    def run(self) -> int:
+        from .main import app
+
+        args = self.args
+        self.app = app
+        app.state.prefork = True
+        self.metrics_dir = tempfile.mkdtemp(prefix="rag-metrics-")
+        metrics.clear_shared(Path(self.metrics_dir))
+        self.sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+        self.sock.set_inheritable(True)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        preload(args.preload_store, args.preload_all)
+        logger.info(
+            "Serving on http://%s:%d with %d workers (master pid %d)", args.host, args.port, args.workers, os.getpid()
+        )
+        self._spawn_jobs()
+        for slot in range(args.workers):
+            self._spawn(slot)
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self._reload()
+            self._reap()
+            time.sleep(0.2)
+
+        logger.info("Shutting down %d workers", len(self.workers))
+        for pid in list(self.workers):
+            self._stop_worker(pid, args.graceful_timeout)
+        if self.jobs_pid is not None:
+            self._stop_worker(self.jobs_pid, args.graceful_timeout)
+        self.sock.close()
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    if not hasattr(os, "fork"):
+        print("app.serve needs os.fork(); on this platform use `uvicorn app.main:app --workers N`", file=sys.stderr)
+        return 2
+
+    from .config import get_settings
+
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Run the RAG backend with pre-forked, preloaded workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=settings.port)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--preload-store", action="append", default=[], help="store id to load before forking (repeatable)"
+    )
+    parser.add_argument("--preload-all", action="store_true", help="load every ready store before forking")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    parser.add_argument("--respawn-delay", type=float, default=1.0)
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument(
+        "--metrics-interval", type=float, default=5.0, help="seconds between each process's metrics publishes"
+    )
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_level.upper())
+    return Master(args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
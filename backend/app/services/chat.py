@@ -2,14 +2,13 @@
 
 from datetime import datetime
 import logging
-from typing import Any, Dict, List, Optional
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
 from fastapi import HTTPException
-from langchain.schema import HumanMessage, SystemMessage
-from langchain_community.chat_models import FakeListChatModel
-from langchain_core.language_models import BaseChatModel
-from langgraph.graph import END, START, StateGraph
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from sqlalchemy import delete, update
 from sqlmodel import func, select
 
 from ..config import get_settings
@@ -25,37 +24,58 @@ from ..models.schemas import (
     CreateChatSessionRequest,
     DocumentSnippet,
     RecallRequest,
+    RequestDebug,
     SendChatMessageRequest,
+    TokenUsage,
 )
-from . import vector_stores
+from ..utils import metrics, timing, tokens
+from ..utils.http_client import http_client, request_timeout
+from ..utils.lazy import Lazy
+from ..utils.logs import fingerprint
+from ..utils.profiling import profiled
+from ..utils.singleflight import SingleFlight
+from ..utils.text import estimate_tokens
+from . import usage, vector_stores
+from .llm_scheduler import CircuitOpenError, DeadlineExceeded, LLMScheduler, batch_scheduler, scheduler
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
+_answer_flight = SingleFlight("answer")
 
-try:
-    from langchain.chat_models import init_chat_model  # type: ignore
-except ImportError:  # pragma: no cover
-    init_chat_model = None  # type: ignore
-
-try:
-    from langchain_openai import ChatOpenAI
-except ImportError:  # pragma: no cover
-    ChatOpenAI = None  # type: ignore
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
 
 
 class GraphState(dict):
     question: str
+    sessionId: str
+    userMessage: ChatMessageEntity
+    history: List[Any]
     messages: List[Any]
     answer: Optional[str]
     context: str
     citations: List[DocumentSnippet]
     vectorStoreId: Optional[str]
     recallRequest: RecallRequest
+    debug: List[str]
+    batch: bool
 
 
 def build_chat_model() -> BaseChatModel:
     """Initialise chat model using DeepSeek first, fall back to OpenAI or fake model."""
 
+    from langchain_community.chat_models import FakeListChatModel
+
+    try:
+        from langchain.chat_models import init_chat_model  # type: ignore
+    except ImportError:  # pragma: no cover
+        init_chat_model = None  # type: ignore
+
+    try:
+        from langchain_openai import ChatOpenAI
+    except ImportError:  # pragma: no cover
+        ChatOpenAI = None  # type: ignore
+
     prefer_deepseek = bool(settings.deepseek_api_key) or settings.openai_base_url.startswith(
         "https://api.deepseek.com"
     )
@@ -74,7 +94,15 @@ def build_chat_model() -> BaseChatModel:
 
     if prefer_init and init_chat_model is not None:
         try:
-            kwargs: Dict[str, Any] = {"model": settings.model_name, "temperature": 0}
+            kwargs: Dict[str, Any] = {
+                "model": settings.model_name,
+                "temperature": 0,
+                "timeout": request_timeout(settings.llm_timeout_seconds),
+                # the scheduler deadline bounds each call; SDK retries would run past it
+                "max_retries": 0,
+                "http_client": http_client(),
+                "stream_usage": True,
+            }
             if base_url:
                 kwargs["base_url"] = base_url
             if prefer_deepseek:
@@ -93,6 +121,10 @@ def build_chat_model() -> BaseChatModel:
                 api_key=api_key,
                 base_url=base_url,
                 temperature=0,
+                timeout=request_timeout(settings.llm_timeout_seconds),
+                max_retries=0,
+                http_client=http_client(),
+                stream_usage=True,
             )
             logger.info("Initialised ChatOpenAI model (%s)", model.__class__.__name__)
             return model
@@ -103,18 +135,136 @@ def build_chat_model() -> BaseChatModel:
     return FakeListChatModel(responses=["我不知道"])
 
 
-chat_model = build_chat_model()
-logger.info("Chat model ready: %s", chat_model.__class__.__name__)
+def _init_chat_model() -> BaseChatModel:
+    model = build_chat_model()
+    logger.info("Chat model ready: %s", model.__class__.__name__)
+    return model
+
+
+_chat_model = Lazy(_init_chat_model)
+
+
+def get_chat_model() -> BaseChatModel:
+    return _chat_model.get()
 
 SYSTEM_PROMPT = (
     "你是企业知识库助手。若检索到参考片段，请结合它们回答；若未检索到参考资料，也可以依靠常识和经验回答。只有在确实无法回答时，才说‘我不知道’。"
 )
 
 
+def _stream_chat_model(messages: List[Any], lane: LLMScheduler = scheduler) -> Any:
+    """Stream the chat model through the scheduler so concurrency and deadlines are enforced."""
+
+    if settings.chat_coalesce_answers:
+        key = tuple((message.type, message.content) for message in messages)
+        led: List[bool] = []
+
+        def lead() -> Any:
+            led.append(True)
+            return lane.run(lambda deadline: _stream_until(messages, deadline))
+
+        response = _answer_flight.do(key, lead)
+        if not led:
+            # the leader metered the call; this answer still used those tokens, marked as shared
+            _, prompt, completion, estimated = _usage_counts(messages, response)
+            tokens.record_coalesced(prompt, completion, estimated)
+        return response
+    return lane.run(lambda deadline: _stream_until(messages, deadline))
+
+
+def _call_options(model: BaseChatModel, deadline: float) -> Dict[str, Any]:
+    """Per-call request timeout bounded by the time left until ``deadline``.
+
+    The deadline is otherwise only checked between streamed chunks, so an upstream that never sends
+    a first token would be bounded by the model's own read timeout alone.
+    """
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("chat model deadline passed before the call started")
+    if "request_timeout" not in getattr(type(model), "model_fields", {}):
+        return {}
+    return {"timeout": request_timeout(remaining)}
+
+
+def _stream_until(messages: List[Any], deadline: float) -> Any:
+    start = time.perf_counter()
+    response = None
+    outcome = "error"
+    model = get_chat_model()
+    try:
+        with metrics.LLM_INFLIGHT.track_inprogress(), timing.stage("llm_total"):
+            try:
+                for chunk in model.stream(messages, **_call_options(model, deadline)):
+                    if time.monotonic() > deadline:
+                        raise DeadlineExceeded("chat model exceeded its deadline")
+                    if response is None:
+                        first_token = time.perf_counter() - start
+                        metrics.LLM_FIRST_TOKEN_LATENCY.observe(first_token)
+                        timing.record("llm_first_token", first_token)
+                        response = chunk
+                    else:
+                        response = response + chunk
+            except DeadlineExceeded:
+                raise
+            except Exception as exc:
+                # the request timeout fired because the deadline ran out
+                if time.monotonic() >= deadline:
+                    raise DeadlineExceeded("chat model exceeded its deadline") from exc
+                raise
+        outcome = "ok"
+    finally:
+        metrics.LLM_LATENCY.observe(time.perf_counter() - start, outcome=outcome)
+    _record_usage(messages, response)
+    return response
+
+
+def _usage_counts(messages: List[Any], response: Any) -> Tuple[str, int, int, bool]:
+    """Model name, prompt and completion tokens of a call: provider-reported when the stream carried them,
+    else a local estimate (flagged by the last item)."""
+
+    model = get_chat_model()
+    name = getattr(model, "model_name", None) or model.__class__.__name__
+    reported = getattr(response, "usage_metadata", None)
+    if reported:
+        return name, reported.get("input_tokens", 0), reported.get("output_tokens", 0), False
+    prompt = sum(estimate_tokens(str(message.content)) for message in messages)
+    completion = estimate_tokens(str(getattr(response, "content", response) or ""))
+    return name, prompt, completion, True
+
+
+def _record_usage(messages: List[Any], response: Any) -> None:
+    name, prompt, completion, estimated = _usage_counts(messages, response)
+    tokens.record_chat(name, prompt, completion, estimated=estimated)
+
+
 def _build_graph():
+    from langgraph.graph import END, START, StateGraph
+
     workflow = StateGraph(GraphState)
 
-    def ingest(state: GraphState) -> GraphState:
+    # without a sessionId (offline batch answering) nothing is persisted and there is no history
+    def persist_user(state: GraphState) -> Dict[str, Any]:
+        with metrics.GRAPH_NODE_LATENCY.time(node="persist_user"):
+            if state.get("sessionId"):
+                _persist_user_message(state["sessionId"], state["userMessage"])
+            return {}
+
+    def history(state: GraphState) -> Dict[str, Any]:
+        with metrics.GRAPH_NODE_LATENCY.time(node="history"):
+            if not state.get("sessionId"):
+                return {"history": []}
+            return {"history": _load_history(state["sessionId"], state["userMessage"].message_id)}
+
+    def ingest(state: GraphState) -> Dict[str, Any]:
+        with metrics.GRAPH_NODE_LATENCY.time(node="ingest"):
+            return _ingest(state)
+
+    def respond(state: GraphState) -> Dict[str, Any]:
+        with metrics.GRAPH_NODE_LATENCY.time(node="respond"):
+            return _respond(state)
+
+    def _ingest(state: GraphState) -> Dict[str, Any]:
         store_id = state.get("vectorStoreId")
         citations: List[DocumentSnippet] = []
         context = ""
@@ -122,49 +272,60 @@ def _build_graph():
             recall_resp = vector_stores.recall(store_id, state["recallRequest"])
             citations = recall_resp.items
             context = "\n\n".join(item.content for item in citations)
-        state["citations"] = citations
-        state["context"] = context
-        return state
+        return {"citations": citations, "context": context}
 
-    def respond(state: GraphState) -> Dict[str, Any]:
+    def _respond(state: GraphState) -> Dict[str, Any]:
         context = state.get("context", "")
         question = state["question"]
         citations = state.get("citations", [])
         debug_parts: List[str] = [
-            f"model={chat_model.__class__.__name__}",
+            f"model={get_chat_model().__class__.__name__}",
             f"citations={len(citations)}",
             "context=present" if context else "context=missing",
+            f"history={len(state.get('history') or [])}",
         ]
-        if context:
-            user_prompt = "".join(
-                [
-                    f"问题：{question}\n\n",
-                    f"参考资料：\n{context}\n\n",
-                    "请结合参考资料，用中文回答用户问题。如参考资料不足，可以补充常识性的说明。",
-                ]
-            )
-        else:
-            user_prompt = "".join(
-                [
-                    f"用户问题：{question}\n",
-                    "没有检索到参考资料，请依靠通用知识以中文回答用户，注意保持礼貌和准确。",
-                ]
-            )
+        with timing.stage("prompt_build"):
+            if context:
+                user_prompt = "".join(
+                    [
+                        f"问题：{question}\n\n",
+                        f"参考资料：\n{context}\n\n",
+                        "请结合参考资料，用中文回答用户问题。如参考资料不足，可以补充常识性的说明。",
+                    ]
+                )
+            else:
+                user_prompt = "".join(
+                    [
+                        f"用户问题：{question}\n",
+                        "没有检索到参考资料，请依靠通用知识以中文回答用户，注意保持礼貌和准确。",
+                    ]
+                )
         try:
-            response = chat_model.invoke(
+            response = _stream_chat_model(
                 [
                     SystemMessage(content=SYSTEM_PROMPT),
+                    *(state.get("history") or []),
                     HumanMessage(content=user_prompt),
-                ]
+                ],
+                batch_scheduler if state.get("batch") else scheduler,
             )
             content = getattr(response, "content", response) or "我不知道"
             debug_parts.append("invoke=success")
+        except HTTPException:
+            raise
+        except DeadlineExceeded as exc:
+            logger.warning("Chat model timed out: %s", exc)
+            raise HTTPException(status_code=503, detail="模型响应超时，请稍后重试") from exc
+        except CircuitOpenError as exc:
+            logger.warning("Chat model skipped: %s", exc)
+            content = "调用大模型失败，请检查模型名称、密钥或代理配置。"
+            debug_parts.append("invoke=circuit_open")
         except Exception as exc:  # pragma: no cover - defensive fallback
             logger.exception("Chat model invocation failed: %s", exc)
             content = "调用大模型失败，请检查模型名称、密钥或代理配置。"
             debug_parts.append(f"invoke=error:{exc}")
         else:
-            logger.info("Chat answer generated | question=%s | citations=%s", question, len(citations))
+            logger.info("Chat answer generated | question=%s | citations=%s", fingerprint(question), len(citations))
             if content.strip() in {"我不知道", "不知道"}:
                 debug_parts.append("answer=unknown")
                 if context:
@@ -175,20 +336,79 @@ def _build_graph():
                 debug_parts.append("answer=ok")
         debug_line = "[debug " + " | ".join(debug_parts) + "]"
         logger.debug("Chat respond stats %s", debug_line)
-        answer_text = content
-        state["answer"] = answer_text
-        state["citations"] = citations
-        return state
+        return {"answer": content, "debug": debug_parts}
 
+    # persisting the question, loading history and retrieval are independent: they run as parallel
+    # branches of one superstep and respond waits for all three
+    workflow.add_node("persist_user", persist_user)
+    workflow.add_node("history", history)
     workflow.add_node("ingest", ingest)
     workflow.add_node("respond", respond)
-    workflow.add_edge(START, "ingest")
-    workflow.add_edge("ingest", "respond")
+    for branch in ("persist_user", "history", "ingest"):
+        workflow.add_edge(START, branch)
+    workflow.add_edge(["persist_user", "history", "ingest"], "respond")
     workflow.add_edge("respond", END)
     return workflow.compile()
 
 
-rag_executor = _build_graph()
+_rag_executor = Lazy(_build_graph)
+
+
+def get_rag_executor():
+    return _rag_executor.get()
+
+
+def __getattr__(name: str) -> Any:
+    # ``chat.chat_model`` / ``chat.rag_executor`` used to be eager module globals
+    if name == "chat_model":
+        return get_chat_model()
+    if name == "rag_executor":
+        return get_rag_executor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _persist_user_message(session_id: str, message: ChatMessageEntity) -> None:
+    with timing.stage("persist_user"), get_session() as session:
+        if not session.get(ChatSessionEntity, session_id):
+            raise HTTPException(status_code=404, detail="Session not found")
+        session.add(message)
+        session.commit()
+
+
+def _load_history(session_id: str, exclude_message_id: str) -> List[Any]:
+    if settings.chat_history_messages <= 0:
+        return []
+    with timing.stage("history"), get_session() as session:
+        rows = session.exec(
+            select(ChatMessageEntity)
+            .where(ChatMessageEntity.session_id == session_id, ChatMessageEntity.message_id != exclude_message_id)
+            .order_by(ChatMessageEntity.timestamp.desc())
+            .limit(settings.chat_history_messages)
+        ).all()
+    return [
+        HumanMessage(content=row.content) if row.role == "user" else AIMessage(content=row.content)
+        for row in reversed(rows)
+    ]
+
+
+def _persist_answer(session_id: str, message: ChatMessageEntity, store_id: Optional[str] = None) -> None:
+    with get_session() as session:
+        # the graph may still have been running when delete_session waited for pending writes
+        if session.get(ChatSessionEntity, session_id) is None:
+            logger.info("Session %s deleted before its answer was written; dropping it", session_id)
+            return
+        session.add(message)
+        session.add(
+            usage.usage_record(
+                "chat", message.usage or {}, session_id=session_id, message_id=message.message_id, store_id=store_id
+            )
+        )
+        session.exec(
+            update(ChatSessionEntity)
+            .where(ChatSessionEntity.session_id == session_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        session.commit()
 
 
 def _map_session(entity: ChatSessionEntity) -> ChatSession:
@@ -230,9 +450,7 @@ def delete_session(session_id: str) -> None:
         entity = session.exec(select(ChatSessionEntity).where(ChatSessionEntity.session_id == session_id)).first()
         if not entity:
             raise HTTPException(status_code=404, detail="Session not found")
-        messages = session.exec(select(ChatMessageEntity).where(ChatMessageEntity.session_id == session_id)).all()
-        for msg in messages:
-            session.delete(msg)
+        session.exec(delete(ChatMessageEntity).where(ChatMessageEntity.session_id == session_id))
         session.delete(entity)
         session.commit()
 
@@ -254,40 +472,42 @@ def get_session_detail(session_id: str) -> ChatSessionDetailResponse:
             content=m.content,
             timestamp=m.timestamp,
             citations=[DocumentSnippet(**c) for c in m.citations],
+            usage=m.usage,
         )
         for m in message_entities
     ]
     return ChatSessionDetailResponse(session=_map_session(entity), messages=messages)
 
 
+@profiled("send_message")
 def send_message(session_id: str, payload: SendChatMessageRequest) -> ChatMessageResponse:
-    with get_session() as session:
-        session_entity = session.exec(select(ChatSessionEntity).where(ChatSessionEntity.session_id == session_id)).first()
-        if not session_entity:
-            raise HTTPException(status_code=404, detail="Session not found")
-        user_msg = ChatMessageEntity(
-            message_id=uuid4().hex,
-            session_id=session_id,
-            role="user",
-            content=payload.message,
-            timestamp=datetime.utcnow(),
-            citations=[],
-        )
-        session.add(user_msg)
-        session.commit()
-
-    recall_request = RecallRequest(query=payload.message, topK=3, withContent=True)
-    result = rag_executor.invoke(
-        {
-            "question": payload.message,
-            "messages": [HumanMessage(content=payload.message)],
-            "vectorStoreId": payload.vectorStoreId,
-            "recallRequest": recall_request,
-            "session_id": session_id,
-        }
+    user_msg = ChatMessageEntity(
+        message_id=uuid4().hex,
+        session_id=session_id,
+        role="user",
+        content=payload.message,
+        timestamp=datetime.utcnow(),
+        citations=[],
     )
-    logger.info("RAG graph output: %r", result)
+    recall_request = RecallRequest(query=payload.message, topK=3, withContent=True)
+    with tokens.metering() as used:
+        result = get_rag_executor().invoke(
+            {
+                "question": payload.message,
+                "sessionId": session_id,
+                "userMessage": user_msg,
+                "messages": [HumanMessage(content=payload.message)],
+                "vectorStoreId": payload.vectorStoreId,
+                "recallRequest": recall_request,
+            }
+        )
     answer = result.get("answer")
+    logger.info(
+        "RAG graph done | session=%s | answer=%s chars | citations=%d",
+        session_id,
+        len(answer) if isinstance(answer, str) else None,
+        len(result.get("citations", [])),
+    )
     if not isinstance(answer, str) or not answer.strip():
         logger.error("Graph output missing usable 'answer': %r", result)
         answer = "[GraphMissingAnswer] 模型没有返回内容"
@@ -300,14 +520,12 @@ def send_message(session_id: str, payload: SendChatMessageRequest) -> ChatMessag
         content=answer,
         timestamp=datetime.utcnow(),
         citations=[c.model_dump() for c in citations],
+        usage=used.as_dict(),
     )
-    with get_session() as session:
-        session.add(assistant_entity)
-        session.exec(select(ChatSessionEntity).where(ChatSessionEntity.session_id == session_id)).first()
-        session_entity = session.get(ChatSessionEntity, session_id)
-        if session_entity:
-            session_entity.updated_at = datetime.utcnow()
-        session.commit()
+    # written before responding, so any worker serving the next request sees it and a crash cannot lose
+    # an answer the client already has
+    with timing.stage("persist_answer"):
+        _persist_answer(session_id, assistant_entity, payload.vectorStoreId)
 
     return ChatMessageResponse(
         sessionId=session_id,
@@ -317,5 +535,14 @@ def send_message(session_id: str, payload: SendChatMessageRequest) -> ChatMessag
             content=assistant_entity.content,
             timestamp=assistant_entity.timestamp,
             citations=citations,
+            usage=TokenUsage(**assistant_entity.usage),
         ),
+        debug=_request_debug(result.get("debug")),
     )
+
+
+def _request_debug(notes: Optional[List[str]] = None) -> Optional[RequestDebug]:
+    timings = timing.current()
+    if timings is None:
+        return None
+    return RequestDebug(timings=timings.as_dict(), notes=notes or [])
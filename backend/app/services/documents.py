@@ -1,24 +1,35 @@
 ﻿from __future__ import annotations
 
+from concurrent.futures import Executor, ProcessPoolExecutor
 import mimetypes
-from pathlib import Path
-from typing import List, Tuple
+import multiprocessing
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import tarfile
+import threading
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
 from uuid import uuid4
+import zipfile
 
 from fastapi import HTTPException, UploadFile, Response
 from sqlmodel import select
 
 from ..config import get_settings
 from ..models.db import get_session
-from ..models.entities import DocumentTask
-from ..models.schemas import DocumentTaskStatusResponse, DocumentValidation, ValidationRule
+from ..models.entities import DocumentBatch, DocumentTask
+from ..models.schemas import DocumentBatchResponse, DocumentTaskStatusResponse, DocumentValidation, ValidationRule
 from ..storage.file_storage import save_upload_file
-from ..utils.text import extract_text
+from ..utils.profiling import profiled
+from ..utils.text import TextSegment, check_content, extract_segments
 
 settings = get_settings()
 
+_ingest_pool: Optional[Executor] = None
+_ingest_pool_lock = threading.Lock()
 
-def _validate_file(upload_file: UploadFile) -> Tuple[List[ValidationRule], int]:
+
+def validate_file(upload_file: UploadFile) -> Tuple[List[ValidationRule], int]:
     rules: List[ValidationRule] = []
     filename = upload_file.filename or ""
     extension = Path(filename).suffix.lower()
@@ -37,26 +48,7 @@ def _validate_file(upload_file: UploadFile) -> Tuple[List[ValidationRule], int]:
             with temp_path.open("wb") as f:
                 f.write(upload_file.file.read())
             upload_file.file.seek(0)
-            try:
-                text = extract_text(temp_path)
-            except Exception as exc:
-                rules.append(
-                    ValidationRule(
-                        rule="content_parse",
-                        passed=False,
-                        detail=str(exc),
-                    )
-                )
-                content_ok = False
-            else:
-                content_ok = len(text.strip()) >= settings.min_document_length
-                rules.append(
-                    ValidationRule(
-                        rule="content_length",
-                        passed=content_ok,
-                        detail=f">= {settings.min_document_length} characters",
-                    )
-                )
+            rules.append(ValidationRule(**check_content(temp_path, settings.min_document_length)))
         finally:
             if temp_path.exists():
                 temp_path.unlink()
@@ -72,9 +64,10 @@ def _validate_file(upload_file: UploadFile) -> Tuple[List[ValidationRule], int]:
     return rules, size
 
 
+@profiled("upload")
 def create_document_task(upload_file: UploadFile) -> DocumentTaskStatusResponse:
     filename = upload_file.filename or "uploaded"
-    rules, size = _validate_file(upload_file)
+    rules, size = validate_file(upload_file)
     passed = all(rule.passed for rule in rules)
 
     task_id = uuid4().hex
@@ -86,16 +79,7 @@ def create_document_task(upload_file: UploadFile) -> DocumentTaskStatusResponse:
         upload_file.file.seek(0)
 
     with get_session() as session:
-        task = DocumentTask(
-            task_id=task_id,
-            file_name=filename,
-            file_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
-            file_size=size,
-            status="success" if passed else "failed",
-            validation={"passed": passed, "rules": [rule.dict() for rule in rules]},
-            message=None if passed else "文档校验未通过",
-            file_path=file_path_str,
-        )
+        task = _new_task(task_id, filename, size, rules, file_path_str)
         session.add(task)
         session.commit()
         session.refresh(task)
@@ -111,6 +95,208 @@ def create_document_task(upload_file: UploadFile) -> DocumentTaskStatusResponse:
     return map_task_to_schema(task)
 
 
+def _new_task(task_id: str, filename: str, size: int, rules: List[ValidationRule], file_path: str) -> DocumentTask:
+    passed = all(rule.passed for rule in rules)
+    return DocumentTask(
+        task_id=task_id,
+        file_name=filename,
+        file_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        file_size=size,
+        status="success" if passed else "failed",
+        validation={"passed": passed, "rules": [rule.dict() for rule in rules]},
+        message=None if passed else "文档校验未通过",
+        file_path=file_path,
+    )
+
+
+class _StagedFile(NamedTuple):
+    name: str
+    path: Path
+    size: int
+
+
+def _get_ingest_pool() -> Executor:
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            workers = settings.ingest_workers or min(4, os.cpu_count() or 1)
+            _ingest_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _ingest_pool
+
+
+def _forget_ingest_pool() -> None:
+    global _ingest_pool
+    _ingest_pool = None
+
+
+# pool processes belong to the parent; a forked server worker starts its own on demand
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_ingest_pool)
+
+
+def _archive_kind(filename: str) -> Optional[str]:
+    lower = filename.lower()
+    if lower.endswith(".zip"):
+        return "zip"
+    if lower.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    return None
+
+
+def _skip_member(member_name: str) -> bool:
+    path = PurePosixPath(member_name)
+    return path.parts[:1] == ("__MACOSX",) or path.name.startswith(".")
+
+
+def _stage_stream(stream: BinaryIO, staging_dir: Path, index: int, name: str) -> _StagedFile:
+    """Copy at most ``max_file_size_mb`` + 1 bytes so oversized members fail the size rule cheaply."""
+
+    limit = settings.max_file_size_mb * 1024 * 1024 + 1
+    target = staging_dir / f"{index}{Path(name).suffix.lower()}"
+    size = 0
+    with target.open("wb") as buffer:
+        while size < limit:
+            chunk = stream.read(min(1024 * 1024, limit - size))
+            if not chunk:
+                break
+            buffer.write(chunk)
+            size += len(chunk)
+    return _StagedFile(name, target, size)
+
+
+def _stage_uploads(files: List[UploadFile], staging_dir: Path) -> List[_StagedFile]:
+    staged: List[_StagedFile] = []
+
+    def add(stream: BinaryIO, name: str) -> None:
+        if len(staged) >= settings.bulk_max_files:
+            raise HTTPException(status_code=413, detail=f"单批最多 {settings.bulk_max_files} 个文件")
+        staged.append(_stage_stream(stream, staging_dir, len(staged), name))
+
+    for upload_file in files:
+        filename = upload_file.filename or "uploaded"
+        kind = _archive_kind(filename)
+        upload_file.file.seek(0)
+        try:
+            if kind == "zip":
+                with zipfile.ZipFile(upload_file.file) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or _skip_member(member.filename):
+                            continue
+                        with archive.open(member) as stream:
+                            add(stream, PurePosixPath(member.filename).name)
+            elif kind == "tar":
+                with tarfile.open(fileobj=upload_file.file, mode="r|*") as archive:
+                    for member in archive:
+                        if not member.isfile() or _skip_member(member.name):
+                            continue
+                        stream = archive.extractfile(member)
+                        if stream is not None:
+                            add(stream, PurePosixPath(member.name).name)
+            else:
+                add(upload_file.file, filename)
+        except (zipfile.BadZipFile, tarfile.TarError) as exc:
+            raise HTTPException(status_code=400, detail=f"无法解析压缩包 {filename}: {exc}") from exc
+    return staged
+
+
+def _validate_staged(staged: List[_StagedFile]) -> List[List[ValidationRule]]:
+    """Cheap checks inline; text extraction for eligible files fans out to the ingest process pool."""
+
+    rule_sets: List[List[ValidationRule]] = []
+    pending = {}
+    for index, item in enumerate(staged):
+        extension = Path(item.name).suffix.lower()
+        allowed = extension in settings.allowed_extensions
+        size_ok = item.size <= settings.max_file_size_mb * 1024 * 1024
+        rules = [
+            ValidationRule(rule="extension", passed=allowed, detail=f"allowed: {settings.allowed_extensions}"),
+            ValidationRule(rule="size", passed=size_ok, detail=f"<= {settings.max_file_size_mb}MB"),
+        ]
+        if allowed and size_ok:
+            pending[index] = item
+        else:
+            rules.append(
+                ValidationRule(rule="content_length", passed=False, detail="skipped due to previous failure")
+            )
+        rule_sets.append(rules)
+
+    if pending:
+        pool = _get_ingest_pool()
+        futures = {
+            index: pool.submit(check_content, str(item.path), settings.min_document_length)
+            for index, item in pending.items()
+        }
+        for index, future in futures.items():
+            rule_sets[index].append(ValidationRule(**future.result()))
+    return rule_sets
+
+
+@profiled("upload_batch")
+def create_document_batch(files: List[UploadFile]) -> DocumentBatchResponse:
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+
+    batch_id = uuid4().hex
+    staging_dir = settings.document_dir / f"_batch_{batch_id}"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    tasks: List[DocumentTask] = []
+    try:
+        staged = _stage_uploads(files, staging_dir)
+        for item, rules in zip(staged, _validate_staged(staged)):
+            task_id = uuid4().hex
+            file_path_str = ""
+            if all(rule.passed for rule in rules):
+                target = settings.document_dir / f"{task_id}{Path(item.name).suffix}"
+                item.path.replace(target)
+                file_path_str = str(target)
+            tasks.append(_new_task(task_id, item.name, item.size, rules, file_path_str))
+
+        batch = DocumentBatch(batch_id=batch_id, task_ids=[task.task_id for task in tasks])
+        with get_session() as session:
+            session.add_all(tasks)
+            session.add(batch)
+            session.commit()
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    return _map_batch(batch, tasks)
+
+
+def attach_batch_store(batch_id: str, store_id: Optional[str], message: Optional[str] = None) -> DocumentBatchResponse:
+    with get_session() as session:
+        batch = session.get(DocumentBatch, batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="Document batch not found")
+        batch.store_id = store_id
+        batch.message = message
+        session.add(batch)
+        session.commit()
+    return get_document_batch(batch_id)
+
+
+def get_document_batch(batch_id: str) -> DocumentBatchResponse:
+    with get_session() as session:
+        batch = session.get(DocumentBatch, batch_id)
+        if not batch:
+            raise HTTPException(status_code=404, detail="Document batch not found")
+        tasks = session.exec(select(DocumentTask).where(DocumentTask.task_id.in_(batch.task_ids))).all()
+    order = {task_id: index for index, task_id in enumerate(batch.task_ids)}
+    return _map_batch(batch, sorted(tasks, key=lambda task: order[task.task_id]))
+
+
+def _map_batch(batch: DocumentBatch, tasks: List[DocumentTask]) -> DocumentBatchResponse:
+    succeeded = sum(1 for task in tasks if task.status == "success")
+    return DocumentBatchResponse(
+        batchId=batch.batch_id,
+        total=len(tasks),
+        succeeded=succeeded,
+        failed=len(tasks) - succeeded,
+        items=[map_task_to_schema(task) for task in tasks],
+        vectorStoreId=batch.store_id,
+        message=batch.message,
+        createdAt=batch.created_at,
+    )
+
+
 def map_task_to_schema(task: DocumentTask) -> DocumentTaskStatusResponse:
     validation = DocumentValidation(
         passed=bool(task.validation.get("passed")),
@@ -137,14 +323,10 @@ def get_document_task(task_id: str) -> DocumentTaskStatusResponse:
         return map_task_to_schema(task)
 
 
-def get_document_text(task: DocumentTask) -> str:
+def get_document_segments(task: DocumentTask) -> List[TextSegment]:
     if not task.file_path:
         raise HTTPException(status_code=400, detail="Document not available")
     path = Path(task.file_path)
     if not path.exists():
         raise HTTPException(status_code=404, detail="Document file missing")
-    return extract_text(path)
-
-
-
-
+    return extract_segments(path)
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from langchain_core.embeddings import Embeddings
+
+from ..config import get_settings
+from ..utils import metrics, tokens
+from ..utils.http_client import http_client, request_timeout
+from ..utils.singleflight import SingleFlight
+from .llm_scheduler import CircuitBreaker, CircuitOpenError
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_query_flight = SingleFlight("embed_query")
+
+
+class FallbackEmbeddings(Embeddings):
+    """Deterministic embeddings when real embedding services are unavailable."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:  # type: ignore[override]
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:  # type: ignore[override]
+        return [float(len(text) % 97), float(hash(text) % 101), float(len(text.split()))]
+
+
+class EmbeddingUnavailable(RuntimeError):
+    """Raised when no healthy backend can embed into the requested vector space."""
+
+
+def embedding_space(embeddings: Embeddings) -> str:
+    """Vectors are comparable only between embedders of the same provider class and model."""
+
+    model = getattr(embeddings, "model", None)
+    return f"{type(embeddings).__name__}/{model}" if model else type(embeddings).__name__
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Delegating wrapper that records latency and volume of embedding calls."""
+
+    def __init__(self, inner: Embeddings, backend: str, space: Optional[str] = None) -> None:
+        self.inner = inner
+        self.backend = backend
+        self.space = space or embedding_space(inner)
+
+    def _observe(self, operation: str, texts: List[str], call: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        outcome = "error"
+        metrics.EMBEDDING_INFLIGHT.inc()
+        try:
+            result = call()
+            outcome = "ok"
+            tokens.record_embedding(self.backend, texts)
+            return result
+        finally:
+            metrics.EMBEDDING_INFLIGHT.dec()
+            metrics.EMBEDDING_LATENCY.observe(
+                time.perf_counter() - start, backend=self.backend, operation=operation, outcome=outcome
+            )
+            metrics.EMBEDDING_TEXTS.inc(len(texts), backend=self.backend, operation=operation)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:  # type: ignore[override]
+        return self._observe("documents", texts, lambda: self.inner.embed_documents(texts))
+
+    def request_count(self, texts: int) -> int:
+        """Upstream requests ``embed_documents`` makes for this many texts; 0 for local embeddings."""
+
+        if not texts or isinstance(self.inner, FallbackEmbeddings):
+            return 0
+        batch = getattr(self.inner, "chunk_size", None) or texts
+        return -(-texts // batch)
+
+    def embed_query(self, text: str) -> List[float]:  # type: ignore[override]
+        return _query_flight.do(
+            (id(self.inner), text), lambda: self._observe("query", [text], lambda: self.inner.embed_query(text))
+        )
+
+
+class EmbeddingRouter:
+    """Sends each call to the first healthy backend of the requested vector space, in priority order.
+
+    Every backend has its own circuit breaker: failing backends are skipped without being called
+    until their cooldown ends, then a single probe call decides whether they rejoin.
+    """
+
+    def __init__(self, backends: Sequence[InstrumentedEmbeddings]) -> None:
+        self.backends = list(backends)
+        self._breakers = {
+            backend.backend: CircuitBreaker(
+                failure_ratio=settings.embed_breaker_failure_ratio,
+                window=settings.embed_breaker_window,
+                min_calls=settings.embed_breaker_min_calls,
+                cooldown_seconds=settings.embed_breaker_cooldown_seconds,
+                name=f"embedding backend {backend.backend}",
+                report=lambda value, name=backend.backend: metrics.EMBEDDING_BACKEND_STATE.set(value, backend=name),
+            )
+            for backend in self.backends
+        }
+        self._routed: Dict[str, RoutedEmbeddings] = {}
+        self._lock = threading.Lock()
+
+    def spaces(self) -> List[str]:
+        """Vector spaces in the priority order of their best backend."""
+
+        return list(dict.fromkeys(backend.space for backend in self.backends))
+
+    def space_of(self, name: str) -> Optional[str]:
+        return next((backend.space for backend in self.backends if backend.backend == name), None)
+
+    def embeddings(self, space: str) -> "RoutedEmbeddings":
+        with self._lock:
+            routed = self._routed.get(space)
+            if routed is None:
+                routed = self._routed[space] = RoutedEmbeddings(self, space)
+            return routed
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": backend.backend, "space": backend.space, "state": self._breakers[backend.backend].state}
+            for backend in self.backends
+        ]
+
+    def call(self, space: str, operation: Callable[[InstrumentedEmbeddings], T]) -> T:
+        errors: List[str] = []
+        for backend in self.backends:
+            if backend.space != space:
+                continue
+            breaker = self._breakers[backend.backend]
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                metrics.EMBEDDING_FAILOVERS.inc(backend=backend.backend, reason="unhealthy")
+                errors.append(f"{backend.backend}: unhealthy")
+                continue
+            try:
+                result = operation(backend)
+            except Exception as exc:
+                breaker.record(False)
+                metrics.EMBEDDING_FAILOVERS.inc(backend=backend.backend, reason="error")
+                logger.warning("Embedding backend %s failed: %s", backend.backend, exc)
+                errors.append(f"{backend.backend}: {exc}")
+                continue
+            breaker.record(True)
+            return result
+        raise EmbeddingUnavailable(f"{space} ({'; '.join(errors) or 'no backend configured'})")
+
+
+class RoutedEmbeddings(Embeddings):
+    """Embeddings bound to one vector space; what stores are built and queried with."""
+
+    def __init__(self, router: EmbeddingRouter, space: str) -> None:
+        self.router = router
+        self.space = space
+
+    @property
+    def backend(self) -> str:
+        """Name of the space's highest-priority backend, recorded on stores built in this space."""
+
+        return next((backend.backend for backend in self.router.backends if backend.space == self.space), "none")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:  # type: ignore[override]
+        return self.router.call(self.space, lambda backend: backend.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:  # type: ignore[override]
+        return self.router.call(self.space, lambda backend: backend.embed_query(text))
+
+    def request_count(self, texts: int) -> int:
+        backend = next((backend for backend in self.router.backends if backend.space == self.space), None)
+        return backend.request_count(texts) if backend else 0
+
+
+def _resolve_embed_base_url() -> str:
+    if settings.embed_base_url:
+        return settings.embed_base_url
+    if settings.openai_base_url and settings.openai_base_url != "https://api.deepseek.com/v1":
+        return settings.openai_base_url
+    return "https://api.openai.com/v1"
+
+
+def build_embeddings() -> Embeddings:
+    try:
+        api_key = settings.embed_api_key or settings.openai_api_key or settings.deepseek_api_key
+        if not api_key or api_key == "test-key":
+            raise ValueError("missing api key")
+
+        from langchain_openai import OpenAIEmbeddings
+
+        base_url = _resolve_embed_base_url()
+        logger.info("Using embedding backend %s", base_url)
+        return OpenAIEmbeddings(
+            api_key=api_key,
+            base_url=base_url,
+            model=settings.embed_model,
+            http_client=http_client(),
+            timeout=request_timeout(),
+        )
+    except Exception as exc:
+        logger.warning("Falling back to deterministic embeddings: %s", exc)
+        return FallbackEmbeddings()
+
+
+def _configured_embeddings(spec: Dict[str, Any]) -> Embeddings:
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(
+        api_key=spec.get("apiKey") or settings.embed_api_key or settings.openai_api_key,
+        base_url=spec.get("baseUrl") or _resolve_embed_base_url(),
+        model=spec.get("model") or settings.embed_model,
+        http_client=http_client(),
+        timeout=request_timeout(),
+    )
+
+
+def build_backends() -> List[InstrumentedEmbeddings]:
+    """Embedding backends in priority order: ``EMBED_BACKENDS`` (or the default one), then the local one."""
+
+    specs = settings.embed_backends
+    if specs:
+        backends = [
+            InstrumentedEmbeddings(_configured_embeddings(spec), spec["name"], spec.get("space")) for spec in specs
+        ]
+    else:
+        backends = [InstrumentedEmbeddings(build_embeddings(), "default")]
+    backends.append(InstrumentedEmbeddings(FallbackEmbeddings(), "fallback"))
+    return backends
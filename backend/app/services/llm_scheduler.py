@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from collections import deque
+import logging
+import threading
+import time
+from typing import Callable, Deque, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from ..config import get_settings
+from ..utils import metrics
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the upstream service while the breaker is open."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a model call runs past its per-request deadline."""
+
+
+class CircuitBreaker:
+    """Error-rate breaker over a rolling window of recent call outcomes.
+
+    ``report`` receives the numeric state on every transition (defaults to the chat model gauge).
+    """
+
+    def __init__(
+        self,
+        failure_ratio: float,
+        window: int,
+        min_calls: int,
+        cooldown_seconds: float,
+        name: str = "chat model",
+        report: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.name = name
+        self._report = report or metrics.LLM_BREAKER_STATE.set
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._report(_STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        if state != self._state:
+            logger.warning("%s circuit breaker %s -> %s", self.name, self._state, state)
+        self._state = state
+        self._report(_STATE_VALUES[state])
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                    raise CircuitOpenError(f"{self.name} circuit breaker is open")
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(f"{self.name} circuit breaker is probing")
+                self._probe_in_flight = True
+
+    def cancel_probe(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                if success:
+                    self._transition(CLOSED)
+                else:
+                    self._opened_at = time.monotonic()
+                    self._transition(OPEN)
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+                self._opened_at = time.monotonic()
+                self._outcomes.clear()
+                self._transition(OPEN)
+
+
+class LLMScheduler:
+    """Caps concurrent upstream model calls behind a bounded wait queue with per-request deadlines."""
+
+    def __init__(
+        self, max_in_flight: int, max_queue: int, timeout_seconds: float, breaker: CircuitBreaker, lane: str = "chat"
+    ) -> None:
+        self.lane = lane
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout_seconds = timeout_seconds
+        self.breaker = breaker
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+
+    @classmethod
+    def from_settings(cls) -> "LLMScheduler":
+        breaker = CircuitBreaker(
+            failure_ratio=settings.llm_breaker_failure_ratio,
+            window=settings.llm_breaker_window,
+            min_calls=settings.llm_breaker_min_calls,
+            cooldown_seconds=settings.llm_breaker_cooldown_seconds,
+        )
+        return cls(settings.llm_max_in_flight, settings.llm_max_queue, settings.llm_timeout_seconds, breaker)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    def _acquire(self, deadline: float) -> None:
+        with self._cond:
+            if self._in_flight >= self.max_in_flight or self._waiting:
+                if self._waiting >= self.max_queue:
+                    metrics.LLM_SCHEDULER_REJECTIONS.inc(lane=self.lane, reason="queue_full")
+                    raise HTTPException(status_code=429, detail="模型请求排队已满，请稍后重试")
+                self._waiting += 1
+                metrics.LLM_QUEUE_DEPTH.set(self._waiting, lane=self.lane)
+                try:
+                    while self._in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            metrics.LLM_SCHEDULER_REJECTIONS.inc(lane=self.lane, reason="deadline")
+                            raise HTTPException(status_code=503, detail="模型请求排队超时，请稍后重试")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                    metrics.LLM_QUEUE_DEPTH.set(self._waiting, lane=self.lane)
+            self._in_flight += 1
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def run(self, call: Callable[[float], T], timeout_seconds: Optional[float] = None) -> T:
+        """Run ``call(deadline)`` once a slot is free; ``deadline`` is a ``time.monotonic()`` value."""
+
+        deadline = time.monotonic() + (timeout_seconds or self.timeout_seconds)
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            metrics.LLM_SCHEDULER_REJECTIONS.inc(lane=self.lane, reason="circuit_open")
+            raise
+        try:
+            self._acquire(deadline)
+        except HTTPException:
+            self.breaker.cancel_probe()
+            raise
+        try:
+            result = call(deadline)
+        except Exception:
+            self.breaker.record(False)
+            raise
+        finally:
+            self._release()
+        self.breaker.record(True)
+        return result
+
+
+scheduler = LLMScheduler.from_settings()
+# offline batch answering runs in its own lane; the breaker is shared because both lanes call the same upstream
+batch_scheduler = LLMScheduler(
+    settings.llm_batch_max_in_flight,
+    settings.llm_batch_max_queue,
+    settings.llm_batch_timeout_seconds,
+    scheduler.breaker,
+    lane="batch",
+)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, text
+from sqlmodel import Session, select
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are only serialized within one process
+    fcntl = None
+
+from ..config import get_settings
+from ..models import db
+from ..models.db import get_session
+from ..models.entities import ChatMessage, ChatSession, DocumentTask, DocumentVersion, QaBatchJob, VectorStoreRecord
+from ..models.schemas import MaintenanceReport
+from ..storage.vector_storage import delete_vector_store
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_run_lock = threading.Lock()
+_LOCK_FILE = "maintenance.lock"
+_stop = threading.Event()
+_scheduler: Optional[threading.Thread] = None
+
+
+@contextmanager
+def _exclusive() -> Iterator[None]:
+    """One run at a time across threads and processes (the scheduled job, admin requests in any worker, the CLI)."""
+
+    if not _run_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="维护任务正在运行")
+    try:
+        settings.data_dir.mkdir(parents=True, exist_ok=True)
+        with (settings.data_dir / _LOCK_FILE).open("a") as handle:
+            if fcntl is not None:
+                try:
+                    # released when the handle is closed, or by the OS if the process dies
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise HTTPException(status_code=409, detail="维护任务正在运行") from None
+            yield
+    finally:
+        _run_lock.release()
+
+
+def _count(session: Session, query: Any) -> int:
+    return session.exec(select(func.count()).select_from(query.subquery())).one()
+
+
+def _cutoff(days: int) -> Optional[datetime]:
+    return datetime.utcnow() - timedelta(days=days) if days > 0 else None
+
+
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+
+
+def _settled(path: Path, now: float) -> bool:
+    # in-flight builds, imports and uploads write their files before their DB row exists; leave recent ones alone
+    return now - path.stat().st_mtime >= settings.maintenance_min_age_seconds
+
+
+def _purge_rows(dry_run: bool) -> Dict[str, int]:
+    """Set-based deletes of rows past their retention period; counts what was (or would be) deleted."""
+
+    counts = {"sessions": 0, "messages": 0, "failedTasks": 0, "qaJobs": 0}
+    sessions_before = _cutoff(settings.retention_session_days)
+    messages_before = _cutoff(settings.retention_message_days)
+    failed_before = _cutoff(settings.retention_failed_task_days)
+    jobs: List[str] = []
+    with get_session() as session:
+        if sessions_before is not None:
+            expired = select(ChatSession.session_id).where(ChatSession.updated_at < sessions_before)
+            counts["sessions"] = _count(session, expired)
+            expired_messages = select(ChatMessage.message_id).where(ChatMessage.session_id.in_(expired))
+            counts["messages"] += _count(session, expired_messages)
+            if not dry_run:
+                session.exec(delete(ChatMessage).where(ChatMessage.session_id.in_(expired)))
+                session.exec(delete(ChatSession).where(ChatSession.updated_at < sessions_before))
+        if messages_before is not None:
+            old = select(ChatMessage.message_id).where(ChatMessage.timestamp < messages_before)
+            if dry_run and sessions_before is not None:
+                # not deleted yet in a dry run: do not count the expired sessions' messages twice
+                old = old.where(ChatMessage.session_id.not_in(expired))
+            counts["messages"] += _count(session, old)
+            if not dry_run:
+                session.exec(delete(ChatMessage).where(ChatMessage.timestamp < messages_before))
+        if failed_before is not None:
+            failed_tasks = (DocumentTask.status == "failed", DocumentTask.updated_at < failed_before)
+            counts["failedTasks"] = _count(session, select(DocumentTask.task_id).where(*failed_tasks))
+            failed_jobs = (QaBatchJob.status.in_(("failed", "cancelled")), QaBatchJob.updated_at < failed_before)
+            jobs = list(session.exec(select(QaBatchJob.job_id).where(*failed_jobs)).all())
+            counts["qaJobs"] = len(jobs)
+            if not dry_run:
+                session.exec(delete(DocumentTask).where(*failed_tasks))
+                session.exec(delete(QaBatchJob).where(*failed_jobs))
+        session.commit()
+    if not dry_run:
+        for job_id in jobs:
+            shutil.rmtree(settings.qa_job_dir / job_id, ignore_errors=True)
+    return counts
+
+
+def _orphans(now: float) -> Dict[str, List[Path]]:
+    """Files and directories no DB row refers to (or left behind by interrupted writes), old enough to be safe."""
+
+    with get_session() as session:
+        store_ids: Set[str] = set(session.exec(select(VectorStoreRecord.store_id)).all())
+        documents: Set[str] = {
+            Path(path).name
+            for path in [
+                *session.exec(select(DocumentTask.file_path)).all(),
+                *session.exec(select(DocumentVersion.file_path)).all(),
+            ]
+            if path
+        }
+        jobs: Set[str] = set(session.exec(select(QaBatchJob.job_id)).all())
+
+    stores: List[Path] = []
+    if settings.vector_dir.exists():
+        for child in settings.vector_dir.iterdir():
+            if child.name not in store_ids:
+                stores.append(child)  # deleted or never-registered stores, .import-* and <id>.staging leftovers
+            elif child.is_dir():
+                stores += [shard for shard in child.glob("shard-*.*") if shard.suffix in (".staging", ".retired")]
+    files = [
+        child
+        for child in (settings.document_dir.iterdir() if settings.document_dir.exists() else ())
+        if child.name not in documents  # includes _batch_* staging directories of interrupted uploads
+    ]
+    job_dirs = [
+        child for child in (settings.qa_job_dir.iterdir() if settings.qa_job_dir.exists() else ()) if child.name not in jobs
+    ]
+    found = {"stores": stores, "documents": files, "qaJobs": job_dirs}
+    return {name: [path for path in paths if _settled(path, now)] for name, paths in found.items()}
+
+
+def _remove(paths: Iterable[Path]) -> None:
+    for path in paths:
+        if path.parent == settings.vector_dir and "." not in path.name:
+            delete_vector_store(path.name)  # also drops it from the loaded-index cache
+        elif path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def _db_pages() -> Dict[str, int]:
+    with db.engine.connect() as connection:
+        return {
+            name: connection.execute(text(f"PRAGMA {name}")).scalar_one()
+            for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        }
+
+
+def _vacuum(full: bool) -> str:
+    """Return free pages to the filesystem: incremental vacuum when enabled, else a full VACUUM on request.
+
+    A full VACUUM also applies the incremental auto-vacuum mode (set on connect) to an older database.
+    """
+
+    if not full and _db_pages()["auto_vacuum"] != 2:
+        return "skipped"
+    connection = db.engine.raw_connection()
+    try:
+        # executescript runs outside a transaction and steps the pragma to completion (execute frees one page)
+        connection.driver_connection.executescript("VACUUM" if full else "PRAGMA incremental_vacuum")
+    finally:
+        connection.close()
+    return "full" if full else "incremental"
+
+
+def run_maintenance(dry_run: bool = False, full_vacuum: bool = False) -> MaintenanceReport:
+    """Apply the retention policies, remove orphaned store/document/job files and compact the database."""
+
+    with _exclusive():
+        started = datetime.utcnow()
+        start = time.perf_counter()
+        before = _db_pages()
+        counts = _purge_rows(dry_run)
+        orphans = _orphans(time.time())
+        freed = sum(_size(path) for paths in orphans.values() for path in paths)
+        vacuum = "skipped"
+        if not dry_run:
+            for paths in orphans.values():
+                _remove(paths)
+            vacuum = _vacuum(full_vacuum)
+        after = _db_pages()
+        report = MaintenanceReport(
+            dryRun=dry_run,
+            **counts,
+            orphanedStores=sorted(path.name for path in orphans["stores"]),
+            orphanedDocuments=sorted(path.name for path in orphans["documents"]),
+            orphanedQaJobs=sorted(path.name for path in orphans["qaJobs"]),
+            freedFileBytes=freed,
+            dbBytesBefore=before["page_count"] * before["page_size"],
+            dbBytesAfter=after["page_count"] * after["page_size"],
+            dbFreePages=after["freelist_count"],
+            vacuum=vacuum,
+            startedAt=started,
+            durationSeconds=round(time.perf_counter() - start, 3),
+        )
+    logger.info(
+        "Maintenance%s: %d sessions, %d messages, %d failed tasks, %d qa jobs, %d orphaned paths (%d bytes), vacuum=%s",
+        " (dry run)" if dry_run else "",
+        report.sessions,
+        report.messages,
+        report.failedTasks,
+        report.qaJobs,
+        sum(len(paths) for paths in orphans.values()),
+        freed,
+        vacuum,
+    )
+    return report
+
+
+def _loop(interval: float) -> None:
+    while not _stop.wait(interval):
+        try:
+            run_maintenance()
+        except HTTPException as exc:
+            logger.info("Scheduled maintenance skipped: %s", exc.detail)
+        except Exception:
+            logger.exception("Scheduled maintenance failed")
+
+
+def start_schedule() -> None:
+    """Run maintenance every ``MAINTENANCE_INTERVAL_HOURS`` in a daemon thread (no-op when 0)."""
+
+    global _scheduler
+    if settings.maintenance_interval_hours <= 0 or _scheduler is not None:
+        return
+    _stop.clear()
+    _scheduler = threading.Thread(
+        target=_loop, args=(settings.maintenance_interval_hours * 3600,), name="maintenance", daemon=True
+    )
+    _scheduler.start()
+
+
+def stop_schedule() -> None:
+    global _scheduler
+    _stop.set()
+    _scheduler = None
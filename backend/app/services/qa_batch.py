@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlmodel import select
+
+from ..config import get_settings
+from ..models.db import get_session
+from ..models.entities import QaBatchJob
+from ..models.schemas import RecallRequest
+from ..utils import timing, tokens
+from . import chat, vector_stores
+from .usage import save_usage
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_ACTIVE = ("queued", "running")
+# finished, but some questions failed; resume asks only those again
+_WITH_ERRORS = "completed_with_errors"
+_PROGRESS_INTERVAL = 1.0
+_INPUT = "input.jsonl"
+_OUTPUT = "output.jsonl"
+
+# jobs executing in this process -> stop flag
+_running: Dict[str, threading.Event] = {}
+_running_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads; no limit when ``rate`` is falsy."""
+
+    def __init__(self, rate: Optional[float]) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def parse_questions(lines: Iterable[bytes]) -> List[Dict[str, str]]:
+    """Each line is ``{"question": ..., "id": ...}`` (``id`` defaults to the line number) or a bare JSON string."""
+
+    questions: List[Dict[str, str]] = []
+    seen: Set[str] = set()
+    for number, raw in enumerate(lines, start=1):
+        try:
+            line = raw.decode("utf-8-sig").strip()
+            item = json.loads(line) if line else None
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"第 {number} 行不是合法的 UTF-8 JSON") from exc
+        if item is None:
+            continue
+        if isinstance(item, str):
+            item = {"question": item}
+        question = item.get("question") if isinstance(item, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPException(status_code=400, detail=f"第 {number} 行缺少 question 字段")
+        question_id = str(item.get("id", number))
+        if question_id in seen:
+            raise HTTPException(status_code=400, detail=f"第 {number} 行的 id 重复: {question_id}")
+        seen.add(question_id)
+        questions.append({"id": question_id, "question": question})
+    if not questions:
+        raise HTTPException(status_code=400, detail="问题文件为空")
+    return questions
+
+
+def _failed_invoke(debug: Optional[List[str]]) -> Optional[str]:
+    # chat answers a failed or skipped model call with fallback text; a batch result must not count it as answered
+    for note in debug or ():
+        if note == "invoke=circuit_open" or note.startswith("invoke=error:"):
+            return note[len("invoke="):]
+    return None
+
+
+def answer_question(store_id: str, question: str) -> Dict[str, Any]:
+    """Run one question through the RAG graph without a chat session (nothing is written to the DB).
+
+    Model calls go through the scheduler's batch lane. Raises when the model call failed or was skipped.
+    """
+
+    token = timing.activate()
+    try:
+        with tokens.metering() as used:
+            result = chat.get_rag_executor().invoke(
+                {
+                    "question": question,
+                    "vectorStoreId": store_id,
+                    "recallRequest": RecallRequest(query=question, topK=3, withContent=True),
+                    "batch": True,
+                }
+            )
+        failure = _failed_invoke(result.get("debug"))
+        if failure:
+            raise RuntimeError(f"model call failed: {failure}")
+        return {
+            "answer": result.get("answer"),
+            "citations": [citation.model_dump(mode="json") for citation in result.get("citations", [])],
+            "timings": timing.current().as_dict(),  # type: ignore[union-attr]
+            "usage": used.as_dict(),
+        }
+    finally:
+        timing.deactivate(token)
+
+
+def _drop_partial_line(path: Path) -> None:
+    """A run killed mid-write can leave a torn last line; cut it so appends start on a fresh line."""
+
+    if not path.exists():
+        return
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        with path.open("r+b") as handle:
+            handle.truncate(data.rfind(b"\n") + 1)
+
+
+def read_results(output: Path) -> Set[str]:
+    """Ids already answered in ``output``; lines of failed attempts are removed so those questions are asked again."""
+
+    done: Set[str] = set()
+    if not output.exists():
+        return done
+    kept: List[str] = []
+    dropped = 0
+    with output.open(encoding="utf-8") as handle:
+        for line in handle:
+            result = json.loads(line)
+            if result.get("error"):
+                dropped += 1
+                continue
+            done.add(result["id"])
+            kept.append(line)
+    if dropped:
+        staging = output.with_suffix(output.suffix + ".tmp")
+        staging.write_text("".join(kept), encoding="utf-8")
+        os.replace(staging, output)
+    return done
+
+
+def run_questions(
+    questions: List[Dict[str, str]],
+    store_id: str,
+    output: Path,
+    concurrency: int,
+    rate_limit: Optional[float] = None,
+    should_stop: Callable[[], bool] = lambda: False,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    usage: Optional[tokens.TokenUsage] = None,
+) -> Tuple[int, int]:
+    """Answer every question not yet in ``output``, appending one JSON line per result as it finishes.
+
+    Re-running with the same output resumes where an interrupted run stopped and retries the questions
+    that failed. Returns the (completed, failed) counts including earlier answers; ``usage`` accumulates
+    this run's tokens.
+    """
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    _drop_partial_line(output)
+    done = read_results(output)
+    completed, failed = len(done), 0
+    if on_progress:
+        on_progress(completed, failed)  # the failed lines are gone from the output; show counts that match it
+    pending = [item for item in questions if item["id"] not in done]
+    limiter = RateLimiter(rate_limit)
+    lock = threading.Lock()
+
+    with output.open("a", encoding="utf-8") as handle:
+
+        def work(item: Dict[str, str]) -> None:
+            nonlocal completed, failed
+            if should_stop():
+                return
+            limiter.acquire()
+            try:
+                result = {**item, **answer_question(store_id, item["question"]), "error": None}
+            except Exception as exc:
+                detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+                logger.warning("Batch question %s failed: %s", item["id"], detail or type(exc).__name__)
+                result = {**item, "answer": None, "citations": [], "timings": {}, "error": detail or type(exc).__name__}
+            if usage is not None and result.get("usage"):
+                usage.merge(result["usage"])
+            line = json.dumps(result, ensure_ascii=False) + "\n"
+            with lock:
+                handle.write(line)
+                handle.flush()
+                completed += 1
+                failed += bool(result["error"])
+                if on_progress:
+                    on_progress(completed, failed)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="qa-batch") as pool:
+            list(pool.map(work, pending))
+    return completed, failed
+
+
+def _job_dir(job_id: str) -> Path:
+    return settings.qa_job_dir / job_id
+
+
+def _runner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _runner_alive(job: QaBatchJob) -> bool:
+    if not job.runner:
+        return False
+    host, _, pid = job.runner.rpartition(":")
+    if host != socket.gethostname():
+        return True  # another node; assume it is still working on it
+    if int(pid) == os.getpid():
+        return job.job_id in _running
+    if os.name == "nt":
+        return False  # os.kill(pid, 0) is not a liveness probe on Windows; serve.py is POSIX-only anyway
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def create_job(stream: BinaryIO, store_id: str, concurrency: int, rate_limit: Optional[float]) -> QaBatchJob:
+    vector_stores.get_vector_store(store_id)
+    if not 1 <= concurrency <= settings.qa_batch_max_concurrency:
+        raise HTTPException(status_code=400, detail=f"并发数需在 1-{settings.qa_batch_max_concurrency} 之间")
+    questions = parse_questions(stream)
+
+    job = QaBatchJob(
+        job_id=uuid4().hex,
+        store_id=store_id,
+        total=len(questions),
+        concurrency=concurrency,
+        rate_limit=rate_limit or None,
+    )
+    directory = _job_dir(job.job_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    # normalised copy so a resumed run sees exactly the same ids
+    (directory / _INPUT).write_text(
+        "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in questions), encoding="utf-8"
+    )
+    with get_session() as session:
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    _start(job.job_id, expected_runner=None)
+    return get_job(job.job_id)
+
+
+def get_job(job_id: str) -> QaBatchJob:
+    with get_session() as session:
+        job = session.get(QaBatchJob, job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Batch job not found")
+        return job
+
+
+def cancel_job(job_id: str) -> QaBatchJob:
+    job = get_job(job_id)
+    if job.status not in _ACTIVE:
+        raise HTTPException(status_code=409, detail=f"任务已结束（{job.status}）")
+    with get_session() as session:
+        session.exec(
+            update(QaBatchJob)
+            .where(QaBatchJob.job_id == job_id, QaBatchJob.status.in_(_ACTIVE))
+            .values(status="cancelled", updated_at=datetime.utcnow())
+        )
+        session.commit()
+    # a runner in another process notices at its next progress update
+    with _running_lock:
+        stop = _running.get(job_id)
+    if stop:
+        stop.set()
+    return get_job(job_id)
+
+
+def resume_job(job_id: str) -> QaBatchJob:
+    job = get_job(job_id)
+    if job.status == "completed":
+        raise HTTPException(status_code=409, detail="任务已完成且没有失败的问题")
+    if job.status in _ACTIVE and _runner_alive(job):
+        raise HTTPException(status_code=409, detail="任务正在运行")
+    if not _start(job_id, expected_runner=job.runner):
+        raise HTTPException(status_code=409, detail="任务已被其他进程接管")
+    return get_job(job_id)
+
+
+def resume_interrupted() -> int:
+    """Restart jobs whose runner process is gone; returns how many this process picked up."""
+
+    with get_session() as session:
+        jobs = session.exec(select(QaBatchJob).where(QaBatchJob.status.in_(_ACTIVE))).all()
+    resumed = sum(_start(job.job_id, expected_runner=job.runner) for job in jobs if not _runner_alive(job))
+    if resumed:
+        logger.info("Resumed %d interrupted batch QA jobs", resumed)
+    return resumed
+
+
+def _start(job_id: str, expected_runner: Optional[str]) -> bool:
+    """Claim the job for this process (compare-and-swap on ``runner``) and run it in a background thread."""
+
+    owner = QaBatchJob.runner.is_(None) if expected_runner is None else QaBatchJob.runner == expected_runner
+    with get_session() as session:
+        claimed = session.exec(
+            update(QaBatchJob)
+            .where(QaBatchJob.job_id == job_id, owner)
+            .values(runner=_runner_id(), status="running", message=None, updated_at=datetime.utcnow())
+        ).rowcount
+        session.commit()
+    if not claimed:
+        return False
+    stop = threading.Event()
+    with _running_lock:
+        _running[job_id] = stop
+    threading.Thread(target=_run_job, args=(job_id, stop), name=f"qa-job-{job_id[:8]}", daemon=True).start()
+    return True
+
+
+def _record_progress(job_id: str, completed: int, failed: int) -> str:
+    with get_session() as session:
+        job = session.get(QaBatchJob, job_id)
+        if job and job.status == "running":
+            job.completed, job.failed, job.updated_at = completed, failed, datetime.utcnow()
+            session.add(job)
+            session.commit()
+        return job.status if job else "cancelled"
+
+
+def _finish(
+    job_id: str,
+    status: str,
+    completed: Optional[int] = None,
+    failed: Optional[int] = None,
+    message: Optional[str] = None,
+) -> None:
+    with get_session() as session:
+        job = session.get(QaBatchJob, job_id)
+        if not job:
+            return
+        if job.status == "running":
+            job.status = status
+        if completed is not None:
+            job.completed, job.failed = completed, failed or 0
+        job.message = message
+        job.runner = None
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+
+
+def _run_job(job_id: str, stop: threading.Event) -> None:
+    last_update = 0.0
+
+    def on_progress(completed: int, failed: int) -> None:
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update < _PROGRESS_INTERVAL:
+            return
+        last_update = now
+        if _record_progress(job_id, completed, failed) != "running":
+            stop.set()
+
+    try:
+        job = get_job(job_id)
+        directory = _job_dir(job_id)
+        with (directory / _INPUT).open(encoding="utf-8") as handle:
+            questions = [json.loads(line) for line in handle]
+        used = tokens.TokenUsage()
+        try:
+            completed, failed = run_questions(
+                questions,
+                job.store_id,
+                directory / _OUTPUT,
+                job.concurrency,
+                job.rate_limit,
+                should_stop=stop.is_set,
+                on_progress=on_progress,
+                usage=used,
+            )
+        finally:
+            save_usage("qa_batch", used.as_dict(), store_id=job.store_id)
+        if stop.is_set():
+            _finish(job_id, "cancelled", completed, failed)
+        elif failed:
+            _finish(job_id, _WITH_ERRORS, completed, failed, message=f"{failed} 个问题失败，可调用 resume 重试")
+        else:
+            _finish(job_id, "completed", completed, failed)
+        logger.info("Batch QA job %s finished: %d answered, %d failed", job_id, completed, failed)
+    except Exception as exc:
+        logger.exception("Batch QA job %s failed: %s", job_id, exc)
+        _finish(job_id, "failed", message=str(exc))
+    finally:
+        with _running_lock:
+            _running.pop(job_id, None)
+
+
+def iter_results(job_id: str) -> Iterator[bytes]:
+    """Results written so far; safe to read while the job is still appending."""
+
+    get_job(job_id)
+    output = _job_dir(job_id) / _OUTPUT
+    if not output.exists():
+        return iter(())
+
+    def lines() -> Iterator[bytes]:
+        with output.open("rb") as handle:
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    break  # still being written
+                yield line
+
+    return lines()
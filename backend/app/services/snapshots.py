@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+from datetime import datetime
+import hashlib
+import hmac
+import io
+import json
+import logging
+from pathlib import Path, PurePosixPath
+import re
+import shutil
+import tarfile
+import tempfile
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlmodel import select
+
+from ..config import get_settings
+from ..models.db import get_session
+from ..models.entities import VectorStoreRecord
+from ..storage.vector_storage import get_vector_store_path
+from . import vector_stores
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+_MANIFEST = "manifest.json"
+# hex HMAC-SHA256 of the manifest bytes under SNAPSHOT_SIGNING_KEY; the manifest pins every index file's sha256
+_SIGNATURE = "manifest.sig"
+_INDEX_PREFIX = "index/"
+_COPY_CHUNK = 1024 * 1024
+_MANIFEST_MAX_BYTES = 16 * 1024 * 1024
+
+
+def embedding_identity(backend: str, space: Optional[str] = None) -> Dict[str, Any]:
+    """What produced a store's vectors; imports are refused when this node would embed queries differently.
+
+    ``space`` is the vector space the store was built in; by default the one this node puts ``backend`` in.
+    """
+
+    router = vector_stores.embedding_router()
+    inner = next((item for item in router.backends if item.backend == backend), router.backends[0]).inner
+    return {
+        "backend": backend,
+        "provider": type(inner).__name__,
+        "model": getattr(inner, "model", None),
+        "space": space or router.space_of(backend),
+    }
+
+
+def _index_files(root: Path) -> List[Path]:
+    # skips the .staging/.retired directories of a swap and the temp file of a centroid write
+    return sorted(
+        path
+        for path in root.rglob("*")
+        if path.is_file()
+        and not any(part.endswith((".staging", ".retired", ".tmp")) for part in path.relative_to(root).parts)
+    )
+
+
+def _signature(payload: bytes) -> Optional[str]:
+    key = settings.snapshot_signing_key
+    if not key:
+        return None
+    return hmac.new(key.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(_COPY_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(store_id: str) -> Path:
+    """Write ``<store>.tar.gz`` (manifest, its signature, then index files) to a temp file and return its path.
+
+    Without ``SNAPSHOT_SIGNING_KEY`` the snapshot is unsigned and no node will import it.
+    """
+
+    record = vector_stores.get_vector_store(store_id)
+    root = get_vector_store_path(store_id)
+    # no shard rebuild or document update may swap files between hashing and archiving them
+    with vector_stores.update_lock(store_id):
+        if not root.exists():
+            raise HTTPException(status_code=404, detail="Vector store not ready")
+        return _write_snapshot(record, root)
+
+
+def _write_snapshot(record: VectorStoreRecord, root: Path) -> Path:
+    store_id = record.store_id
+    files = _index_files(root)
+    backend = record.config.get("embeddingBackend", "default")
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "exportedAt": datetime.utcnow().isoformat(),
+        "store": {
+            "id": record.store_id,
+            "name": record.name,
+            "documentTaskId": record.document_task_id,
+            "config": record.config,
+            "buildReport": record.build_report,
+            "createdAt": record.created_at.isoformat(),
+        },
+        "embedding": embedding_identity(backend, record.config.get("embeddingSpace")),
+        "files": {
+            path.relative_to(root).as_posix(): {"size": path.stat().st_size, "sha256": _sha256(path)}
+            for path in files
+        },
+    }
+
+    handle = tempfile.NamedTemporaryFile(prefix=f"snapshot-{store_id}-", suffix=".tar.gz", delete=False)
+    try:
+        with tarfile.open(fileobj=handle, mode="w:gz") as archive:
+            payload = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            signature = _signature(payload)
+            members = [(_MANIFEST, payload)]
+            if signature is not None:
+                members.append((_SIGNATURE, signature.encode("ascii")))
+            for name, content in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+            for path in files:
+                archive.add(str(path), arcname=_INDEX_PREFIX + path.relative_to(root).as_posix(), recursive=False)
+    except BaseException:
+        handle.close()
+        Path(handle.name).unlink(missing_ok=True)
+        raise
+    handle.close()
+    return Path(handle.name)
+
+
+def _read_small(archive: tarfile.TarFile, name: str, limit: int) -> bytes:
+    member = archive.next()
+    if member is None or member.name != name or not member.isfile():
+        raise HTTPException(status_code=400, detail=f"快照缺少 {name}")
+    if member.size > limit:
+        raise HTTPException(status_code=400, detail=f"快照 {name} 过大")
+    return archive.extractfile(member).read(limit)  # type: ignore[union-attr]
+
+
+def _safe_relative(name: Any) -> bool:
+    path = PurePosixPath(str(name))
+    return (
+        isinstance(name, str)
+        and "\\" not in name
+        and not path.is_absolute()
+        and path.as_posix() == name
+        and all(part not in ("", ".", "..") for part in path.parts)
+    )
+
+
+def _read_manifest(archive: tarfile.TarFile) -> Dict[str, Any]:
+    """Read the manifest and check its signature before trusting any of it."""
+
+    payload = _read_small(archive, _MANIFEST, _MANIFEST_MAX_BYTES)
+    signature = _read_small(archive, _SIGNATURE, 1024).decode("ascii", errors="replace").strip()
+    if not hmac.compare_digest(signature, _signature(payload) or ""):
+        raise HTTPException(status_code=400, detail="快照签名无效")
+    try:
+        manifest = json.loads(payload)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="快照 manifest.json 无法解析") from exc
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise HTTPException(status_code=400, detail=f"不支持的快照格式: {manifest.get('format')}")
+    store = manifest.get("store") or {}
+    files = manifest.get("files")
+    if (
+        not re.fullmatch(r"[A-Za-z0-9_-]+", str(store.get("id", "")))
+        or not isinstance(files, dict)
+        or not all(_safe_relative(name) for name in files)
+    ):
+        raise HTTPException(status_code=400, detail="快照 manifest.json 字段不完整")
+    return manifest
+
+
+def _extract_member(archive: tarfile.TarFile, member: tarfile.TarInfo, target: Path, budget: int) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    written = 0
+    source = archive.extractfile(member)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with target.open("wb") as out:
+        for block in iter(lambda: source.read(_COPY_CHUNK), b""):  # type: ignore[union-attr]
+            written += len(block)
+            if written > budget:
+                raise HTTPException(status_code=413, detail=f"快照超过 {settings.snapshot_max_size_mb}MB 限制")
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest(), written
+
+
+def _safe_member(member: tarfile.TarInfo, expected: Dict[str, Any]) -> str:
+    """The member's path below ``index/``; anything but a regular file listed in the manifest is refused."""
+
+    relative = member.name[len(_INDEX_PREFIX):]
+    if (
+        not member.isfile()
+        or member.issym()
+        or member.islnk()
+        or not member.name.startswith(_INDEX_PREFIX)
+        or not _safe_relative(relative)
+        or relative not in expected
+    ):
+        raise HTTPException(status_code=400, detail=f"快照包含非法条目: {member.name}")
+    return relative
+
+
+def import_snapshot(stream: BinaryIO) -> VectorStoreRecord:
+    """Stream-extract a signed snapshot into a staging directory, verify every checksum, then register it."""
+
+    if not settings.snapshot_signing_key:
+        raise HTTPException(status_code=403, detail="未配置 SNAPSHOT_SIGNING_KEY，快照导入已禁用")
+    staging = settings.vector_dir / f".import-{uuid4().hex}"
+    remaining = settings.snapshot_max_size_mb * 1024 * 1024
+    checksums: Dict[str, str] = {}
+    try:
+        with tarfile.open(fileobj=stream, mode="r|gz") as archive:
+            manifest = _read_manifest(archive)
+            backend = manifest["store"].get("config", {}).get("embeddingBackend", "default")
+            if manifest.get("embedding") != embedding_identity(backend):
+                raise HTTPException(status_code=409, detail="快照的 Embedding 模型与本节点不一致")
+            while (member := archive.next()) is not None:
+                relative = _safe_member(member, manifest["files"])
+                checksums[relative], written = _extract_member(archive, member, staging / relative, remaining)
+                remaining -= written
+    except (tarfile.TarError, EOFError, OSError) as exc:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"快照已损坏: {exc}") from exc
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return _register(manifest, checksums, staging)
+
+
+def _register(manifest: Dict[str, Any], seen: Dict[str, str], staging: Path) -> VectorStoreRecord:
+    expected = manifest["files"]
+    store = manifest["store"]
+    try:
+        mismatched = [name for name, meta in expected.items() if seen.get(name) != meta.get("sha256")]
+        if mismatched:
+            raise HTTPException(status_code=400, detail=f"快照校验失败: {', '.join(sorted(mismatched))}")
+
+        target = get_vector_store_path(store["id"])
+        with get_session() as session:
+            exists = session.exec(select(VectorStoreRecord).where(VectorStoreRecord.store_id == store["id"])).first()
+            if exists or target.exists():
+                raise HTTPException(status_code=409, detail="向量库已存在")
+            record = VectorStoreRecord(
+                store_id=store["id"],
+                name=store.get("name") or store["id"],
+                document_task_id=store.get("documentTaskId") or "",
+                config=store.get("config") or {},
+                status="ready",
+                failure_reason=None,
+                build_report=store.get("buildReport"),
+                created_at=datetime.fromisoformat(store["createdAt"]) if store.get("createdAt") else datetime.utcnow(),
+                updated_at=datetime.utcnow(),
+            )
+            session.add(record)
+            session.flush()
+            staging.rename(target)
+            try:
+                session.commit()
+            except BaseException:
+                target.rename(staging)
+                raise
+            session.refresh(record)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info("Imported vector store %s (%d files)", store["id"], len(seen))
+    return record
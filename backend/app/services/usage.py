@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import case, func
+from sqlmodel import select
+
+from ..config import get_settings
+from ..models.db import get_session
+from ..models.entities import TokenUsageRecord
+from ..models.schemas import UsageBucket, UsageReport
+
+settings = get_settings()
+
+GROUPS = ("day", "session", "store")
+
+
+def usage_record(kind: str, usage: Dict[str, Any], **ids: Optional[str]) -> TokenUsageRecord:
+    """Ledger row for ``usage`` (a ``TokenUsage.as_dict()``); ``ids`` are session_id/message_id/store_id."""
+
+    return TokenUsageRecord(
+        usage_id=uuid4().hex,
+        kind=kind,
+        prompt_tokens=usage.get("promptTokens", 0),
+        completion_tokens=usage.get("completionTokens", 0),
+        embedding_tokens=usage.get("embeddingTokens", 0),
+        estimated=usage.get("estimated", False),
+        coalesced=usage.get("coalesced", False),
+        **ids,
+    )
+
+
+def save_usage(kind: str, usage: Dict[str, Any], **ids: Optional[str]) -> None:
+    with get_session() as session:
+        session.add(usage_record(kind, usage, **ids))
+        session.commit()
+
+
+def _cost(prompt: int, completion: int, embedding: int) -> float:
+    return round(
+        (
+            prompt * settings.price_prompt_per_1k_tokens
+            + completion * settings.price_completion_per_1k_tokens
+            + embedding * settings.price_embedding_per_1k_tokens
+        )
+        / 1000,
+        6,
+    )
+
+
+def _bucket(
+    key: Optional[str],
+    calls: int,
+    prompt: int,
+    completion: int,
+    embedding: int,
+    estimated: int,
+    coalesced: int,
+    coalesced_tokens: int,
+) -> UsageBucket:
+    return UsageBucket(
+        key=key,
+        calls=calls,
+        promptTokens=prompt,
+        completionTokens=completion,
+        embeddingTokens=embedding,
+        estimated=bool(estimated),
+        coalesced=bool(coalesced),
+        coalescedTokens=coalesced_tokens,
+        cost=_cost(prompt, completion, embedding),
+    )
+
+
+def usage_report(
+    group_by: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    kind: Optional[str] = None,
+) -> UsageReport:
+    """Recorded token usage summed per day, session or store, largest consumers first for sessions/stores."""
+
+    if group_by not in GROUPS:
+        raise HTTPException(status_code=400, detail=f"groupBy 仅支持 {', '.join(GROUPS)}")
+    key = {
+        "day": func.date(TokenUsageRecord.created_at),
+        "session": TokenUsageRecord.session_id,
+        "store": TokenUsageRecord.store_id,
+    }[group_by]
+    # a coalesced row repeats the chat tokens of a model call another row already counts
+    shared = func.coalesce(TokenUsageRecord.coalesced, False)
+    totals = (
+        func.count(),
+        func.coalesce(func.sum(case((shared, 0), else_=TokenUsageRecord.prompt_tokens)), 0),
+        func.coalesce(func.sum(case((shared, 0), else_=TokenUsageRecord.completion_tokens)), 0),
+        func.coalesce(func.sum(TokenUsageRecord.embedding_tokens), 0),
+        func.coalesce(func.max(TokenUsageRecord.estimated), False),
+        func.coalesce(func.max(TokenUsageRecord.coalesced), False),
+        func.coalesce(
+            func.sum(case((shared, TokenUsageRecord.prompt_tokens + TokenUsageRecord.completion_tokens), else_=0)), 0
+        ),
+    )
+    conditions = []
+    if since is not None:
+        conditions.append(TokenUsageRecord.created_at >= since)
+    if until is not None:
+        conditions.append(TokenUsageRecord.created_at < until)
+    if kind is not None:
+        conditions.append(TokenUsageRecord.kind == kind)
+
+    with get_session() as session:
+        rows = session.exec(select(key, *totals).where(*conditions).group_by(key)).all()
+        total = session.exec(select(*totals).where(*conditions)).one()
+    items = [_bucket(str(row[0]) if row[0] is not None else None, *row[1:]) for row in rows]
+    if group_by == "day":
+        items.sort(key=lambda item: item.key or "")
+    else:
+        items.sort(
+            key=lambda item: (item.cost, item.promptTokens + item.completionTokens + item.embeddingTokens), reverse=True
+        )
+    return UsageReport(groupBy=group_by, items=items, total=_bucket(None, *total))
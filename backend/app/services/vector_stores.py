@@ -1,105 +1,364 @@
 from __future__ import annotations
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from datetime import datetime, timezone
+import hashlib
+import heapq
+import itertools
 import logging
-from typing import List
+import os
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 from uuid import uuid4
+import weakref
 
 from fastapi import HTTPException
-from langchain_community.vectorstores import FAISS
-from langchain_core.embeddings import Embeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from sqlmodel import select
 
 from ..config import get_settings
 from ..models.db import get_session
 from ..models.entities import DocumentTask, VectorStoreRecord
-from ..models.schemas import DocumentSnippet, RecallRequest, RecallResponse, VectorStoreConfig
-from ..storage.vector_storage import load_vector_store, save_vector_store
-from .documents import get_document_text
+from ..models.schemas import (
+    DocumentSnippet,
+    RecallFilter,
+    RecallRequest,
+    RecallResponse,
+    RequestDebug,
+    VectorStoreConfig,
+)
+from ..storage.vector_storage import (
+    delete_vector_store,
+    get_vector_store_path,
+    list_shards,
+    load_centroids,
+    load_vector_store,
+    open_vector_store,
+    save_centroids,
+    save_vector_store,
+)
+from ..utils import metrics, timing, tokens
+from ..utils.dedup import Deduplicator
+from ..utils.profiling import profiled
+from ..utils.lazy import Lazy
+from ..utils.locks import named_lock
+from ..utils.singleflight import SingleFlight
+from ..utils.text import TextSegment, estimate_tokens
+from .documents import get_document_segments
+from .usage import usage_record
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+    import numpy as np
+
+    from .embeddings import EmbeddingRouter, InstrumentedEmbeddings, RoutedEmbeddings
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-class FallbackEmbeddings(Embeddings):
-    """Deterministic embeddings when real embedding services are unavailable."""
+_recall_flight = SingleFlight("recall")
+# shared by parallel shard builds, loads and searches; FAISS releases the GIL inside add/search
+_shard_pool = Lazy(
+    lambda: ThreadPoolExecutor(
+        max_workers=settings.vector_shard_workers or os.cpu_count() or 4, thread_name_prefix="vector-shard"
+    )
+)
+# a forked worker inherits the executor object but not its threads
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_shard_pool.reset)
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:  # type: ignore[override]
-        return [self.embed_query(text) for text in texts]
 
-    def embed_query(self, text: str) -> List[float]:  # type: ignore[override]
-        return [float(len(text) % 97), float(hash(text) % 101), float(len(text.split()))]
+def _build_router() -> EmbeddingRouter:
+    from .embeddings import EmbeddingRouter, build_backends
 
+    return EmbeddingRouter(build_backends())
 
-def _resolve_embed_base_url() -> str:
-    if settings.embed_base_url:
-        return settings.embed_base_url
-    if settings.openai_base_url and settings.openai_base_url != "https://api.deepseek.com/v1":
-        return settings.openai_base_url
-    return "https://api.openai.com/v1"
 
+# built on first use: importing langchain_core.embeddings alone pulls in langsmith
+_router = Lazy(_build_router)
 
-def build_embeddings() -> Embeddings:
-    try:
-        from langchain_openai import OpenAIEmbeddings
-
-        api_key = settings.embed_api_key or settings.openai_api_key or settings.deepseek_api_key
-        if not api_key or api_key == "test-key":
-            raise ValueError("missing api key")
-
-        base_url = _resolve_embed_base_url()
-        logger.info("Using embedding backend %s", base_url)
-        return OpenAIEmbeddings(
-            api_key=api_key,
-            base_url=base_url,
-            model=settings.embed_model,
-        )
-    except Exception as exc:
-        logger.warning("Falling back to deterministic embeddings: %s", exc)
-        return FallbackEmbeddings()
+
+def embedding_router() -> EmbeddingRouter:
+    return _router.get()
 
 
-_embeddings = build_embeddings()
+def get_embeddings() -> InstrumentedEmbeddings:
+    """The highest-priority embedding backend."""
+
+    return embedding_router().backends[0]
+
+
+def _unavailable(exc: Exception) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"没有可用的 Embedding 服务（向量空间 {exc}）")
 
 
 def create_vector_store(document_task_id: str, config: VectorStoreConfig) -> VectorStoreRecord:
-    with get_session() as session:
+    return build_vector_store([document_task_id], config)
+
+
+def _load_tasks(session, document_task_ids: Sequence[str]) -> List[DocumentTask]:
+    tasks: List[DocumentTask] = []
+    for document_task_id in document_task_ids:
         task = session.exec(select(DocumentTask).where(DocumentTask.task_id == document_task_id)).first()
         if not task:
             raise HTTPException(status_code=404, detail="Document task not found")
         if task.status != "success":
             raise HTTPException(status_code=400, detail="文档尚未通过校验")
+        tasks.append(task)
+    return tasks
+
+
+@contextmanager
+def _phase(phases: Dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = round(time.perf_counter() - start, 4)
+
+
+def _split_segments(
+    documents: Sequence[Sequence[TextSegment]], tasks: Sequence[DocumentTask], config: VectorStoreConfig
+) -> List[Document]:
+    """Chunk each document segment by segment so every chunk carries its page and section."""
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=config.chunkSize,
+        chunk_overlap=config.overlap,
+    )
+    texts: List[str] = []
+    metadatas: List[Dict[str, Any]] = []
+    for segments, task in zip(documents, tasks):
+        for segment in segments:
+            metadata: Dict[str, Any] = {
+                "source": task.file_name,
+                "documentId": task.task_id,
+                "uploadedAt": task.created_at.isoformat(),
+            }
+            if segment.page is not None:
+                metadata["page"] = segment.page
+            if segment.section is not None:
+                metadata["section"] = segment.section
+            texts.append(segment.text)
+            metadatas.append(metadata)
+    return splitter.create_documents(texts, metadatas=metadatas)
+
+
+def _split_documents(
+    tasks: Sequence[DocumentTask], config: VectorStoreConfig, phases: Optional[Dict[str, float]] = None
+) -> List[Document]:
+    phases = {} if phases is None else phases
+    with _phase(phases, "extract"):
+        segments = [get_document_segments(task) for task in tasks]
+    with _phase(phases, "split"):
+        return _split_segments(segments, tasks, config)
+
+
+def stored_config(record: VectorStoreRecord) -> VectorStoreConfig:
+    """The store's build config; stores built before dedup existed have no key for it and were built without."""
+
+    return VectorStoreConfig(**{"dedup": False, **record.config})
+
+
+def _near_distance(config: VectorStoreConfig) -> Optional[int]:
+    return settings.dedup_max_distance if config.dedupDistance is None else config.dedupDistance
+
+
+def _deduplicator(config: VectorStoreConfig) -> Deduplicator:
+    """A fresh deduplicator for one document's chunks."""
+
+    distance = _near_distance(config)
+    return Deduplicator(-1 if distance is None else distance)
+
+
+def _drop_duplicates(
+    documents: Sequence[Document], config: VectorStoreConfig, seen: Optional[Dict[str, Deduplicator]] = None
+) -> Tuple[List[Document], Dict[str, int]]:
+    """Drop chunks repeating an earlier chunk of the same document; returns the removed counts.
+
+    Deduplication never crosses documents: a chunk is stored under one documentId, so dropping another
+    document's copy would lose it once the kept one is revised or deleted, and hide it from documentIds filters.
+    ``seen`` maps documentIds to deduplicators already holding their stored chunks.
+    """
+
+    removed = {"exact": 0, "near": 0}
+    if not config.dedup:
+        return list(documents), removed
+    per_document = {} if seen is None else seen
+    kept: List[Document] = []
+    for document in documents:
+        owner = document.metadata.get("documentId")
+        dedup = per_document.get(owner)
+        if dedup is None:
+            dedup = per_document[owner] = _deduplicator(config)
+        kind = dedup.check(document.page_content)
+        if kind is None:
+            kept.append(document)
+        else:
+            removed[kind] += 1
+    return kept, removed
+
+
+def _shard_of(text: str, shards: int) -> int:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
 
-        text = get_document_text(task)
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=config.chunkSize,
-            chunk_overlap=config.overlap,
+
+def _partition(documents: Sequence[Document], shards: int) -> Dict[int, List[Document]]:
+    """Assign chunks to shards by content hash so a rebuild puts every chunk back where it was."""
+
+    partitions: Dict[int, List[Document]] = {}
+    for document in documents:
+        partitions.setdefault(_shard_of(document.page_content, shards), []).append(document)
+    return partitions
+
+
+def _per_shard(shards: Sequence[int], work: Callable[[int], T]) -> Dict[int, T]:
+    if len(shards) == 1:
+        return {shards[0]: work(shards[0])}
+    # each task runs in its own copy of the caller's context, so token metering also sees the pool threads
+    contexts = [copy_context() for _ in shards]
+    return dict(zip(shards, _shard_pool.get().map(lambda context, shard: context.run(work, shard), contexts, shards)))
+
+
+def _embed_unique(documents: Sequence[Document], embeddings: Embeddings) -> Tuple[List[List[float]], int]:
+    """Embed each distinct chunk text once; returns one vector per document and the distinct count."""
+
+    texts = [document.page_content for document in documents]
+    unique = list(dict.fromkeys(texts))
+    vectors = dict(zip(unique, embeddings.embed_documents(unique)))
+    return [vectors[text] for text in texts], len(unique)
+
+
+def _build_shards(
+    documents: Sequence[Document],
+    shards: int,
+    embeddings: Embeddings,
+    report: Optional[Dict[str, Any]] = None,
+) -> Dict[int, FAISS]:
+    from langchain_community.vectorstores import FAISS
+
+    partitions = {0: list(documents)} if shards == 1 else _partition(documents, shards)
+    report = {} if report is None else report
+    phases = report.setdefault("phases", {})
+    with _phase(phases, "embed"):
+        embedded = _per_shard(list(partitions), lambda shard: _embed_unique(partitions[shard], embeddings))
+    with _phase(phases, "index"):
+        built = _per_shard(
+            list(partitions),
+            lambda shard: FAISS.from_embeddings(
+                [(document.page_content, vector) for document, vector in zip(partitions[shard], embedded[shard][0])],
+                embeddings,
+                metadatas=[document.metadata for document in partitions[shard]],
+            ),
         )
-        documents = splitter.create_documents([text])
 
-        backend = "default"
+    distinct = sum(count for _, count in embedded.values())
+    request_count = getattr(embeddings, "request_count", None)
+    report["embedding"] = {
+        "texts": len(documents),
+        # chunks that needed no embedding of their own: exact duplicates dropped by dedup, repeats within a shard
+        "cacheHits": (report.get("dedup") or {}).get("exact", 0) + len(documents) - distinct,
+        "apiCalls": sum(request_count(count) for _, count in embedded.values()) if request_count else None,
+    }
+    return built
+
+
+def _build_report(
+    store_id: str, documents: Sequence[Document], built: Dict[int, FAISS], backend: str, report: Dict[str, Any]
+) -> Dict[str, Any]:
+    indexes = [faiss_store.index for faiss_store in built.values()]
+    root = get_vector_store_path(store_id)
+    return {
+        "chunks": len(documents),
+        "characters": sum(len(document.page_content) for document in documents),
+        "tokens": sum(estimate_tokens(document.page_content) for document in documents),
+        "dimension": indexes[0].d if indexes else None,
+        "indexType": type(indexes[0]).__name__ if indexes else None,
+        "shards": len(built),
+        "diskBytes": sum(path.stat().st_size for path in root.rglob("*") if path.is_file()),
+        "memoryBytes": sum(index.ntotal * index.sa_code_size() for index in indexes),
+        "phases": report.get("phases", {}),
+        "embedding": {"backend": backend, **report.get("embedding", {})},
+        "usage": report.get("usage"),
+        "dedup": report.get("dedup"),
+    }
+
+
+@profiled("build_vector_store", always=lambda: settings.profile_builds)
+def build_vector_store(document_task_ids: List[str], config: VectorStoreConfig) -> VectorStoreRecord:
+    report: Dict[str, Any] = {"phases": {}}
+    with get_session() as session:
+        tasks = _load_tasks(session, document_task_ids)
+        documents = _split_documents(tasks, config, report["phases"])
+        # boilerplate repeated within a document (headers, footers, disclaimers) is embedded and stored once
+        with _phase(report["phases"], "dedup"):
+            documents, removed = _drop_duplicates(documents, config)
+        report["dedup"] = {**removed, "maxDistance": _near_distance(config) if config.dedup else None}
+
         store_id = uuid4().hex
-        try:
-            faiss_store = FAISS.from_documents(documents, _embeddings)
-        except Exception as exc:
-            logger.warning("Embedding model failed (%s), falling back to deterministic embeddings", exc)
-            backend = "fallback"
-            fallback = FallbackEmbeddings()
-            faiss_store = FAISS.from_documents(documents, fallback)
-        save_vector_store(faiss_store, store_id)
+        start = time.perf_counter()
+        spaces = embedding_router().spaces()
+        with metrics.STORE_BUILDS_INFLIGHT.track_inprogress(), tokens.metering() as used:
+            # every space is tried in priority order; the local deterministic one always succeeds
+            for position, space in enumerate(spaces):
+                embeddings = embedding_router().embeddings(space)
+                try:
+                    built = _build_shards(documents, config.shards, embeddings, report)
+                    break
+                except Exception as exc:
+                    if position == len(spaces) - 1:
+                        raise
+                    logger.warning("Embedding space %s failed (%s), building in %s", space, exc, spaces[position + 1])
+            backend = embeddings.backend
+            with _phase(report["phases"], "save"):
+                for shard, faiss_store in built.items():
+                    save_vector_store(faiss_store, store_id, shard if config.shards > 1 else None)
+                _write_centroids(store_id, built.values())
+        metrics.STORE_BUILD_LATENCY.observe(time.perf_counter() - start, backend=backend)
+        # includes the tokens of spaces that failed part-way before the one that built the store
+        report["usage"] = used.as_dict()
 
         record = VectorStoreRecord(
             store_id=store_id,
             name=config.name,
-            document_task_id=document_task_id,
-            config={**config.dict(), "embeddingBackend": backend},
+            document_task_id=document_task_ids[0],
+            config={
+                **config.dict(),
+                "embeddingBackend": backend,
+                "embeddingSpace": embeddings.space,
+                "documentTaskIds": list(document_task_ids),
+            },
             status="ready",
             failure_reason=None,
+            build_report=_build_report(store_id, documents, built, backend, report),
             created_at=datetime.utcnow(),
             updated_at=datetime.utcnow(),
         )
         session.add(record)
+        session.add(usage_record("build", report["usage"], store_id=store_id))
         session.commit()
         session.refresh(record)
         return record
@@ -118,39 +377,463 @@ def list_vector_stores() -> List[VectorStoreRecord]:
         return list(session.exec(select(VectorStoreRecord)))
 
 
-def recall(store_id: str, payload: RecallRequest) -> RecallResponse:
+def _store_embeddings(record: VectorStoreRecord) -> RoutedEmbeddings:
+    """Embeddings routed only to backends in the vector space the store was built in."""
+
+    router = embedding_router()
+    # stores built before spaces were recorded only name the backend that built them
+    space = (
+        record.config.get("embeddingSpace")
+        or router.space_of(record.config.get("embeddingBackend", "default"))
+        or router.spaces()[0]
+    )
+    return router.embeddings(space)
+
+
+def preload_store(store_id: str) -> int:
+    """Load every index of a store into the in-memory cache; returns how many were loaded."""
+
     record = get_vector_store(store_id)
-    backend = record.config.get("embeddingBackend", "default")
+    return len(_load_stores(store_id, record.config.get("shards", 1) > 1, _store_embeddings(record)))
 
-    embedding = FallbackEmbeddings() if backend == "fallback" else _embeddings
-    store = load_vector_store(store_id, embedding)
-    if not store:
-        raise HTTPException(status_code=404, detail="Vector store not ready")
 
+@profiled("rebuild_shard", always=lambda: settings.profile_builds)
+def rebuild_shard(store_id: str, shard: int) -> int:
+    """Re-embed one shard of a sharded store from its source documents; returns the chunk count."""
+
+    record = get_vector_store(store_id)
+    config = stored_config(record)
+    if config.shards <= 1 or not 0 <= shard < config.shards:
+        raise HTTPException(status_code=404, detail="分片不存在")
+    with get_session() as session:
+        tasks = _load_tasks(session, record.config.get("documentTaskIds") or [record.document_task_id])
+    documents, _ = _drop_duplicates(_split_documents(tasks, config), config)
+    documents = _partition(documents, config.shards).get(shard, [])
+    if not documents:
+        delete_vector_store(store_id, shard)
+        return 0
+
+    from .embeddings import EmbeddingUnavailable
+
+    start = time.perf_counter()
+    embeddings = _store_embeddings(record)
+    with update_lock(store_id), metrics.STORE_BUILDS_INFLIGHT.track_inprogress(), tokens.metering() as used:
+        try:
+            rebuilt = _build_shards(documents, 1, embeddings)[0]
+        except EmbeddingUnavailable as exc:
+            raise _unavailable(exc) from exc
+        finally:
+            _record_usage(store_id, "rebuild", used)
+        save_vector_store(rebuilt, store_id, shard)
+        _write_centroids(store_id, _load_stores(store_id, True, embeddings))
+    metrics.STORE_BUILD_LATENCY.observe(
+        time.perf_counter() - start, backend=record.config.get("embeddingBackend", "default")
+    )
+    return len(documents)
+
+
+def stores_for_document(document_task_id: str) -> List[VectorStoreRecord]:
+    return [
+        record
+        for record in list_vector_stores()
+        if record.status == "ready"
+        and document_task_id in (record.config.get("documentTaskIds") or [record.document_task_id])
+    ]
+
+
+def update_lock(store_id: str) -> ContextManager[None]:
+    """Serializes changes to one store's index files (shard rebuilds, document updates) and snapshot exports,
+    across threads and pre-fork workers.
+    """
+
+    return named_lock(f"store-{store_id}")
+
+
+@profiled("update_document_chunks", always=lambda: settings.profile_builds)
+def update_document_chunks(store_id: str, task: DocumentTask, segments: Sequence[TextSegment]) -> Dict[str, int]:
+    """Re-chunk a revised document and patch the store: chunks are matched to the stored ones by content,
+    only new chunks are embedded and chunks that disappeared are deleted. Returns added/removed/unchanged.
+    Unchanged chunks that moved to another page or section only have their metadata rewritten.
+    """
+
+    from langchain_community.vectorstores import FAISS
+
+    record = get_vector_store(store_id)
+    config = stored_config(record)
+    chunks = _split_segments([segments], [task], config)
+    embeddings = _store_embeddings(record)
+    sharded = config.shards > 1
+    # stores built from one document before chunks carried a documentId belong to that document entirely
+    sources = record.config.get("documentTaskIds") or [record.document_task_id]
+    sole_owner = task.task_id if sources == [task.task_id] else None
+
+    with update_lock(store_id), metrics.STORE_BUILDS_INFLIGHT.track_inprogress(), tokens.metering() as used:
+        stores = {
+            shard: open_vector_store(store_id, embeddings, shard)
+            for shard in (range(config.shards) if sharded else [None])
+        }
+        stored: Dict[str, List[Tuple[Optional[int], str]]] = {}
+        for shard, faiss_store in stores.items():
+            for doc_id, document in (faiss_store.docstore._dict.items() if faiss_store else ()):
+                if document.metadata.get("documentId", sole_owner) == task.task_id:
+                    stored.setdefault(document.page_content, []).append((shard, doc_id))
+
+        added: List[Document] = []
+        relabeled = set()
+        for chunk in chunks:
+            matches = stored.get(chunk.page_content)
+            if not matches:
+                added.append(chunk)
+                continue
+            shard, doc_id = matches.pop()
+            document = stores[shard].docstore.search(doc_id)
+            if document.metadata != chunk.metadata:
+                document.metadata = chunk.metadata
+                relabeled.add(shard)
+        removed = [(content, shard, doc_id) for content, entries in stored.items() for shard, doc_id in entries]
+        unchanged = len(chunks) - len(added)
+
+        # new chunks repeating a chunk of this document that stays in the store are not added, as at build time
+        seen: Dict[str, Deduplicator] = {}
+        if config.dedup and added:
+            gone = {doc_id for _, _, doc_id in removed}
+            dedup = seen[task.task_id] = _deduplicator(config)
+            for faiss_store in stores.values():
+                for doc_id, document in (faiss_store.docstore._dict.items() if faiss_store else ()):
+                    if doc_id not in gone and document.metadata.get("documentId", sole_owner) == task.task_id:
+                        dedup.check(document.page_content)
+        added, deduplicated = _drop_duplicates(added, config, seen)
+
+        vectors = _embed_unique(added, embeddings)[0] if added else []
+        changes: Dict[Optional[int], Tuple[List[str], List[Tuple[Document, List[float]]]]] = {}
+        for _, shard, doc_id in removed:
+            changes.setdefault(shard, ([], []))[0].append(doc_id)
+        for chunk, vector in zip(added, vectors):
+            shard = _shard_of(chunk.page_content, config.shards) if sharded else None
+            changes.setdefault(shard, ([], []))[1].append((chunk, vector))
+        for shard in relabeled:
+            changes.setdefault(shard, ([], []))
+
+        for shard, (doc_ids, additions) in changes.items():
+            faiss_store = stores[shard]
+            if doc_ids:
+                faiss_store.delete(doc_ids)
+            pairs = [(chunk.page_content, vector) for chunk, vector in additions]
+            metadatas = [chunk.metadata for chunk, _ in additions]
+            if faiss_store is None:
+                faiss_store = stores[shard] = FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas)
+            elif pairs:
+                faiss_store.add_embeddings(pairs, metadatas=metadatas)
+            if sharded and faiss_store.index.ntotal == 0:
+                delete_vector_store(store_id, shard)
+            else:
+                save_vector_store(faiss_store, store_id, shard)
+        if changes:
+            _write_centroids(store_id, stores.values())
+
+        _record_update(record, stores, added, [content for content, _, _ in removed], deduplicated)
+        _record_usage(store_id, "update", used)
+    logger.info(
+        "Updated store %s from document %s: %d added, %d removed", store_id, task.task_id, len(added), len(removed)
+    )
+    return {
+        "added": len(added),
+        "removed": len(removed),
+        "unchanged": unchanged,
+        "deduplicated": sum(deduplicated.values()),
+    }
+
+
+def _record_update(
+    record: VectorStoreRecord,
+    stores: Dict[Optional[int], Optional[FAISS]],
+    added: Sequence[Document],
+    removed: Sequence[str],
+    deduplicated: Dict[str, int],
+) -> None:
+    report = dict(record.build_report or {})
+    if report.get("dedup"):
+        report["dedup"] = {
+            **report["dedup"],
+            **{kind: report["dedup"].get(kind, 0) + count for kind, count in deduplicated.items()},
+        }
+    if report:
+        indexes = [faiss_store.index for faiss_store in stores.values() if faiss_store is not None]
+        root = get_vector_store_path(record.store_id)
+        report.update(
+            chunks=sum(index.ntotal for index in indexes),
+            characters=report.get("characters", 0)
+            + sum(len(chunk.page_content) for chunk in added)
+            - sum(len(content) for content in removed),
+            tokens=report.get("tokens", 0)
+            + sum(estimate_tokens(chunk.page_content) for chunk in added)
+            - sum(estimate_tokens(content) for content in removed),
+            diskBytes=sum(path.stat().st_size for path in root.rglob("*") if path.is_file()),
+            memoryBytes=sum(index.ntotal * index.sa_code_size() for index in indexes),
+        )
+    with get_session() as session:
+        stored = session.get(VectorStoreRecord, record.store_id)
+        if stored:
+            stored.build_report = report or stored.build_report
+            stored.updated_at = datetime.utcnow()
+            session.add(stored)
+            session.commit()
+
+
+def _record_usage(store_id: str, kind: str, used: tokens.TokenUsage) -> None:
+    """Ledger row for a shard rebuild or document update, also added to the store's build report totals."""
+
+    counts = used.as_dict()
+    with get_session() as session:
+        session.add(usage_record(kind, counts, store_id=store_id))
+        stored = session.get(VectorStoreRecord, store_id)
+        if stored and stored.build_report:
+            total = tokens.TokenUsage()
+            total.merge(stored.build_report.get("usage") or {})
+            total.merge(counts)
+            stored.build_report = {**stored.build_report, "usage": total.as_dict()}
+            session.add(stored)
+        session.commit()
+
+
+@profiled("recall")
+def recall(store_id: str, payload: RecallRequest) -> RecallResponse:
+    filters = payload.filters.model_dump_json() if payload.filters else None
+    key = (store_id, payload.query, payload.topK, payload.withContent, payload.coarseDocuments, filters)
+    response = _recall_flight.do(key, lambda: _recall(store_id, payload))
+    timings = timing.current()
+    if timings is None:
+        return response
+    return response.model_copy(update={"debug": RequestDebug(timings=timings.as_dict())})
+
+
+def _recall(store_id: str, payload: RecallRequest) -> RecallResponse:
+    from .embeddings import EmbeddingUnavailable
+
+    record = get_vector_store(store_id)
+    sharded = record.config.get("shards", 1) > 1
+
+    embedding = _store_embeddings(record)
+    # embedding first: with no usable backend for the store's space the request fails before touching disk
     try:
-        retriever = store.as_retriever(search_kwargs={"k": payload.topK})
-        docs = retriever.get_relevant_documents(payload.query)
-    except Exception as exc:
-        if backend != "fallback":
-            logger.warning("Vector recall failed (%s), retrying with deterministic embeddings", exc)
-            fallback_store = load_vector_store(store_id, FallbackEmbeddings())
-            if not fallback_store:
-                raise HTTPException(status_code=500, detail="Vector store fallback failed") from exc
-            retriever = fallback_store.as_retriever(search_kwargs={"k": payload.topK})
-            docs = retriever.get_relevant_documents(payload.query)
-        else:
-            raise
+        with timing.stage("embed_query"):
+            query_vector = embedding.embed_query(payload.query)
+    except EmbeddingUnavailable as exc:
+        raise _unavailable(exc) from exc
+    stores = _load_stores(store_id, sharded, embedding)
+    if not stores:
+        raise HTTPException(status_code=404, detail="Vector store not ready")
+    filters = payload.filters
+    documents = None
+    # centroids describe whole documents, so they can only pre-select when no chunk-level filter applies
+    if not _filters_chunks(filters):
+        allowed = filters.documentIds if filters else None
+        documents = _coarse_documents(store_id, query_vector, payload.coarseDocuments, allowed)
+    with metrics.FAISS_SEARCH_LATENCY.time(), timing.stage("search"):
+        hits = _search(stores, query_vector, payload.topK, documents, filters)
 
     items: List[DocumentSnippet] = []
-    for idx, doc in enumerate(docs, start=1):
+    for idx, (doc, distance) in enumerate(hits, start=1):
         metadata = {**doc.metadata}
         items.append(
             DocumentSnippet(
                 id=f"{store_id}-{idx}",
                 title=metadata.get("source", record.name),
-                similarity=float(doc.metadata.get("score", 0.0)),
+                similarity=1.0 / (1.0 + float(distance)),
                 content=doc.page_content if payload.withContent else doc.page_content[:100],
                 metadata=metadata,
             )
         )
     return RecallResponse(storeId=store_id, items=items)
+
+
+def _load_stores(store_id: str, sharded: bool, embeddings: Embeddings) -> List[FAISS]:
+    if not sharded:
+        store = load_vector_store(store_id, embeddings)
+        return [store] if store else []
+    with timing.stage("store_load"):
+        loaded = _shard_pool.get().map(lambda shard: load_vector_store(store_id, embeddings, shard), list_shards(store_id))
+        return [store for store in loaded if store]
+
+
+def _search(
+    stores: Sequence[FAISS],
+    query_vector: List[float],
+    k: int,
+    documents: Optional[Sequence[str]] = None,
+    filters: Optional[RecallFilter] = None,
+) -> List[Tuple[Document, float]]:
+    """Per-shard top-k searched concurrently, merged by L2 distance into the global top-k.
+
+    ``documents`` and ``filters`` restrict the search to matching chunks with a bitmap ID selector
+    evaluated inside the FAISS scan, so a filtered query still returns a full top-k.
+    """
+
+    def search_one(store: FAISS) -> List[Tuple[Document, float]]:
+        mask = _selection(store, documents, filters)
+        if mask is None:
+            return store.similarity_search_with_score_by_vector(query_vector, k=k)
+        return _search_selected(store, query_vector, k, mask)
+
+    if len(stores) == 1:
+        return search_one(stores[0])
+    results = _shard_pool.get().map(search_one, stores)
+    return heapq.nsmallest(k, itertools.chain.from_iterable(results), key=lambda hit: hit[1])
+
+
+class _Columns(NamedTuple):
+    """Chunk metadata laid out by index position, for vectorised filtering."""
+
+    documents: np.ndarray  # "" when unknown
+    pages: np.ndarray  # 0 when unknown
+    sections: np.ndarray  # "" when unknown
+    uploaded: np.ndarray  # NaT when unknown
+
+
+# loaded indexes are never mutated in place, so columns stay valid for the lifetime of the object
+_column_cache: "weakref.WeakKeyDictionary[FAISS, _Columns]" = weakref.WeakKeyDictionary()
+
+
+def _columns(store: FAISS) -> _Columns:
+    import numpy as np
+
+    columns = _column_cache.get(store)
+    if columns is None:
+        metadata = [
+            store.docstore.search(store.index_to_docstore_id[position]).metadata
+            for position in range(store.index.ntotal)
+        ]
+        columns = _Columns(
+            documents=np.array([item.get("documentId") or "" for item in metadata], dtype=str),
+            pages=np.array([item.get("page") or 0 for item in metadata], dtype=np.int32),
+            sections=np.array([item.get("section") or "" for item in metadata], dtype=str),
+            uploaded=np.array([item.get("uploadedAt") or "NaT" for item in metadata], dtype="datetime64[us]"),
+        )
+        _column_cache[store] = columns
+    return columns
+
+
+def _filters_chunks(filters: Optional[RecallFilter]) -> bool:
+    if filters is None:
+        return False
+    bounds = (filters.pageFrom, filters.pageTo, filters.uploadedAfter, filters.uploadedBefore)
+    return bool(filters.section) or any(bound is not None for bound in bounds)
+
+
+def _utc(value: datetime) -> np.datetime64:
+    import numpy as np
+
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "us")
+
+
+def _selection(
+    store: FAISS, documents: Optional[Sequence[str]], filters: Optional[RecallFilter]
+) -> Optional[np.ndarray]:
+    """Boolean mask over index positions, one bitmap per condition ANDed together; None when unrestricted."""
+
+    import numpy as np
+
+    if documents is None and filters is None:
+        return None
+    columns = _columns(store)
+    conditions = []
+    if documents is not None:
+        conditions.append(np.isin(columns.documents, list(documents)))
+    if filters is not None:
+        if filters.documentIds is not None:
+            conditions.append(np.isin(columns.documents, filters.documentIds))
+        if filters.pageFrom is not None:
+            conditions.append(columns.pages >= filters.pageFrom)
+        if filters.pageTo is not None:
+            conditions.append((columns.pages >= 1) & (columns.pages <= filters.pageTo))
+        if filters.section:
+            conditions.append(np.char.find(columns.sections, filters.section) >= 0)
+        if filters.uploadedAfter is not None:
+            conditions.append(columns.uploaded >= _utc(filters.uploadedAfter))
+        if filters.uploadedBefore is not None:
+            conditions.append(columns.uploaded <= _utc(filters.uploadedBefore))
+    if not conditions:
+        return None
+    return np.logical_and.reduce(conditions)
+
+
+def _search_selected(store: FAISS, query_vector: List[float], k: int, mask: np.ndarray) -> List[Tuple[Document, float]]:
+    """k-NN over the positions set in ``mask``; FAISS skips everything else during the scan."""
+
+    import faiss
+    import numpy as np
+
+    selected = int(np.count_nonzero(mask))
+    if not selected:
+        return []
+    bitmap = np.packbits(mask, bitorder="little")
+    params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(bitmap))
+    distances, indices = store.index.search(
+        np.asarray([query_vector], dtype=np.float32), min(k, selected), params=params
+    )
+    return [
+        (store.docstore.search(store.index_to_docstore_id[int(position)]), float(distance))
+        for distance, position in zip(distances[0], indices[0])
+        if position >= 0
+    ]
+
+
+def _document_positions(store: FAISS) -> Dict[str, np.ndarray]:
+    import numpy as np
+
+    documents = _columns(store).documents
+    order = np.argsort(documents, kind="stable")
+    names, starts = np.unique(documents[order], return_index=True)
+    return {str(name): group for name, group in zip(names, np.split(order, starts[1:])) if name}
+
+
+def _write_centroids(store_id: str, stores: Iterable[Optional[FAISS]]) -> None:
+    """Mean chunk vector per document, the coarse level of two-stage recall."""
+
+    import numpy as np
+
+    sums: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = {}
+    dimension = 0
+    for faiss_store in stores:
+        if faiss_store is None or not faiss_store.index.ntotal:
+            continue
+        dimension = faiss_store.index.d
+        vectors = faiss_store.index.reconstruct_n(0, faiss_store.index.ntotal)
+        for document_id, positions in _document_positions(faiss_store).items():
+            sums[document_id] = sums.get(document_id, 0) + vectors[positions].sum(axis=0)
+            counts[document_id] = counts.get(document_id, 0) + len(positions)
+    document_ids = sorted(sums)
+    centroids = (
+        np.stack([sums[document_id] / counts[document_id] for document_id in document_ids])
+        if document_ids
+        else np.zeros((0, dimension))
+    )
+    save_centroids(store_id, document_ids, centroids.astype(np.float32))
+
+
+def _coarse_documents(
+    store_id: str, query_vector: List[float], requested: Optional[int], allowed: Optional[Sequence[str]] = None
+) -> Optional[List[str]]:
+    """The documents (among ``allowed``) whose centroids are nearest the query, or None to search every chunk."""
+
+    import numpy as np
+
+    limit = settings.recall_coarse_documents if requested is None else requested
+    if limit <= 0:
+        return None
+    centroids = load_centroids(store_id)
+    if centroids is None:
+        return None
+    document_ids, matrix = centroids
+    if allowed is not None:
+        keep = np.isin(np.asarray(document_ids), list(allowed))
+        document_ids, matrix = [item for item, kept in zip(document_ids, keep) if kept], matrix[keep]
+    if len(document_ids) <= max(limit, settings.recall_coarse_min_documents) or matrix.shape[1] != len(query_vector):
+        return None
+    with timing.stage("coarse"):
+        distances = ((matrix - np.asarray(query_vector, dtype=np.float32)) ** 2).sum(axis=1)
+        nearest = np.argpartition(distances, limit)[:limit]
+    return [document_ids[index] for index in nearest]
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from datetime import datetime
+import logging
+import mimetypes
+from typing import Dict, List
+from uuid import uuid4
+
+from fastapi import HTTPException, UploadFile
+from sqlmodel import select
+
+from ..models.db import get_session
+from ..models.entities import DocumentTask, DocumentVersion
+from ..models.schemas import DocumentVersionResponse, StoreChunkChanges
+from ..storage.file_storage import save_upload_file
+from ..utils.locks import named_lock
+from ..utils.profiling import profiled
+from . import vector_stores
+from .documents import get_document_segments, validate_file
+
+logger = logging.getLogger(__name__)
+
+
+def _map_version(version: DocumentVersion) -> DocumentVersionResponse:
+    return DocumentVersionResponse(
+        taskId=version.task_id,
+        version=version.version,
+        fileName=version.file_name,
+        fileSize=version.file_size,
+        stores=[StoreChunkChanges(storeId=store_id, **change) for store_id, change in version.changes.items()],
+        status=version.status or "ready",
+        createdAt=version.created_at,
+    )
+
+
+def _stored_versions(session, task_id: str) -> List[DocumentVersion]:
+    return list(
+        session.exec(
+            select(DocumentVersion).where(DocumentVersion.task_id == task_id).order_by(DocumentVersion.version)
+        ).all()
+    )
+
+
+def _original(task: DocumentTask) -> DocumentVersion:
+    """The original upload as version 1; its row is only written when the document is first revised."""
+
+    return DocumentVersion(
+        version_id=uuid4().hex,
+        task_id=task.task_id,
+        version=1,
+        file_name=task.file_name,
+        file_size=task.file_size,
+        file_path=task.file_path,
+        created_at=task.created_at,
+    )
+
+
+def list_document_versions(task_id: str) -> List[DocumentVersionResponse]:
+    with get_session() as session:
+        task = session.get(DocumentTask, task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="Document task not found")
+        versions = _stored_versions(session, task_id) or [_original(task)]
+    return [_map_version(version) for version in versions]
+
+
+@profiled("upload_version")
+def create_document_version(task_id: str, upload_file: UploadFile) -> DocumentVersionResponse:
+    """Store a new revision of a document and patch every ready store built from it in place."""
+
+    rules, size = validate_file(upload_file)
+    if not all(rule.passed for rule in rules):
+        error = {
+            "code": "DATASET_INVALID",
+            "message": "文档校验未通过",
+            "issues": [rule.dict() for rule in rules],
+        }
+        raise HTTPException(status_code=400, detail=error)
+
+    # revisions of one document are numbered and applied one at a time, across pre-fork workers too
+    with named_lock(f"document-{task_id}"):
+        with get_session() as session:
+            task = session.get(DocumentTask, task_id)
+            if not task:
+                raise HTTPException(status_code=404, detail="Document task not found")
+            if task.status != "success":
+                raise HTTPException(status_code=400, detail="文档尚未通过校验")
+            history = _stored_versions(session, task_id)
+            if not history:
+                history = [_original(task)]
+                session.add(history[0])
+            number = history[-1].version + 1
+            filename = upload_file.filename or task.file_name
+            path = save_upload_file(upload_file, task_id, number)
+            version = DocumentVersion(
+                version_id=uuid4().hex,
+                task_id=task_id,
+                version=number,
+                file_name=filename,
+                file_size=size,
+                file_path=str(path),
+                status="updating",
+            )
+            task.file_name = filename
+            task.file_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+            task.file_size = size
+            task.file_path = str(path)
+            task.validation = {"passed": True, "rules": [rule.dict() for rule in rules]}
+            task.updated_at = datetime.utcnow()
+            session.add(task)
+            session.add(version)
+            session.commit()
+            session.refresh(task)
+
+        changes: Dict[str, dict] = {}
+        status = "failed"
+        try:
+            segments = get_document_segments(task)
+            for record in vector_stores.stores_for_document(task_id):
+                try:
+                    changes[record.store_id] = vector_stores.update_document_chunks(record.store_id, task, segments)
+                except Exception as exc:
+                    logger.exception("Updating store %s to version %d of %s failed", record.store_id, number, task_id)
+                    changes[record.store_id] = {"error": str(exc)}
+            status = "failed" if any("error" in change for change in changes.values()) else "ready"
+        finally:
+            # a row left "updating" marks a revision whose process died before its stores were patched
+            with get_session() as session:
+                version = session.get(DocumentVersion, version.version_id)
+                version.changes = changes
+                version.status = status
+                session.add(version)
+                session.commit()
+                session.refresh(version)
+    return _map_version(version)
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+from fastapi import HTTPException
+
+from ..config import get_settings
+from . import chat, vector_stores
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _timed(call: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+
+def warm_up(models: Optional[bool] = None, store_ids: Optional[Sequence[str]] = None) -> Dict[str, float]:
+    """Build lazily-initialised models and preload hot stores before serving; returns seconds per step.
+
+    Defaults come from ``WARMUP_MODELS`` and ``WARMUP_STORE_IDS``; with neither set this is a no-op and
+    everything is built on first use instead.
+    """
+
+    timings: Dict[str, float] = {}
+    if settings.warmup_models if models is None else models:
+        timings["embeddings"] = _timed(vector_stores.get_embeddings)
+        timings["chat_model"] = _timed(chat.get_chat_model)
+        timings["rag_executor"] = _timed(chat.get_rag_executor)
+    for store_id in settings.warmup_store_ids if store_ids is None else store_ids:
+        try:
+            timings[f"store:{store_id}"] = _timed(lambda: vector_stores.preload_store(store_id))
+        except HTTPException as exc:
+            logger.warning("Skipping warm-up of vector store %s: %s", store_id, exc.detail)
+    if timings:
+        logger.info("Warm-up finished in %.3fs: %s", sum(timings.values()), timings)
+    return timings
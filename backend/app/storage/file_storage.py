@@ -10,9 +10,10 @@ from ..config import get_settings
 settings = get_settings()
 
 
-def save_upload_file(upload_file: UploadFile, task_id: str) -> Path:
+def save_upload_file(upload_file: UploadFile, task_id: str, version: int = 1) -> Path:
     extension = Path(upload_file.filename or "").suffix
-    target = settings.document_dir / f"{task_id}{extension}"
+    stem = task_id if version == 1 else f"{task_id}-v{version}"
+    target = settings.document_dir / f"{stem}{extension}"
     with target.open("wb") as buffer:
         shutil.copyfileobj(upload_file.file, buffer)
     upload_file.file.seek(0)
@@ -1,28 +1,173 @@
 ﻿from __future__ import annotations
 
+from collections import OrderedDict
+import os
 from pathlib import Path
-from typing import Optional
-
-from langchain_community.vectorstores import FAISS
-from langchain_core.embeddings import Embeddings
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Hashable, List, Optional, Sequence, Tuple
 
 from ..config import get_settings
+from ..utils import metrics, timing
+from ..utils.singleflight import SingleFlight
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import Embeddings
+    import numpy as np
 
 settings = get_settings()
+_load_flight = SingleFlight("store_load")
+_cache_lock = threading.Lock()
+# (store_id, shard, embeddings) -> (file version, loaded index), least recently used first
+_cache: "OrderedDict[Hashable, Tuple[Tuple[int, int], FAISS]]" = OrderedDict()
+_CENTROIDS = "centroids.npz"
+# a load that finds the index missing or replaced mid-read while a swap is under way retries this often
+_SWAP_RETRIES = 100
+_SWAP_RETRY_SECONDS = 0.01
+# store_id -> (file version, (document ids, centroid matrix))
+_centroid_cache: Dict[str, Tuple[Tuple[int, int], Tuple[List[str], "np.ndarray"]]] = {}
 
 
-def get_vector_store_path(store_id: str) -> Path:
-    return settings.vector_dir / store_id
+def get_vector_store_path(store_id: str, shard: Optional[int] = None) -> Path:
+    path = settings.vector_dir / store_id
+    return path if shard is None else path / f"shard-{shard:02d}"
 
 
-def save_vector_store(store: FAISS, store_id: str) -> None:
+def list_shards(store_id: str) -> List[int]:
     path = get_vector_store_path(store_id)
-    path.mkdir(parents=True, exist_ok=True)
-    store.save_local(str(path))
+    if not path.exists():
+        return []
+    return sorted(int(child.name[6:]) for child in path.glob("shard-[0-9]*") if child.is_dir())
 
 
-def load_vector_store(store_id: str, embeddings: Embeddings) -> Optional[FAISS]:
-    path = get_vector_store_path(store_id)
+def save_vector_store(store: FAISS, store_id: str, shard: Optional[int] = None) -> None:
+    path = get_vector_store_path(store_id, shard)
     if not path.exists():
+        path.mkdir(parents=True)
+        store.save_local(str(path))
+        return
+    # rebuilds are written aside and swapped in so readers never see a half-written index; between the
+    # two renames ``path`` is missing, which load_vector_store waits out (see _swapping)
+    staging = path.with_name(f"{path.name}.staging")
+    retired = path.with_name(f"{path.name}.retired")
+    shutil.rmtree(staging, ignore_errors=True)
+    store.save_local(str(staging))
+    path.rename(retired)
+    staging.rename(path)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def delete_vector_store(store_id: str, shard: Optional[int] = None) -> None:
+    shutil.rmtree(get_vector_store_path(store_id, shard), ignore_errors=True)
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == store_id and (shard is None or key[1] == shard)]:
+            del _cache[key]
+
+
+def _version(path: Path) -> Tuple[int, int]:
+    # inode + mtime change whenever save_vector_store swaps in a rebuild, here or in another worker
+    stat = (path / "index.faiss").stat()
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _swapping(path: Path) -> bool:
+    return path.with_name(f"{path.name}.staging").exists() or path.with_name(f"{path.name}.retired").exists()
+
+
+def load_vector_store(store_id: str, embeddings: Embeddings, shard: Optional[int] = None) -> Optional[FAISS]:
+    path = get_vector_store_path(store_id, shard)
+    for attempt in range(_SWAP_RETRIES + 1):
+        last = attempt == _SWAP_RETRIES
+        try:
+            version = _version(path)
+        except FileNotFoundError:
+            if last or not _swapping(path):
+                return None
+        else:
+            try:
+                store = _load_cached(path, (store_id, shard, id(embeddings)), version, embeddings)
+            except Exception:
+                # files renamed away or replaced while being read
+                if last or not (_swapping(path) or _changed(path, version)):
+                    raise
+            else:
+                if last or not _changed(path, version):
+                    return store
+        time.sleep(_SWAP_RETRY_SECONDS)
+    return None
+
+
+def _changed(path: Path, version: Tuple[int, int]) -> bool:
+    try:
+        return _version(path) != version
+    except FileNotFoundError:
+        return True
+
+
+def _load_cached(
+    path: Path, key: Tuple[str, Optional[int], int], version: Tuple[int, int], embeddings: Embeddings
+) -> FAISS:
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(key)
+            metrics.record_cache("vector_store", True)
+            return cached[1]
+    metrics.record_cache("vector_store", False)
+    with timing.stage("store_load"):
+        store = _load_flight.do(key + version, lambda: _load_from_disk(path, embeddings))
+    if settings.vector_store_cache_size > 0:
+        with _cache_lock:
+            _cache[key] = (version, store)
+            _cache.move_to_end(key)
+            while len(_cache) > settings.vector_store_cache_size:
+                _cache.popitem(last=False)
+    return store
+
+
+def open_vector_store(store_id: str, embeddings: Embeddings, shard: Optional[int] = None) -> Optional[FAISS]:
+    """A private, uncached copy to modify and pass back to ``save_vector_store``; readers keep the cached one."""
+
+    path = get_vector_store_path(store_id, shard)
+    if not (path / "index.faiss").exists():
         return None
-    return FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
+    return _load_from_disk(path, embeddings)
+
+
+def save_centroids(store_id: str, document_ids: Sequence[str], centroids: np.ndarray) -> None:
+    """Per-document centroid vectors, kept in the store root next to the chunk index(es)."""
+
+    import numpy as np
+
+    target = get_vector_store_path(store_id) / _CENTROIDS
+    staging = target.with_name(f".{_CENTROIDS}.tmp")
+    with staging.open("wb") as handle:
+        np.savez(handle, ids=np.asarray(list(document_ids), dtype=str), vectors=centroids)
+    os.replace(staging, target)
+
+
+def load_centroids(store_id: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    import numpy as np
+
+    path = get_vector_store_path(store_id) / _CENTROIDS
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    cached = _centroid_cache.get(store_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with np.load(path, allow_pickle=False) as data:
+        loaded = ([str(item) for item in data["ids"]], data["vectors"].astype(np.float32))
+    _centroid_cache[store_id] = (version, loaded)
+    return loaded
+
+
+def _load_from_disk(path: Path, embeddings: Embeddings) -> FAISS:
+    from langchain_community.vectorstores import FAISS
+
+    with metrics.FAISS_LOAD_LATENCY.time():
+        return FAISS.load_local(str(path), embeddings, allow_dangerous_deserialization=True)
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import hmac
+from typing import Optional
+
+from ..config import get_settings
+
+ADMIN_HEADER = "x-admin-token"
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """Constant-time check against ``ADMIN_TOKEN``; always false when no token is configured."""
+
+    expected = get_settings().admin_token
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from collections import defaultdict
+import hashlib
+import re
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+_SHINGLE = 3
+# below this many distinct shingles a fingerprint says little; such texts are only deduplicated exactly
+_MIN_SHINGLES = 8
+
+
+def simhash(text: str) -> Optional[int]:
+    """64-bit SimHash over the character 3-grams of the whitespace/case-normalized text.
+
+    Returns None for texts too short to fingerprint reliably.
+    """
+
+    normalized = _WHITESPACE.sub(" ", text).strip().casefold()
+    shingles = {normalized[index : index + _SHINGLE] for index in range(len(normalized) - _SHINGLE + 1)}
+    if len(shingles) < _MIN_SHINGLES:
+        return None
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    majority = bits.sum(axis=0) * 2 > len(shingles)
+    return int(np.packbits(majority, bitorder="little").view("<u8")[0])
+
+
+class Deduplicator:
+    """Classifies texts against the ones kept so far: ``"exact"``, ``"near"`` or None (then keeps it).
+
+    Near duplicates are texts whose SimHash differs in at most ``max_distance`` bits (negative
+    disables them). Fingerprints are split into ``max_distance + 1`` bands: two fingerprints within
+    the distance agree on at least one band, so only texts sharing a band value are compared.
+    """
+
+    def __init__(self, max_distance: int) -> None:
+        self.max_distance = max_distance
+        self._bands = max_distance + 1 if max_distance >= 0 else 0
+        self._width = 64 // self._bands if self._bands else 0
+        self._exact: Set[bytes] = set()
+        self._index: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(self._bands)]
+
+    def _keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self._width) - 1
+        return [(fingerprint >> (band * self._width)) & mask for band in range(self._bands)]
+
+    def check(self, text: str) -> Optional[str]:
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        if digest in self._exact:
+            return "exact"
+        fingerprint = simhash(text) if self._bands else None
+        keys = self._keys(fingerprint) if fingerprint is not None else []
+        for band, key in enumerate(keys):
+            for other in self._index[band].get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return "near"
+        self._exact.add(digest)
+        for band, key in enumerate(keys):
+            self._index[band][key].append(fingerprint)
+        return None
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Dict, Optional
+
+from ..config import get_settings
+from .lazy import Lazy
+
+if TYPE_CHECKING:
+    import httpx
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    if not settings.http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2=true but the h2 package is not installed, provider calls stay on HTTP/1.1")
+        return False
+    return True
+
+
+def request_timeout(read_seconds: Optional[float] = None) -> httpx.Timeout:
+    """Connect/read/write/pool timeouts from settings; ``read_seconds`` overrides the read timeout."""
+
+    import httpx
+
+    return httpx.Timeout(
+        connect=settings.http_connect_timeout_seconds,
+        read=settings.http_read_timeout_seconds if read_seconds is None else read_seconds,
+        write=settings.http_read_timeout_seconds,
+        pool=settings.http_pool_timeout_seconds,
+    )
+
+
+def _build_client() -> httpx.Client:
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry_seconds,
+    )
+    http2 = _http2_available()
+    logger.info(
+        "Provider HTTP client: %d connections (%d keep-alive), http2=%s",
+        settings.http_max_connections,
+        settings.http_max_keepalive_connections,
+        http2,
+    )
+    return httpx.Client(limits=limits, timeout=request_timeout(), http2=http2)
+
+
+# one pool shared by every chat model and embedding client; connections are opened on first use only,
+# so building it in the pre-fork master (warm-up) does not leave sockets shared between workers
+_client = Lazy(_build_client)
+
+
+def http_client() -> httpx.Client:
+    return _client.get()
+
+
+_probe_warned = False
+
+
+def pool_usage() -> Dict[str, float]:
+    """Connections of the shared pool by state; empty until the client has been built.
+
+    The counts come from httpx/httpcore internals; if those change, the probe reports nothing
+    instead of breaking ``/metrics``.
+    """
+
+    global _probe_warned
+    if not _client.loaded:
+        return {}
+    try:
+        pool = _client.get()._transport._pool
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        waiting = sum(1 for request in list(pool._requests) if request.is_queued())
+    except Exception as exc:
+        if not _probe_warned:
+            _probe_warned = True
+            logger.warning("HTTP pool usage is not available with this httpx version: %r", exc)
+        return {}
+    return {"active": len(connections) - idle, "idle": idle, "waiting": waiting, "limit": settings.http_max_connections}
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """Thread-safe holder that builds an expensive singleton on first use.
+
+    ``set`` installs a replacement (benchmarks, tests) and ``reset`` drops the value so the
+    next ``get`` rebuilds it from the factory.
+    """
+
+    def __init__(self, factory: Callable[[], T]) -> None:
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if self._loaded:
+            return self._value  # type: ignore[return-value]
+        with self._lock:
+            if not self._loaded:
+                self._value = self._factory()
+                self._loaded = True
+        return self._value  # type: ignore[return-value]
+
+    def set(self, value: T) -> None:
+        with self._lock:
+            self._value = value
+            self._loaded = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._value = None
+            self._loaded = False
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+import threading
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only hold within one process
+    fcntl = None
+
+from ..config import get_settings
+
+_LOCK_DIR = "locks"
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def named_lock(name: str) -> Iterator[None]:
+    """Block until no other thread, pre-fork worker or CLI process holds the lock called ``name``.
+
+    Threads of one process queue on a ``threading.Lock``; the holder then takes an ``flock`` on
+    ``<data_dir>/locks/<name>.lock`` so workers sharing the data directory exclude each other too.
+    """
+
+    with _locks_guard:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        directory = get_settings().data_dir / _LOCK_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        with (directory / f"{name}.lock").open("a") as handle:
+            if fcntl is not None:
+                # released when the handle is closed, or by the OS if the process dies
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
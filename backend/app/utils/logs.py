@@ -0,0 +1,175 @@
+"""Structured, non-blocking logging.
+
+A log call on a request thread costs a sampling check and a queue put: records are formatted and
+written by a listener thread. Below ERROR, records can be sampled per logger (``LOG_SAMPLE_RATES``)
+and long messages are clipped to ``LOG_MAX_FIELD_CHARS``; errors keep full detail.
+"""
+
+from __future__ import annotations
+
+import atexit
+import copy
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from typing import Any, Dict, Optional, Union
+
+from ..config import get_settings
+from .metrics import LOG_RECORDS_DROPPED
+
+settings = get_settings()
+
+TEXT_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+# arguments of these types cannot change after the call, so merging them into the message can wait
+# for the listener thread; anything else is rendered on the calling thread
+_DEFERRABLE = (str, int, float, type(None))
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_handler: Optional[StructuredQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def fingerprint(text: str) -> str:
+    """Short stable stand-in for a payload too large (or too private) to log verbatim."""
+
+    digest = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()[:12]
+    return f"sha1:{digest} ({len(text)} chars)"
+
+
+def clip(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…[{fingerprint(text)}]"
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of each logger's records below WARNING; the longest matching dotted prefix wins."""
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            prefix, rate = name, 1.0
+            while prefix:
+                if prefix in self.rates:
+                    rate = float(self.rates[prefix])
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra={...}`` fields become top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a bounded queue without formatting them; drops (and counts) records when full."""
+
+    def __init__(self, records: queue.Queue, max_chars: int) -> None:
+        super().__init__(records)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        detailed = record.levelno >= logging.ERROR
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _DEFERRABLE) for arg in args)):
+            record.msg, record.args = record.getMessage(), None
+        elif args and not detailed:
+            record.args = tuple(clip(arg, self.max_chars) if isinstance(arg, str) else arg for arg in args)
+        if not detailed and isinstance(record.msg, str):
+            record.msg = clip(record.msg, self.max_chars)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if record.levelno >= logging.ERROR:
+                self.queue.put(record, timeout=1.0)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(level=record.levelname)
+
+
+def _output() -> logging.Handler:
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def _start(*handlers: logging.Handler) -> None:
+    global _listener
+    _handler.queue = queue.Queue(settings.log_queue_size)
+    _listener = logging.handlers.QueueListener(_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    # the listener thread does not survive fork(); give the child its own queue and thread
+    if _listener is not None:
+        _start(*_listener.handlers)
+
+
+def configure_logging(level: Union[int, str, None] = None) -> None:
+    """Route the root logger through the queue. The first call wins; later calls are no-ops."""
+
+    global _handler
+    if _handler is not None:
+        return
+    root = logging.getLogger()
+    root.setLevel(level or settings.log_level.upper())
+    _handler = StructuredQueueHandler(queue.Queue(), settings.log_max_field_chars)
+    _handler.addFilter(SamplingFilter(settings.log_sample_rates))
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    _start(_output())
+    atexit.register(shutdown_logging)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records; call before ``os._exit`` (which skips atexit)."""
+
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelKey = Tuple[str, ...]
+# (pid, process still running, Registry.dump() of that process)
+Snapshot = Tuple[int, bool, Dict[str, List[Any]]]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def dump(self) -> List[Any]:
+        """This process's samples as JSON-able ``[label values, value]`` pairs."""
+
+        raise NotImplementedError
+
+    def collect_merged(self, snapshots: Sequence[Snapshot]) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, snapshots: Optional[Sequence[Snapshot]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self.collect() if snapshots is None else self.collect_merged(snapshots))
+        return lines
+
+    def _lines(self, values: Dict[LabelKey, float], labelnames: Optional[Sequence[str]] = None) -> List[str]:
+        names = self.labelnames if labelnames is None else labelnames
+        return [
+            f"{self.name}{_format_labels(names, key)} {_format_value(value)}" for key, value in sorted(values.items())
+        ]
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def collect(self) -> List[str]:
+        return self._lines(self.samples())
+
+    def dump(self) -> List[Any]:
+        return [[list(key), value] for key, value in self.samples().items()]
+
+    def collect_merged(self, snapshots: Sequence[Snapshot]) -> List[str]:
+        # counts of exited workers are kept so the sum never goes backwards
+        totals: Dict[LabelKey, float] = {}
+        for _, _, dumped in snapshots:
+            for key, value in dumped.get(self.name, ()):
+                totals[tuple(key)] = totals.get(tuple(key), 0.0) + value
+        return self._lines(totals)
+
+
+class Gauge(_Metric):
+    """Gauge with optional scrape-time callback returning ``{label_values: value}``."""
+
+    metric_type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Dict[LabelKey, float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            values = dict(self._values)
+        if self._callback is not None:
+            values.update(self._callback())
+        return values
+
+    def collect(self) -> List[str]:
+        return self._lines(self.samples())
+
+    def dump(self) -> List[Any]:
+        return [[list(key), value] for key, value in self.samples().items()]
+
+    def collect_merged(self, snapshots: Sequence[Snapshot]) -> List[str]:
+        # states, ratios and in-flight counts do not add up meaningfully: one series per running process
+        values = {
+            (*key, str(pid)): value
+            for pid, alive, dumped in snapshots
+            if alive
+            for key, value in dumped.get(self.name, ())
+        }
+        return self._lines(values, (*self.labelnames, "pid"))
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> Dict[LabelKey, Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total[0]) for key, (counts, total) in self._values.items()}
+
+    def dump(self) -> List[Any]:
+        return [[list(key), counts, total] for key, (counts, total) in self.samples().items()]
+
+    def collect_merged(self, snapshots: Sequence[Snapshot]) -> List[str]:
+        merged: Dict[LabelKey, Tuple[List[int], float]] = {}
+        for _, _, dumped in snapshots:
+            for key, counts, total in dumped.get(self.name, ()):
+                previous = merged.get(tuple(key))
+                if previous is not None:
+                    counts, total = [a + b for a, b in zip(previous[0], counts)], previous[1] + total
+                merged[tuple(key)] = (counts, total)
+        return self._render_buckets(merged)
+
+    def collect(self) -> List[str]:
+        return self._render_buckets(self.samples())
+
+    def _render_buckets(self, snapshot: Dict[LabelKey, Tuple[List[int], float]]) -> List[str]:
+        lines: List[str] = []
+        for key, (counts, total) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def dump(self) -> Dict[str, List[Any]]:
+        return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def fold(self, into: Dict[str, List[Any]], dumped: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+        """Add an exited process's counters and histograms to ``into``; its gauges no longer apply."""
+
+        for name, samples in dumped.items():
+            metric = self._metrics.get(name)
+            if metric is None or metric.metric_type not in ("counter", "histogram"):
+                continue
+            merged = {tuple(key): rest for key, *rest in into.get(name, ())}
+            for key, *rest in samples:
+                previous = merged.get(tuple(key))
+                if previous is None:
+                    merged[tuple(key)] = rest
+                elif metric.metric_type == "counter":
+                    merged[tuple(key)] = [previous[0] + rest[0]]
+                else:
+                    merged[tuple(key)] = [[a + b for a, b in zip(previous[0], rest[0])], previous[1] + rest[1]]
+            into[name] = [[list(key), *rest] for key, rest in merged.items()]
+        return into
+
+    def render(self, snapshots: Optional[Sequence[Snapshot]] = None) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(snapshots))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# counters and histograms of exited processes, folded in by the pre-fork master
+_ARCHIVE = "archive.json"
+
+
+class _SharedSamples:
+    """Pre-fork mode: every process publishes its samples to ``directory``; scrapes merge them all.
+
+    Files are named ``<pid>-<start time>.json`` so a reused pid never overwrites an earlier process.
+    """
+
+    def __init__(self, directory: Path, interval: float) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.pid = os.getpid()
+        self.name = f"{self.pid}-{time.time_ns()}"
+        # the publisher thread and the final publish on exit share one staging file
+        self.lock = threading.Lock()
+
+    def publish(self) -> None:
+        target = self.directory / f"{self.name}.json"
+        staging = target.with_suffix(".tmp")
+        with self.lock:
+            staging.write_text(json.dumps(REGISTRY.dump()), encoding="utf-8")
+            os.replace(staging, target)
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except OSError as exc:
+                logger.warning("Could not publish metrics to %s: %s", self.directory, exc)
+
+    def snapshots(self) -> List[Snapshot]:
+        found: List[Snapshot] = [(self.pid, True, REGISTRY.dump())]
+        for path in self.directory.glob("*.json"):
+            if path.stem == self.name:
+                continue
+            pid = 0 if path.name == _ARCHIVE else int(path.stem.partition("-")[0])
+            try:
+                found.append((pid, pid != 0 and _running(pid), json.loads(path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError):
+                continue  # removed or being replaced
+        return found
+
+
+def _running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_shared: Optional[_SharedSamples] = None
+
+
+def share_across_processes(directory: Path, interval: float) -> None:
+    """Make ``render`` report the whole pre-fork server, not only the worker that answers the scrape.
+
+    Counters and histograms are summed over every process that ever published (exited workers are
+    folded into an archive file by the master); gauges get a ``pid`` label per running process. Other processes' samples are at most
+    ``interval`` seconds old.
+    """
+
+    global _shared
+    _shared = _SharedSamples(directory, interval)
+    _shared.publish()
+    threading.Thread(target=_shared.run, name="metrics-publisher", daemon=True).start()
+
+
+def clear_shared(directory: Path) -> None:
+    """Pre-fork master at startup: drop samples left behind by an earlier server using ``directory``."""
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in [*directory.glob("*.json"), *directory.glob("*.tmp")]:
+        path.unlink(missing_ok=True)
+
+
+def mark_process_dead(directory: Path, pid: int) -> None:
+    """Pre-fork master, after reaping ``pid``: fold its samples into the archive and remove its file.
+
+    Only the master writes the archive, so folds never race each other.
+    """
+
+    archive_path = directory / _ARCHIVE
+    for path in directory.glob(f"{pid}-*.json"):
+        try:
+            dumped = json.loads(path.read_text(encoding="utf-8"))
+            archive = json.loads(archive_path.read_text(encoding="utf-8")) if archive_path.exists() else {}
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not archive metrics of process %d: %s", pid, exc)
+            continue
+        staging = archive_path.with_suffix(".tmp")
+        staging.write_text(json.dumps(REGISTRY.fold(archive, dumped)), encoding="utf-8")
+        os.replace(staging, archive_path)
+        path.unlink()
+    for path in directory.glob(f"{pid}-*.tmp"):
+        path.unlink(missing_ok=True)
+
+
+def publish_shared() -> None:
+    """Final publish before a process exits, so none of its counts are lost."""
+
+    if _shared is not None:
+        _shared.publish()
+
+
+def render() -> str:
+    return REGISTRY.render(_shared.snapshots() if _shared is not None else None)
+
+
+HTTP_REQUESTS = Counter("rag_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("rag_http_request_seconds", "HTTP request latency", ("method", "route"))
+HTTP_INFLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests currently being served")
+
+GRAPH_NODE_LATENCY = Histogram("rag_graph_node_seconds", "LangGraph node latency", ("node",))
+LLM_LATENCY = Histogram("rag_llm_call_seconds", "Chat model call latency", ("outcome",))
+LLM_FIRST_TOKEN_LATENCY = Histogram("rag_llm_first_token_seconds", "Chat model time to first streamed token")
+LLM_INFLIGHT = Gauge("rag_llm_calls_in_flight", "Chat model calls currently in flight")
+LLM_QUEUE_DEPTH = Gauge("rag_llm_queue_depth", "Chat model calls waiting for a scheduler slot", ("lane",))
+LLM_BREAKER_STATE = Gauge("rag_llm_breaker_state", "Chat model circuit breaker state (0 closed, 1 half-open, 2 open)")
+LLM_SCHEDULER_REJECTIONS = Counter(
+    "rag_llm_scheduler_rejections_total", "Chat model calls rejected by the scheduler", ("lane", "reason")
+)
+
+EMBEDDING_LATENCY = Histogram(
+    "rag_embedding_call_seconds", "Embedding call latency", ("backend", "operation", "outcome")
+)
+TOKENS = Counter(
+    "rag_tokens_total",
+    "Model tokens by kind (prompt, completion, embedding), model and source (reported by the provider or estimated)",
+    ("kind", "model", "source"),
+)
+EMBEDDING_TEXTS = Counter("rag_embedding_texts_total", "Texts sent to embedding backends", ("backend", "operation"))
+EMBEDDING_INFLIGHT = Gauge("rag_embedding_calls_in_flight", "Embedding calls currently in flight")
+EMBEDDING_BACKEND_STATE = Gauge(
+    "rag_embedding_backend_state",
+    "Embedding backend circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ("backend",),
+)
+EMBEDDING_FAILOVERS = Counter(
+    "rag_embedding_failovers_total",
+    "Embedding calls routed past a backend, by skipped backend and reason (error, unhealthy)",
+    ("backend", "reason"),
+)
+
+FAISS_LOAD_LATENCY = Histogram("rag_faiss_load_seconds", "FAISS index load latency from disk")
+FAISS_SEARCH_LATENCY = Histogram("rag_faiss_search_seconds", "FAISS similarity search latency")
+STORE_BUILD_LATENCY = Histogram("rag_store_build_seconds", "Vector store build latency", ("backend",))
+STORE_BUILDS_INFLIGHT = Gauge("rag_store_builds_in_flight", "Vector store builds currently running")
+
+EXTRACT_LATENCY = Histogram("rag_text_extract_seconds", "Document text extraction latency", ("format", "outcome"))
+
+DB_SESSION_LATENCY = Histogram("rag_db_session_seconds", "Database session lifetime")
+DB_SESSIONS_INFLIGHT = Gauge("rag_db_sessions_in_flight", "Database sessions currently open")
+
+SINGLEFLIGHT_CALLS = Counter(
+    "rag_singleflight_calls_total",
+    "Deduplicated calls by group; role=follower counts calls coalesced onto an in-flight leader",
+    ("group", "role"),
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "rag_log_records_dropped_total", "Log records dropped because the logging queue was full", ("level",)
+)
+
+CACHE_LOOKUPS = Counter("rag_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _cache_hit_ratios() -> Dict[LabelKey, float]:
+    totals: Dict[str, List[float]] = {}
+    for (cache, result), value in CACHE_LOOKUPS.samples().items():
+        entry = totals.setdefault(cache, [0.0, 0.0])
+        entry[0 if result == "hit" else 1] += value
+    return {(cache,): hits / (hits + misses) for cache, (hits, misses) in totals.items() if hits + misses}
+
+
+CACHE_HIT_RATIO = Gauge("rag_cache_hit_ratio", "Cache hit ratio since process start", ("cache",), _cache_hit_ratios)
+
+
+def _http_pool_usage() -> Dict[LabelKey, float]:
+    from .http_client import pool_usage
+
+    return {(state,): value for state, value in pool_usage().items()}
+
+
+HTTP_POOL_CONNECTIONS = Gauge(
+    "rag_http_pool_connections",
+    "Shared provider HTTP pool: active and idle connections, queued requests (waiting) and the limit",
+    ("state",),
+    _http_pool_usage,
+)
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import cProfile
+from contextvars import ContextVar, Token
+from datetime import datetime
+import functools
+import logging
+from pathlib import Path
+import re
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+from uuid import uuid4
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_PROFILE_NAME = re.compile(r"^[0-9T]+-[a-z_]+-[0-9a-f]{8}\.prof$")
+
+# profile ids captured for the current request; None when the request did not ask for profiling
+_requested: ContextVar[Optional[List[str]]] = ContextVar("profile_requested", default=None)
+_active: ContextVar[bool] = ContextVar("profile_active", default=False)
+
+
+def activate() -> Token:
+    return _requested.set([])
+
+
+def deactivate(token: Token) -> None:
+    _requested.reset(token)
+
+
+def captured() -> List[str]:
+    return list(_requested.get() or [])
+
+
+def profiled(name: str, always: Callable[[], bool] = lambda: False) -> Callable[[F], F]:
+    """Run the wrapped call under cProfile when the current request opted in (or ``always()``).
+
+    Costs one context-variable lookup per call otherwise. Nested profiled calls are folded into
+    the outermost profile; work handed to other threads (e.g. shard searches) is not captured.
+    """
+
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            sink = _requested.get()
+            if _active.get() or (sink is None and not always()):
+                return fn(*args, **kwargs)
+            profiler = cProfile.Profile()
+            token = _active.set(True)
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                _active.reset(token)
+                profile_id = _dump(profiler, name)
+                if sink is not None:
+                    sink.append(profile_id)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def _dump(profiler: cProfile.Profile, name: str) -> str:
+    settings.profile_dir.mkdir(parents=True, exist_ok=True)
+    profile_id = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{name}-{uuid4().hex[:8]}.prof"
+    profiler.dump_stats(str(settings.profile_dir / profile_id))
+    logger.info("Wrote profile %s", profile_id)
+    for stale in list_profiles()[settings.profile_max_files:]:
+        (settings.profile_dir / stale["name"]).unlink(missing_ok=True)
+    return profile_id
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Stored profiles, newest first."""
+
+    if not settings.profile_dir.exists():
+        return []
+    entries = []
+    for path in settings.profile_dir.glob("*.prof"):
+        stat = path.stat()
+        entries.append(
+            {"name": path.name, "size": stat.st_size, "createdAt": datetime.utcfromtimestamp(stat.st_mtime)}
+        )
+    return sorted(entries, key=lambda entry: entry["name"], reverse=True)
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    if not _PROFILE_NAME.match(profile_id):
+        return None
+    path = settings.profile_dir / profile_id
+    return path if path.is_file() else None
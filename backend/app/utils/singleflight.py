@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution shared by every caller.
+
+    Only calls that overlap in time are coalesced; nothing is cached once the leader returns.
+    Results are shared objects, so callers must treat them as read-only.
+    """
+
+    def __init__(self, group: str) -> None:
+        self.group = group
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call[Any]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.SINGLEFLIGHT_CALLS.inc(group=self.group, role="follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result  # type: ignore[return-value]
+
+        metrics.SINGLEFLIGHT_CALLS.inc(group=self.group, role="leader")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
@@ -1,10 +1,37 @@
 ﻿from __future__ import annotations
 
+import math
+import re
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, NamedTuple, Optional
 
+from . import metrics
 
-def _extract_pdf_with_pypdf(path: Path) -> Optional[str]:
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+_MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+(.+?)\s*#*$")
+# "第三章 报销范围", "第2节 ...", "4.1 适用对象": numbered headings in plain text and PDFs
+_NUMBERED_HEADING = re.compile(r"^(第[一二三四五六七八九十百零〇\d]+[章节篇部分]|\d+(\.\d+)+)\s*\S")
+_MAX_HEADING_LENGTH = 40
+
+
+class TextSegment(NamedTuple):
+    """A run of text on one page (PDFs) under one heading; chunks never cross segment boundaries."""
+
+    text: str
+    page: Optional[int] = None
+    section: Optional[str] = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough tokenizer-free count: one token per CJK character, one per ~4 other characters."""
+
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _extract_pdf_with_pypdf(path: Path) -> Optional[List[str]]:
     try:
         from PyPDF2 import PdfReader
         from PyPDF2.errors import PdfReadError
@@ -31,11 +58,10 @@ def _extract_pdf_with_pypdf(path: Path) -> Optional[str]:
         except Exception:
             text = ""
         text_parts.append(text)
-    combined = "\n".join(text_parts).strip()
-    return combined or None
+    return text_parts if "".join(text_parts).strip() else None
 
 
-def _extract_pdf_with_pdfminer(path: Path) -> Optional[str]:
+def _extract_pdf_with_pdfminer(path: Path) -> Optional[List[str]]:
     try:
         from pdfminer.high_level import extract_text as pdfminer_extract
     except ImportError:
@@ -45,17 +71,82 @@ def _extract_pdf_with_pdfminer(path: Path) -> Optional[str]:
         text = pdfminer_extract(str(path))
     except Exception:
         return None
-    return text.strip() or None
+    # pdfminer ends every page with a form feed
+    return text.split("\f") if text.strip() else None
 
 
 def extract_text(path: Path) -> str:
+    return "\n".join(_extract_pages(path)).strip()
+
+
+def extract_segments(path: Path) -> List[TextSegment]:
+    """Text split at page boundaries (PDFs) and headings, each part tagged with its page and section."""
+
+    paged = path.suffix.lower() == ".pdf"
+    markdown = path.suffix.lower() == ".md"
+    segments: List[TextSegment] = []
+    section: Optional[str] = None
+    for number, page in enumerate(_extract_pages(path), start=1):
+        lines: List[str] = []
+        for line in page.splitlines():
+            heading = _heading(line, markdown)
+            if heading is not None:
+                _flush(segments, lines, number if paged else None, section)
+                lines, section = [], heading
+            lines.append(line)
+        _flush(segments, lines, number if paged else None, section)
+    return segments
+
+
+def _heading(line: str, markdown: bool) -> Optional[str]:
+    line = line.strip()
+    if not line or len(line) > _MAX_HEADING_LENGTH:
+        return None
+    if markdown:
+        match = _MARKDOWN_HEADING.match(line)
+        return match.group(1) if match else None
+    return line if _NUMBERED_HEADING.match(line) else None
+
+
+def _flush(segments: List[TextSegment], lines: List[str], page: Optional[int], section: Optional[str]) -> None:
+    text = "\n".join(lines)
+    if text.strip():
+        segments.append(TextSegment(text, page, section))
+
+
+def _extract_pages(path: Path) -> List[str]:
     ext = path.suffix.lower()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        pages = _read_pages(path, ext)
+        outcome = "ok"
+        return pages
+    finally:
+        metrics.EXTRACT_LATENCY.observe(time.perf_counter() - start, format=ext.lstrip(".") or "none", outcome=outcome)
+
+
+def _read_pages(path: Path, ext: str) -> List[str]:
     if ext in {".txt", ".md"}:
-        return path.read_text(encoding="utf-8", errors="ignore")
+        return [path.read_text(encoding="utf-8", errors="ignore")]
     if ext == ".pdf":
         for extractor in (_extract_pdf_with_pypdf, _extract_pdf_with_pdfminer):
-            text = extractor(path)
-            if text:
-                return text
+            pages = extractor(path)
+            if pages:
+                return pages
         raise RuntimeError("无法解析 PDF 文档内容，请确认文件未加密且内容可复制")
     raise ValueError(f"Unsupported extension: {ext}")
+
+
+def check_content(path: str | Path, min_length: int) -> Dict[str, Any]:
+    """Content validation rule for a stored file; picklable so it can run in a worker process."""
+
+    try:
+        text = extract_text(Path(path))
+    except Exception as exc:
+        return {"rule": "content_parse", "passed": False, "detail": str(exc)}
+    return {
+        "rule": "content_length",
+        "passed": len(text.strip()) >= min_length,
+        "detail": f">= {min_length} characters",
+    }
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, Iterator, Optional
+
+
+class RequestTimings:
+    """Accumulates per-stage wall time (seconds) for a single request."""
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def set(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stages[stage] = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, rounded for display."""
+        with self._lock:
+            return {stage: round(seconds * 1000, 3) for stage, seconds in self._stages.items()}
+
+    def server_timing(self) -> str:
+        entries = [f"{stage};dur={duration}" for stage, duration in self.as_dict().items()]
+        total = round((time.perf_counter() - self.started_at) * 1000, 3)
+        entries.append(f"total;dur={total}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def activate() -> Token:
+    return _current.set(RequestTimings())
+
+
+def deactivate(token: Token) -> None:
+    _current.reset(token)
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+def record(stage: str, seconds: float) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
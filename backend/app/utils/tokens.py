@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from .metrics import TOKENS
+from .text import estimate_tokens
+
+
+class TokenUsage:
+    """Tokens spent by one unit of work (a chat turn, a batch question, a store build); thread-safe.
+
+    ``estimated`` is set once any chat count came from the local estimate instead of the provider;
+    embedding counts are always estimated (the LangChain embedding clients drop the reported usage).
+    ``coalesced`` is set once any chat count is that of a model call shared with another request.
+    """
+
+    def __init__(self) -> None:
+        self.prompt = 0
+        self.completion = 0
+        self.embedding = 0
+        self.estimated = False
+        self.coalesced = False
+        self._lock = threading.Lock()
+
+    def add(
+        self, prompt: int = 0, completion: int = 0, embedding: int = 0, estimated: bool = False, coalesced: bool = False
+    ) -> None:
+        with self._lock:
+            self.prompt += prompt
+            self.completion += completion
+            self.embedding += embedding
+            self.estimated = self.estimated or estimated
+            self.coalesced = self.coalesced or coalesced
+
+    def merge(self, counts: Dict[str, Any]) -> None:
+        self.add(
+            counts.get("promptTokens", 0),
+            counts.get("completionTokens", 0),
+            counts.get("embeddingTokens", 0),
+            counts.get("estimated", False),
+            counts.get("coalesced", False),
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "promptTokens": self.prompt,
+                "completionTokens": self.completion,
+                "embeddingTokens": self.embedding,
+                "estimated": self.estimated,
+                "coalesced": self.coalesced,
+            }
+
+
+_current: ContextVar[Optional[TokenUsage]] = ContextVar("token_usage", default=None)
+
+
+@contextmanager
+def metering() -> Iterator[TokenUsage]:
+    """Collect the tokens of every model call made in this context (threads started with a copy included)."""
+
+    usage = TokenUsage()
+    token = _current.set(usage)
+    try:
+        yield usage
+    finally:
+        _current.reset(token)
+
+
+def record_chat(model: str, prompt: int, completion: int, estimated: bool) -> None:
+    source = "estimated" if estimated else "reported"
+    TOKENS.inc(prompt, kind="prompt", model=model, source=source)
+    TOKENS.inc(completion, kind="completion", model=model, source=source)
+    usage = _current.get()
+    if usage is not None:
+        usage.add(prompt=prompt, completion=completion, estimated=estimated)
+
+
+def record_coalesced(prompt: int, completion: int, estimated: bool) -> None:
+    """Attribute a shared model call to this context too; the provider was billed once (by the leader)."""
+
+    usage = _current.get()
+    if usage is not None:
+        usage.add(prompt=prompt, completion=completion, estimated=estimated, coalesced=True)
+
+
+def record_embedding(backend: str, texts: Iterable[str]) -> None:
+    count = sum(estimate_tokens(text) for text in texts)
+    TOKENS.inc(count, kind="embedding", model=backend, source="estimated")
+    usage = _current.get()
+    if usage is not None:
+        usage.add(embedding=count)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+_VOCABULARY = (
+    "企业 知识库 检索 增强 生成 文档 向量 索引 召回 会话 模型 回答 引用 片段 配置 部署 监控 日志 "
+    "权限 流程 审批 报销 合同 制度 规范 培训 安全 合规 数据 备份 网络 服务 接口 版本 发布 测试 "
+    "LangChain LangGraph FAISS FastAPI SQLModel embedding retrieval pipeline latency throughput"
+).split()
+
+
+def synthetic_document(seed: int, chars: int) -> str:
+    """Deterministic pseudo-text of roughly ``chars`` characters with paragraph breaks."""
+
+    rng = random.Random(seed)
+    parts: List[str] = [f"# 文档 {seed}\n\n"]
+    size = len(parts[0])
+    sentence: List[str] = []
+    while size < chars:
+        word = rng.choice(_VOCABULARY)
+        sentence.append(word)
+        size += len(word) + 1
+        if len(sentence) >= rng.randint(8, 20):
+            ending = "\n\n" if rng.random() < 0.2 else "。"
+            parts.append(" ".join(sentence) + ending)
+            size += len(ending)
+            sentence = []
+    if sentence:
+        parts.append(" ".join(sentence) + "。")
+    return "".join(parts)
+
+
+def synthetic_questions(seed: int, count: int) -> List[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(_VOCABULARY)} 和 {rng.choice(_VOCABULARY)} 的关系是什么？" for _ in range(count)]
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words hashing embedder, stable across processes and runs."""
+
+    def __init__(self, dim: int = 256) -> None:
+        self.dim = dim
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:  # type: ignore[override]
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:  # type: ignore[override]
+        vector = [0.0] * self.dim
+        for token in text.split():
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
@@ -0,0 +1,261 @@
+"""Local OpenAI-compatible stand-in for load testing the real chat and embedding code paths.
+
+Usage (from ``backend/``)::
+
+    python -m benchmarks.mock_openai --port 9100 --latency lognormal:0.4:0.5 \\
+        --tokens-per-second 40 --error-rate 0.01 --max-concurrency 64
+
+then point the backend at it::
+
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 EMBED_BASE_URL=http://127.0.0.1:9100/v1 \\
+    OPENAI_API_KEY=mock DEEPSEEK_API_KEY= uvicorn app.main:app --port 8002
+
+Supports ``/v1/chat/completions`` (plain and streaming SSE), ``/v1/embeddings`` and
+``/v1/models``. Latency, token rate, error rate and an upstream concurrency cap are configurable
+so timeouts, queueing and backpressure can be exercised on a single machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORDS = "知识 检索 回答 文档 引用 模型 服务 系统 数据 流程 配置 结果".split()
+
+
+@dataclass
+class LatencyDistribution:
+    """Seconds of latency drawn per call: ``fixed:S``, ``uniform:LO:HI``, ``normal:MEAN:STD`` or ``lognormal:MEDIAN:SIGMA``."""
+
+    kind: str = "fixed"
+    params: Sequence[float] = (0.0,)
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, _, rest = spec.partition(":")
+        params = tuple(float(part) for part in rest.split(":") if part) or (0.0,)
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec {spec!r}")
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            value = rng.uniform(*self.params)
+        elif self.kind == "normal":
+            value = rng.gauss(*self.params)
+        elif self.kind == "lognormal":
+            median, sigma = self.params
+            value = rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        else:
+            value = self.params[0]
+        return max(0.0, value)
+
+
+@dataclass
+class MockConfig:
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    embedding_latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    tokens_per_second: float = 0.0
+    completion_tokens: int = 48
+    embedding_dim: int = 256
+    error_rate: float = 0.0
+    error_status: int = 500
+    max_concurrency: int = 0
+    seed: Optional[int] = None
+
+
+class _State:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+
+def _error(status: int, message: str, kind: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"message": message, "type": kind, "code": status}})
+
+
+def _completion_text(messages: List[Dict[str, Any]], tokens: int) -> List[str]:
+    prompt = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+    return [rng.choice(_WORDS) for _ in range(max(1, tokens))]
+
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(max(1, len(str(message.get("content", ""))) // 2) for message in messages)
+
+
+def _embed(value: Any, dim: int) -> List[float]:
+    text = value if isinstance(value, str) else json.dumps(value)
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(item * item for item in vector)) or 1.0
+    return [item / norm for item in vector]
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    state = _State(config or MockConfig())
+    app = FastAPI(title="Mock OpenAI", docs_url=None, redoc_url=None)
+    app.state.mock = state
+
+    async def admit() -> Optional[JSONResponse]:
+        state.requests += 1
+        cfg = state.config
+        if cfg.max_concurrency and state.in_flight >= cfg.max_concurrency:
+            state.errors += 1
+            return _error(429, "Rate limit reached: too many concurrent requests", "rate_limit_error")
+        if cfg.error_rate and state.rng.random() < cfg.error_rate:
+            state.errors += 1
+            return _error(cfg.error_status, "Injected upstream failure", "server_error")
+        return None
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock-chat", "object": "model"}, {"id": "mock-embed", "object": "model"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": state.requests, "errors": state.errors, "inFlight": state.in_flight}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        rejected = await admit()
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        cfg = state.config
+        messages = body.get("messages", [])
+        model = body.get("model", "mock-chat")
+        tokens = _completion_text(messages, int(body.get("max_tokens") or cfg.completion_tokens))
+        token_delay = 1.0 / cfg.tokens_per_second if cfg.tokens_per_second > 0 else 0.0
+        first_token_delay = cfg.latency.sample(state.rng)
+        completion_id = f"chatcmpl-{uuid4().hex}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": _prompt_tokens(messages),
+            "completion_tokens": len(tokens),
+            "total_tokens": _prompt_tokens(messages) + len(tokens),
+        }
+
+        if not body.get("stream"):
+            state.in_flight += 1
+            try:
+                await asyncio.sleep(first_token_delay + token_delay * len(tokens))
+            finally:
+                state.in_flight -= 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}
+                ],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        async def events() -> AsyncIterator[bytes]:
+            state.in_flight += 1
+            try:
+                await asyncio.sleep(first_token_delay)
+                yield chunk({"role": "assistant", "content": ""})
+                for token in tokens:
+                    if token_delay:
+                        await asyncio.sleep(token_delay)
+                    yield chunk({"content": token})
+                yield chunk({}, "stop")
+                if include_usage:
+                    usage_chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    yield f"data: {json.dumps(usage_chunk)}\n\n".encode("utf-8")
+                yield b"data: [DONE]\n\n"
+            finally:
+                state.in_flight -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        rejected = await admit()
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        cfg = state.config
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dim = int(body.get("dimensions") or cfg.embedding_dim)
+        state.in_flight += 1
+        try:
+            await asyncio.sleep(cfg.embedding_latency.sample(state.rng))
+        finally:
+            state.in_flight -= 1
+        tokens = sum(len(item) if isinstance(item, list) else max(1, len(str(item)) // 2) for item in inputs)
+        return {
+            "object": "list",
+            "model": body.get("model", "mock-embed"),
+            "data": [{"object": "embedding", "index": index, "embedding": _embed(item, dim)} for index, item in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    return app
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=LatencyDistribution.parse, default=LatencyDistribution(),
+                        help="time to first token, e.g. fixed:0.2, uniform:0.1:0.6, lognormal:0.4:0.5")
+    parser.add_argument("--embedding-latency", type=LatencyDistribution.parse, default=LatencyDistribution())
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 streams all tokens at once")
+    parser.add_argument("--completion-tokens", type=int, default=48)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--max-concurrency", type=int, default=0, help="reject with 429 above this many in-flight calls")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    options = vars(args)
+    host, port = options.pop("host"), options.pop("port")
+    uvicorn.run(create_app(MockConfig(**options)), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
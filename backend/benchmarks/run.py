@@ -0,0 +1,354 @@
+"""Offline benchmark suite for the RAG backend.
+
+Usage (from ``backend/``)::
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --documents 5 --store-sizes 20000 --chat-messages 20  # quick run
+
+Everything runs in-process against a temporary data directory with a deterministic
+hashing embedder and a fake chat model, so results are comparable across commits.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+
+from .fixtures import HashingEmbeddings, synthetic_document, synthetic_questions
+
+
+@dataclass
+class BenchmarkConfig:
+    documents: int = 20
+    doc_chars: int = 4000
+    store_sizes: Sequence[int] = (20_000, 100_000, 400_000)
+    chunk_size: int = 512
+    overlap: int = 64
+    shards: int = 1
+    top_ks: Sequence[int] = (1, 5, 20)
+    recall_queries: int = 200
+    chat_messages: int = 100
+    concurrency: Sequence[int] = (1, 4, 16)
+    embedding_dim: int = 256
+    llm_token_delay: float = 0.0
+    startup_runs: int = 3
+    seed: int = 7
+    log_level: str = "WARNING"
+    sections: Sequence[str] = field(
+        default_factory=lambda: ("startup", "upload", "extract", "build", "recall", "chat")
+    )
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds using nearest-rank percentiles."""
+
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return round(ordered[index] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _timed(call: Callable[[], Any]) -> tuple[float, Any]:
+    start = time.perf_counter()
+    result = call()
+    return time.perf_counter() - start, result
+
+
+_STARTUP_PROBE = """
+import json, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    ready = time.perf_counter()
+    client.get("/healthz").raise_for_status()
+    first_request = time.perf_counter()
+    from app.services import chat, vector_stores
+    vector_stores.get_embeddings(); chat.get_chat_model(); chat.get_rag_executor()
+    models = time.perf_counter()
+print(json.dumps({"import": imported - start, "ready": ready - start,
+                  "first_request": first_request - ready, "models": models - first_request}))
+"""
+
+
+def _environment(workdir: Path) -> Dict[str, str]:
+    return {
+        "DATA_DIR": str(workdir / "db"),
+        "DOCUMENT_DIR": str(workdir / "documents"),
+        "VECTOR_DIR": str(workdir / "vectors"),
+        "OPENAI_API_KEY": "test-key",
+        "DEEPSEEK_API_KEY": "test-key",
+        "EMBED_API_KEY": "test-key",
+    }
+
+
+def bench_startup(config: BenchmarkConfig, workdir: Path) -> Dict[str, Any]:
+    """Cold-process import, app-ready, first-request and lazy model construction times."""
+
+    env = {**os.environ, **_environment(workdir / "startup"), "PYTHONDONTWRITEBYTECODE": "1"}
+    samples: Dict[str, List[float]] = {}
+    for _ in range(config.startup_runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).resolve().parents[1], env=env,
+        ).stdout
+        for stage, seconds in json.loads(output.strip().splitlines()[-1]).items():
+            samples.setdefault(stage, []).append(seconds)
+    return {stage: summarize(values) for stage, values in samples.items()}
+
+
+def prepare_environment(workdir: Path) -> None:
+    """Point settings at ``workdir`` and disable real providers; must run before ``app`` is imported."""
+
+    if "app.config" in sys.modules:
+        return
+    os.environ.update(_environment(workdir))
+
+
+@contextmanager
+def local_models(config: BenchmarkConfig) -> Iterator[None]:
+    """Swap in the deterministic embedder and fake chat model for the duration of the run."""
+
+    from langchain_community.chat_models import FakeListChatModel
+
+    from app.services import chat, vector_stores
+    from app.services.embeddings import EmbeddingRouter, InstrumentedEmbeddings
+
+    vector_stores._router.set(
+        EmbeddingRouter([InstrumentedEmbeddings(HashingEmbeddings(config.embedding_dim), "default")])
+    )
+    chat._chat_model.set(
+        FakeListChatModel(
+            responses=["这是基准测试使用的固定回答，用于衡量检索与编排开销。"],
+            sleep=config.llm_token_delay or None,
+        )
+    )
+    try:
+        yield
+    finally:
+        vector_stores._router.reset()
+        chat._chat_model.reset()
+
+
+def _upload(client: Any, name: str, text: str) -> str:
+    files = {"file": (name, io.BytesIO(text.encode("utf-8")), "text/plain")}
+    response = client.post("/api/v1/documents", files=files)
+    response.raise_for_status()
+    return response.json()["taskId"]
+
+
+def bench_upload(client: Any, config: BenchmarkConfig) -> Dict[str, Any]:
+    samples: List[float] = []
+    total_bytes = 0
+    for index in range(config.documents):
+        text = synthetic_document(config.seed + index, config.doc_chars)
+        total_bytes += len(text.encode("utf-8"))
+        elapsed, _ = _timed(lambda: _upload(client, f"bench-{index}.txt", text))
+        samples.append(elapsed)
+    wall = sum(samples)
+    return {
+        "latency": summarize(samples),
+        "documents_per_s": round(len(samples) / wall, 3) if wall else None,
+        "mb_per_s": round(total_bytes / wall / 1024 / 1024, 3) if wall else None,
+    }
+
+
+def bench_extract(config: BenchmarkConfig, workdir: Path) -> Dict[str, Any]:
+    from app.utils.text import extract_text
+
+    samples: List[float] = []
+    for index in range(config.documents):
+        path = workdir / f"extract-{index}.md"
+        path.write_text(synthetic_document(config.seed + index, config.doc_chars), encoding="utf-8")
+        elapsed, _ = _timed(lambda: extract_text(path))
+        samples.append(elapsed)
+    return {"latency": summarize(samples)}
+
+
+def bench_build(client: Any, config: BenchmarkConfig) -> tuple[Dict[str, Any], Dict[int, str]]:
+    from app.models.schemas import VectorStoreConfig
+    from app.services import vector_stores
+
+    results: Dict[str, Any] = {}
+    stores: Dict[int, str] = {}
+    for size in config.store_sizes:
+        task_id = _upload(client, f"store-{size}.txt", synthetic_document(config.seed + size, size))
+        store_config = VectorStoreConfig(
+            name=f"bench-{size}",
+            chunkSize=config.chunk_size,
+            overlap=config.overlap,
+            topK=max(config.top_ks),
+            shards=config.shards,
+        )
+        elapsed, record = _timed(lambda: vector_stores.create_vector_store(task_id, store_config))
+        embeddings = vector_stores._store_embeddings(record)
+        stores_loaded = vector_stores._load_stores(record.store_id, config.shards > 1, embeddings)
+        chunks = sum(store.index.ntotal for store in stores_loaded)
+        results[str(size)] = {"build_s": round(elapsed, 4), "chunks": chunks}
+        stores[size] = record.store_id
+    return results, stores
+
+
+def bench_recall(config: BenchmarkConfig, stores: Dict[int, str]) -> Dict[str, Any]:
+    from app.models.schemas import RecallRequest
+    from app.services import vector_stores
+
+    questions = synthetic_questions(config.seed, config.recall_queries)
+    results: Dict[str, Any] = {}
+    for size, store_id in stores.items():
+        per_k: Dict[str, Any] = {}
+        for top_k in config.top_ks:
+            samples = [
+                _timed(lambda q=question: vector_stores.recall(store_id, RecallRequest(query=q, topK=top_k)))[0]
+                for question in questions
+            ]
+            per_k[str(top_k)] = summarize(samples)
+        results[str(size)] = per_k
+    return results
+
+
+def bench_chat(config: BenchmarkConfig, stores: Dict[int, str]) -> Dict[str, Any]:
+    from app.models.schemas import CreateChatSessionRequest, SendChatMessageRequest
+    from app.services import chat
+
+    store_id = stores[min(stores)] if stores else None
+    questions = synthetic_questions(config.seed + 1, config.chat_messages)
+    results: Dict[str, Any] = {}
+    for workers in config.concurrency:
+        sessions = [chat.create_session(CreateChatSessionRequest(title=f"bench-{workers}")).id for _ in range(workers)]
+
+        def send(index: int) -> float:
+            payload = SendChatMessageRequest(message=questions[index], vectorStoreId=store_id)
+            return _timed(lambda: chat.send_message(sessions[index % workers], payload))[0]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            samples = list(pool.map(send, range(len(questions))))
+        wall = time.perf_counter() - start
+        results[str(workers)] = {
+            "latency": summarize(samples),
+            "messages_per_s": round(len(samples) / wall, 3) if wall else None,
+        }
+    return results
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(config: BenchmarkConfig, workdir: Path) -> Dict[str, Any]:
+    prepare_environment(workdir)
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    client = TestClient(app)
+    results: Dict[str, Any] = {}
+    stores: Dict[int, str] = {}
+    if "startup" in config.sections:
+        results["startup"] = bench_startup(config, workdir)
+    with local_models(config):
+        if "upload" in config.sections:
+            results["upload"] = bench_upload(client, config)
+        if "extract" in config.sections:
+            results["extract"] = bench_extract(config, workdir)
+        if {"build", "recall", "chat"} & set(config.sections):
+            results["build"], stores = bench_build(client, config)
+        if "recall" in config.sections:
+            results["recall"] = bench_recall(config, stores)
+        if "chat" in config.sections:
+            results["chat"] = bench_chat(config, stores)
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": asdict(config),
+        },
+        "results": results,
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description="Run the offline RAG benchmark suite")
+    parser.add_argument("--documents", type=int, default=defaults.documents)
+    parser.add_argument("--doc-chars", type=int, default=defaults.doc_chars)
+    parser.add_argument("--store-sizes", type=_int_list, default=list(defaults.store_sizes))
+    parser.add_argument("--chunk-size", type=int, default=defaults.chunk_size)
+    parser.add_argument("--overlap", type=int, default=defaults.overlap)
+    parser.add_argument("--shards", type=int, default=defaults.shards)
+    parser.add_argument("--top-k", type=_int_list, default=list(defaults.top_ks), dest="top_ks")
+    parser.add_argument("--recall-queries", type=int, default=defaults.recall_queries)
+    parser.add_argument("--chat-messages", type=int, default=defaults.chat_messages)
+    parser.add_argument("--concurrency", type=_int_list, default=list(defaults.concurrency))
+    parser.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    parser.add_argument("--llm-token-delay", type=float, default=defaults.llm_token_delay)
+    parser.add_argument("--startup-runs", type=int, default=defaults.startup_runs)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--log-level", default=defaults.log_level)
+    parser.add_argument("--sections", type=lambda v: v.split(","), default=list(defaults.sections))
+    parser.add_argument("--workdir", type=Path, default=None, help="data directory (default: temporary)")
+    parser.add_argument("--output", type=Path, default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    options = vars(args)
+    workdir_arg = options.pop("workdir")
+    output = options.pop("output")
+    config = BenchmarkConfig(**options)
+
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as tmp:
+        workdir = workdir_arg or Path(tmp)
+        workdir.mkdir(parents=True, exist_ok=True)
+        logging.basicConfig(level=config.log_level, format="%(levelname)s %(name)s: %(message)s")
+        report = run_suite(config, workdir)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 ﻿import io
+import json
 import os
 import sys
 from pathlib import Path
@@ -107,4 +108,1519 @@ def test_chat_session_flow(client):
 
     detail_resp = client.get(f"/api/v1/chat/sessions/{session_id}")
     assert detail_resp.status_code == 200
-    assert len(detail_resp.json()["messages"]) >= 2
+    assert len(detail_resp.json()["messages"]) >= 2
+
+
+def test_metrics_endpoint(client):
+    client.get("/healthz")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE rag_http_request_seconds histogram" in body
+    assert 'rag_http_requests_total{method="GET",route="/healthz",status="200"}' in body
+    assert "rag_db_session_seconds_count" in body
+
+
+def test_request_timing_opt_in(client):
+    filename, data = _create_text_file("耗时排查 " * 100)
+    files = {"file": (filename, io.BytesIO(data), "text/plain")}
+    task_id = client.post("/api/v1/documents", files=files).json()["taskId"]
+    payload = {
+        "documentTaskId": task_id,
+        "config": {"name": "timing", "chunkSize": 128, "overlap": 16, "topK": 2},
+    }
+    store_id = client.post("/api/v1/vector-stores", json=payload).json()["storeId"]
+
+    recall = client.post(
+        f"/api/v1/vector-stores/{store_id}/recall?debug=1",
+        json={"query": "耗时", "topK": 2},
+    )
+    assert recall.status_code == 200
+    timings = recall.json()["debug"]["timings"]
+    assert {"store_load", "embed_query", "search"} <= set(timings)
+    assert "search;dur=" in recall.headers["server-timing"]
+
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "timing"}).json()["id"]
+    plain = client.post(f"/api/v1/chat/sessions/{session_id}/messages", json={"message": "hi"})
+    assert "server-timing" not in plain.headers
+    assert "debug" not in plain.json()
+
+    debug = client.post(
+        f"/api/v1/chat/sessions/{session_id}/messages",
+        json={"message": "耗时在哪里", "vectorStoreId": store_id},
+        headers={"X-Debug-Timing": "1"},
+    )
+    assert debug.status_code == 200
+    body = debug.json()["debug"]
+    assert {"db", "prompt_build", "llm_first_token", "llm_total"} <= set(body["timings"])
+    assert any(note.startswith("model=") for note in body["notes"])
+    assert "llm_total;dur=" in debug.headers["server-timing"]
+
+
+def test_benchmark_suite_smoke(client, tmp_path):
+    from benchmarks.run import BenchmarkConfig, run_suite
+
+    config = BenchmarkConfig(
+        documents=1,
+        store_sizes=(3000,),
+        top_ks=(2,),
+        recall_queries=3,
+        chat_messages=2,
+        concurrency=(2,),
+        startup_runs=1,
+    )
+    report = run_suite(config, tmp_path)
+    results = report["results"]
+    assert set(results) == {"startup", "upload", "extract", "build", "recall", "chat"}
+    assert results["startup"]["import"]["count"] == 1
+    assert results["build"]["3000"]["chunks"] > 0
+    assert results["recall"]["3000"]["2"]["count"] == 3
+    assert results["chat"]["2"]["latency"]["count"] == 2
+    json.dumps(report)
+
+
+def test_mock_openai_server_speaks_openai_protocol():
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    from benchmarks.mock_openai import LatencyDistribution, MockConfig, create_app
+
+    mock = TestClient(create_app(MockConfig(latency=LatencyDistribution.parse("fixed:0.001"), embedding_dim=32)))
+    model = ChatOpenAI(model="mock-chat", api_key="mock", base_url="http://testserver/v1", http_client=mock)
+    answer = model.invoke("你好").content
+    streamed = "".join(chunk.content for chunk in model.stream("你好"))
+    assert answer and streamed == answer
+
+    embeddings = OpenAIEmbeddings(
+        model="mock-embed",
+        api_key="mock",
+        base_url="http://testserver/v1",
+        http_client=mock,
+        check_embedding_ctx_length=False,
+    )
+    vectors = embeddings.embed_documents(["a", "b"])
+    assert len(vectors) == 2 and len(vectors[0]) == 32
+    assert embeddings.embed_query("a") == vectors[0]
+
+    failing = TestClient(create_app(MockConfig(error_rate=1.0, error_status=503)))
+    assert failing.post("/v1/chat/completions", json={"messages": []}).status_code == 503
+
+
+def test_provider_clients_share_one_http_pool(test_env, monkeypatch):
+    import socket
+    import threading
+    import time
+
+    import uvicorn
+
+    from app.services import chat, embeddings
+    from app.utils import http_client, metrics
+    from benchmarks.mock_openai import LatencyDistribution, MockConfig, create_app
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    mock_config = MockConfig(latency=LatencyDistribution.parse("fixed:0.001"))
+    server = uvicorn.Server(uvicorn.Config(create_app(mock_config), port=port, log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    base_url = f"http://127.0.0.1:{port}/v1"
+    monkeypatch.setattr(chat.settings, "openai_api_key", "mock-key")
+    monkeypatch.setattr(chat.settings, "deepseek_api_key", None)
+    monkeypatch.setattr(chat.settings, "embed_api_key", None)
+    monkeypatch.setattr(chat.settings, "openai_base_url", base_url)
+    monkeypatch.setattr(http_client.settings, "http_connect_timeout_seconds", 2.0)
+    monkeypatch.setattr(http_client.settings, "http_max_connections", 7)
+    monkeypatch.setattr(http_client, "_client", http_client.Lazy(http_client._build_client))
+    try:
+        model = chat.build_chat_model()
+        embedder = embeddings.build_embeddings()
+        shared = http_client.http_client()
+        assert model.http_client is shared and embedder.http_client is shared
+        assert model.request_timeout.connect == 2.0 and model.request_timeout.read == chat.settings.llm_timeout_seconds
+        assert model.max_retries == 0
+        assert embedder.request_timeout.read == http_client.settings.http_read_timeout_seconds
+        for _ in range(3):
+            assert model.invoke("你好").content
+        assert http_client.pool_usage() == {"active": 0, "idle": 1, "waiting": 0, "limit": 7}
+        assert 'rag_http_pool_connections{state="idle"} 1' in metrics.render()
+        # pool internals that changed shape in an httpx upgrade leave the gauge empty, not /metrics broken
+        transport = http_client.http_client()._transport
+        pool = transport._pool
+        monkeypatch.setattr(http_client, "_probe_warned", False)
+        monkeypatch.setattr(transport, "_pool", object())
+        assert http_client.pool_usage() == {} and "rag_http_pool_connections" in metrics.render()
+        transport._pool = pool
+        assert http_client.pool_usage()["idle"] == 1
+
+        from langchain_core.messages import HumanMessage
+
+        from app.utils import tokens
+
+        monkeypatch.setattr(chat, "get_chat_model", lambda: model)
+        with tokens.metering() as used:
+            chat._stream_until([HumanMessage(content="你好")], time.monotonic() + 30)
+        assert used.prompt > 0 and used.completion > 0 and not used.estimated
+
+        # an upstream that never sends a first token is cut off at the deadline, not the read timeout
+        from app.services.llm_scheduler import DeadlineExceeded
+
+        mock_config.latency = LatencyDistribution.parse("fixed:5")
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            chat._stream_until([HumanMessage(content="你好")], time.monotonic() + 0.5)
+        assert time.monotonic() - started < 2
+    finally:
+        server.should_exit = True
+        thread.join(5)
+        shared.close()
+
+
+def test_token_usage_per_message_store_and_day(client, monkeypatch):
+    from datetime import datetime
+
+    from app.services import usage
+
+    filename, data = _create_text_file("计费 用量 统计 " * 100)
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    payload = {"documentTaskId": task_id, "config": {"name": "用量", "chunkSize": 200, "overlap": 0, "topK": 2}}
+    store_id = client.post("/api/v1/vector-stores", json=payload).json()["storeId"]
+    build_usage = client.get(f"/api/v1/vector-stores/{store_id}").json()["buildReport"]["usage"]
+    assert build_usage["embeddingTokens"] > 0 and build_usage["promptTokens"] == 0
+
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "用量"}).json()["id"]
+    sent = client.post(
+        f"/api/v1/chat/sessions/{session_id}/messages", json={"message": "用量统计", "vectorStoreId": store_id}
+    ).json()["message"]["usage"]
+    assert sent["promptTokens"] > 0 and sent["completionTokens"] > 0 and sent["embeddingTokens"] > 0
+    assert sent["estimated"] is True  # the fake chat model reports no usage
+    messages = client.get(f"/api/v1/chat/sessions/{session_id}").json()["messages"]
+    assert [message["usage"] for message in messages] == [None, sent]
+
+    monkeypatch.setattr(usage.settings, "price_prompt_per_1k_tokens", 2.0)
+    by_session = client.get("/api/v1/usage", params={"groupBy": "session"}).json()
+    bucket = next(item for item in by_session["items"] if item["key"] == session_id)
+    assert bucket["calls"] == 1 and bucket["promptTokens"] == sent["promptTokens"]
+    assert bucket["cost"] == round(sent["promptTokens"] * 2.0 / 1000, 6)
+    by_store = client.get("/api/v1/usage", params={"groupBy": "store"}).json()
+    bucket = next(item for item in by_store["items"] if item["key"] == store_id)
+    assert bucket["calls"] == 2
+    assert bucket["embeddingTokens"] == build_usage["embeddingTokens"] + sent["embeddingTokens"]
+    by_day = client.get("/api/v1/usage", params={"groupBy": "day", "kind": "chat"}).json()
+    assert by_day["items"][-1]["key"] == datetime.utcnow().strftime("%Y-%m-%d")
+    assert by_day["total"]["promptTokens"] == sum(item["promptTokens"] for item in by_day["items"])
+    assert client.get("/api/v1/usage", params={"groupBy": "model"}).status_code == 400
+    assert 'rag_tokens_total{kind="embedding",model="default",source="estimated"}' in client.get("/metrics").text
+
+
+def test_llm_scheduler_queue_and_deadline(test_env):
+    import threading
+
+    from fastapi import HTTPException
+
+    from app.services.llm_scheduler import CircuitBreaker, LLMScheduler
+
+    scheduler = LLMScheduler(1, 1, 0.2, CircuitBreaker(0.5, 10, 10, 30))
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold(_deadline):
+        started.set()
+        release.wait(2)
+        return "done"
+
+    holder = threading.Thread(target=scheduler.run, args=(hold,))
+    holder.start()
+    started.wait(2)
+    waiter_errors = []
+
+    def wait_for_slot():
+        try:
+            scheduler.run(lambda _deadline: "late", timeout_seconds=0.1)
+        except HTTPException as exc:
+            waiter_errors.append(exc.status_code)
+
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while scheduler.queue_depth == 0 and waiter.is_alive():
+        pass
+    with pytest.raises(HTTPException) as rejected:
+        scheduler.run(lambda _deadline: "rejected")
+    assert rejected.value.status_code == 429
+    waiter.join()
+    assert waiter_errors == [503]
+    release.set()
+    holder.join()
+
+
+def test_circuit_breaker_fails_fast_with_fallback_text(client, monkeypatch):
+    from app.services import chat
+    from app.services.llm_scheduler import CircuitBreaker
+
+    breaker = CircuitBreaker(failure_ratio=0.5, window=4, min_calls=2, cooldown_seconds=60)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "open"
+    monkeypatch.setattr(chat.scheduler, "breaker", breaker)
+
+    calls = []
+
+    class RecordingModel:
+        def stream(self, messages):
+            calls.append(messages)
+            return iter(())
+
+    model = RecordingModel()
+    monkeypatch.setattr(chat, "get_chat_model", lambda: model)
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "breaker"}).json()["id"]
+    response = client.post(f"/api/v1/chat/sessions/{session_id}/messages", json={"message": "还好吗"})
+    assert response.status_code == 200
+    assert response.json()["message"]["content"] == "调用大模型失败，请检查模型名称、密钥或代理配置。"
+    assert calls == []
+
+    import time
+
+    from langchain_core.messages import AIMessageChunk
+
+    class SlowModel:
+        def stream(self, messages):
+            time.sleep(0.2)
+            yield AIMessageChunk(content="太迟了")
+
+    monkeypatch.setattr(chat.scheduler, "breaker", CircuitBreaker(0.5, 4, 2, 60))
+    monkeypatch.setattr(chat.scheduler, "timeout_seconds", 0.05)
+    monkeypatch.setattr(chat, "get_chat_model", lambda: SlowModel())
+    late = client.post(f"/api/v1/chat/sessions/{session_id}/messages", json={"message": "超时了吗"})
+    assert late.status_code == 503
+
+
+def test_chat_graph_branches_run_concurrently_with_history(client, monkeypatch):
+    from datetime import datetime
+    import threading
+
+    from langchain_core.messages import AIMessageChunk
+    from sqlmodel import select
+
+    from app.models.db import get_session
+    from app.models.schemas import RecallResponse
+    from app.services import chat
+
+    prompts = []
+
+    class EchoModel:
+        def stream(self, messages):
+            prompts.append(messages)
+            return iter([AIMessageChunk(content=f"第{len(prompts)}个回答")])
+
+    model = EchoModel()
+    monkeypatch.setattr(chat, "get_chat_model", lambda: model)
+    monkeypatch.setattr(chat.settings, "chat_history_messages", 6)
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "并行"}).json()["id"]
+    url = f"/api/v1/chat/sessions/{session_id}/messages"
+    assert client.post(url, json={"message": "第一问"}).json()["message"]["content"] == "第1个回答"
+    # the answer is stored before the response is sent, not by a writer another worker cannot wait on
+    with get_session() as session:
+        stored = session.exec(select(chat.ChatMessageEntity).where(chat.ChatMessageEntity.session_id == session_id)).all()
+    assert sorted(message.content for message in stored) == ["第1个回答", "第一问"]
+    assert client.post("/api/v1/chat/sessions/missing/messages", json={"message": "你好"}).status_code == 404
+
+    # recall and history each wait for the other: this only completes if the branches overlap
+    barrier = threading.Barrier(2, timeout=5)
+    load_history = chat._load_history
+
+    def recall(store_id, request):
+        barrier.wait()
+        return RecallResponse(storeId=store_id, items=[])
+
+    monkeypatch.setattr(chat.vector_stores, "recall", recall)
+    monkeypatch.setattr(chat, "_load_history", lambda *args: (barrier.wait(), load_history(*args))[1])
+    response = client.post(url, json={"message": "第二问", "vectorStoreId": "any"})
+    assert response.status_code == 200
+    assert [(message.type, message.content) for message in prompts[1][1:3]] == [("human", "第一问"), ("ai", "第1个回答")]
+
+    messages = client.get(f"/api/v1/chat/sessions/{session_id}").json()["messages"]
+    assert [message["content"] for message in messages][-2:] == ["第二问", "第2个回答"]
+    assert len(messages) == 4
+    assert len(prompts) == 2
+
+    # an answer finished after the session was deleted must not bring it back
+    late = chat.ChatMessageEntity(
+        message_id="late", session_id=session_id, role="assistant", content="迟到", timestamp=datetime.utcnow(), citations=[]
+    )
+    assert client.delete(f"/api/v1/chat/sessions/{session_id}").status_code == 204
+    chat._persist_answer(session_id, late)
+    with get_session() as session:
+        assert session.exec(select(chat.ChatMessageEntity).where(chat.ChatMessageEntity.session_id == session_id)).all() == []
+
+
+def test_embedding_router_fails_over_within_vector_space(client):
+    from app.services import vector_stores
+    from app.services.embeddings import EmbeddingRouter, FallbackEmbeddings, InstrumentedEmbeddings
+    from app.utils import metrics
+
+    class Provider(FallbackEmbeddings):
+        def __init__(self):
+            self.down = False
+            self.calls = 0
+
+        def embed_query(self, text):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("provider unreachable")
+            return super().embed_query(text)
+
+    primary, secondary = Provider(), Provider()
+    router = EmbeddingRouter(
+        [
+            InstrumentedEmbeddings(primary, "primary", "hash-v1"),
+            InstrumentedEmbeddings(secondary, "secondary", "hash-v1"),
+            InstrumentedEmbeddings(FallbackEmbeddings(), "fallback"),
+        ]
+    )
+    vector_stores._router.set(router)
+    try:
+        filename, data = _create_text_file("\n\n".join(f"故障转移 第{index}段 内容" * 4 for index in range(20)))
+        task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+        config = {"name": "转移库", "chunkSize": 100, "overlap": 0, "topK": 2}
+        store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+        stored = vector_stores.get_vector_store(store_id).config
+        assert (stored["embeddingBackend"], stored["embeddingSpace"]) == ("primary", "hash-v1")
+
+        def recall(query):
+            return client.post(f"/api/v1/vector-stores/{store_id}/recall", json={"query": query, "topK": 2})
+
+        primary.down = True
+        for index in range(3):
+            assert recall(f"故障转移 {index}").status_code == 200
+        health = {item["name"]: item["state"] for item in client.get("/healthz/embeddings").json()}
+        assert health == {"primary": "open", "secondary": "closed", "fallback": "closed"}
+        calls = primary.calls
+        assert recall("故障转移 第3段").status_code == 200
+        assert primary.calls == calls
+        assert metrics.EMBEDDING_FAILOVERS.value(backend="primary", reason="unhealthy") >= 1
+
+        # no healthy backend in the store's space: fail fast, never the 3-dim local space
+        secondary.down = True
+        response = recall("故障转移 全部不可用")
+        assert response.status_code == 503 and "hash-v1" in response.json()["detail"]
+
+        primary.down = False
+        router._breakers["primary"].cooldown_seconds = 0
+        assert recall("故障转移 恢复").status_code == 200
+        assert {item["name"]: item["state"] for item in router.status()}["primary"] == "closed"
+    finally:
+        vector_stores._router.reset()
+
+
+def test_single_flight_coalesces_concurrent_calls(test_env):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.utils import metrics
+    from app.utils.singleflight import SingleFlight
+
+    flight = SingleFlight("test_group")
+    gate = threading.Event()
+    calls = []
+
+    def expensive():
+        calls.append(1)
+        gate.wait(2)
+        return {"answer": 42}
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        futures = [pool.submit(flight.do, "same-key", expensive) for _ in range(6)]
+        while metrics.SINGLEFLIGHT_CALLS.value(group="test_group", role="follower") < 5:
+            pass
+        gate.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert metrics.SINGLEFLIGHT_CALLS.value(group="test_group", role="leader") == 1
+    assert flight.do("same-key", lambda: "fresh") == "fresh"
+
+
+def test_coalesced_answers_are_metered_for_every_caller(client, monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+
+    from app.services import chat
+    from app.utils import metrics, tokens
+
+    gate = threading.Event()
+    calls = []
+
+    class GatedModel:
+        def stream(self, messages):
+            calls.append(1)
+            gate.wait(2)
+            reported = {"input_tokens": 40, "output_tokens": 7, "total_tokens": 47}
+            return iter([AIMessageChunk(content="合并的回答", usage_metadata=reported)])
+
+    model = GatedModel()
+    monkeypatch.setattr(chat, "get_chat_model", lambda: model)
+    monkeypatch.setattr(chat.settings, "chat_coalesce_answers", True)
+    followers = metrics.SINGLEFLIGHT_CALLS.value(group="answer", role="follower")
+
+    def ask():
+        with tokens.metering() as used:
+            chat._stream_chat_model([HumanMessage(content="同一个问题")])
+        return used.as_dict()
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(ask) for _ in range(3)]
+        while metrics.SINGLEFLIGHT_CALLS.value(group="answer", role="follower") < followers + 2:
+            pass
+        gate.set()
+        usages = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all((usage["promptTokens"], usage["completionTokens"]) == (40, 7) for usage in usages)
+    assert sorted(usage["coalesced"] for usage in usages) == [False, True, True]
+    record = chat.usage.usage_record("chat", next(usage for usage in usages if usage["coalesced"]))
+    assert record.coalesced and record.prompt_tokens == 40
+
+    # the report bills the one provider call once; the followers' copies are reported separately
+    for usage in usages:
+        chat.usage.save_usage("chat", usage, session_id="coalesced-session")
+    report = client.get("/api/v1/usage", params={"groupBy": "session", "kind": "chat"}).json()
+    bucket = next(item for item in report["items"] if item["key"] == "coalesced-session")
+    assert (bucket["calls"], bucket["promptTokens"], bucket["completionTokens"]) == (3, 40, 7)
+    assert bucket["coalesced"] and bucket["coalescedTokens"] == 2 * 47
+
+
+def test_bulk_upload_with_archive_and_store(client):
+    import zipfile
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as bundle:
+        bundle.writestr("manual/chapter.md", "# 章节\n" + "批量导入说明 " * 60)
+        bundle.writestr("manual/tool.exe", b"binary")
+        bundle.writestr("__MACOSX/manual/._chapter.md", b"junk")
+    archive.seek(0)
+    files = [
+        ("files", ("a.txt", io.BytesIO(("第一份文档 " * 80).encode("utf-8")), "text/plain")),
+        ("files", ("short.txt", io.BytesIO("太短".encode("utf-8")), "text/plain")),
+        ("files", ("bundle.zip", archive, "application/zip")),
+    ]
+    config = {"name": "批量库", "chunkSize": 200, "overlap": 20, "topK": 3}
+    response = client.post(
+        "/api/v1/documents/batch", files=files, data={"vectorStoreConfig": json.dumps(config)}
+    )
+    assert response.status_code == 201
+    batch = response.json()
+    assert [item["fileName"] for item in batch["items"]] == ["a.txt", "short.txt", "chapter.md", "tool.exe"]
+    assert (batch["total"], batch["succeeded"], batch["failed"]) == (4, 2, 2)
+    assert batch["vectorStoreId"]
+
+    fetched = client.get(f"/api/v1/documents/batches/{batch['batchId']}").json()
+    assert fetched["vectorStoreId"] == batch["vectorStoreId"]
+    task_status = client.get(f"/api/v1/documents/{batch['items'][2]['taskId']}").json()
+    assert task_status["status"] == "success"
+
+    recall = client.post(
+        f"/api/v1/vector-stores/{batch['vectorStoreId']}/recall", json={"query": "批量导入", "topK": 4}
+    ).json()
+    sources = {item["metadata"]["source"] for item in recall["items"]}
+    assert sources <= {"a.txt", "chapter.md"} and sources
+
+
+def test_sharded_store_matches_single_index(client):
+    from app.storage.vector_storage import list_shards
+
+    text = "\n\n".join(f"第{index}节 分片检索 样例内容 {index * 7919 % 1000}" * 4 for index in range(60))
+    filename, data = _create_text_file(text)
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+
+    store_ids = {}
+    for shards in (1, 4):
+        config = {"name": f"分片{shards}", "chunkSize": 120, "overlap": 0, "topK": 5, "shards": shards}
+        resp = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config})
+        assert resp.status_code == 202
+        store_ids[shards] = resp.json()["storeId"]
+    assert list_shards(store_ids[1]) == []
+    assert list_shards(store_ids[4]) == [0, 1, 2, 3]
+    assert client.get(f"/api/v1/vector-stores/{store_ids[4]}").json()["config"]["shards"] == 4
+
+    recall_req = {"query": "第12节 分片检索", "topK": 5, "withContent": True}
+    results = {
+        shards: client.post(f"/api/v1/vector-stores/{store_id}/recall", json=recall_req).json()["items"]
+        for shards, store_id in store_ids.items()
+    }
+    assert len(results[4]) == 5
+    assert [round(item["similarity"], 6) for item in results[4]] == [round(item["similarity"], 6) for item in results[1]]
+
+    rebuilt = client.post(f"/api/v1/vector-stores/{store_ids[4]}/shards/2/rebuild")
+    assert rebuilt.status_code == 200
+    assert rebuilt.json()["chunks"] > 0
+    assert client.post(f"/api/v1/vector-stores/{store_ids[1]}/shards/0/rebuild").status_code == 404
+    again = client.post(f"/api/v1/vector-stores/{store_ids[4]}/recall", json=recall_req).json()["items"]
+    assert [item["content"] for item in again] == [item["content"] for item in results[4]]
+
+
+def test_store_load_waits_out_a_concurrent_swap(test_env, monkeypatch):
+    import threading
+    import time
+
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+
+    from app.storage import vector_storage
+
+    embeddings = FakeEmbeddings(size=8)
+    old, new = (FAISS.from_texts([f"片段 {index}" for index in range(count)], embeddings) for count in (3, 5))
+    vector_storage.save_vector_store(old, "swap-race")
+    in_gap = threading.Event()
+    rename = Path.rename
+
+    def slow_rename(self, target):
+        result = rename(self, target)
+        if str(target).endswith(".retired"):
+            in_gap.set()  # the live path is missing until staging is renamed into place
+            time.sleep(0.3)
+        return result
+
+    monkeypatch.setattr(Path, "rename", slow_rename)
+    writer = threading.Thread(target=vector_storage.save_vector_store, args=(new, "swap-race"))
+    writer.start()
+    try:
+        assert in_gap.wait(5)
+        loaded = vector_storage.load_vector_store("swap-race", embeddings)
+        assert loaded is not None and loaded.index.ntotal == len(loaded.index_to_docstore_id) == 5
+    finally:
+        writer.join()
+        vector_storage.delete_vector_store("swap-race")
+
+
+def test_snapshot_export_import_roundtrip(client, monkeypatch):
+    import hashlib
+    import hmac
+    import shutil
+    import tarfile
+
+    from sqlmodel import select
+
+    from app.config import get_settings
+    from app.models.db import get_session
+    from app.models.entities import VectorStoreRecord
+    from app.services import vector_stores
+    from app.storage.vector_storage import get_vector_store_path
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    monkeypatch.setattr(settings, "snapshot_signing_key", "snapshot-key")
+    admin = {"X-Admin-Token": "s3cret"}
+    filename, data = _create_text_file("快照复制 节点同步 " * 80)
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "快照库", "chunkSize": 100, "overlap": 0, "topK": 3, "shards": 2}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+    recall_req = {"query": "节点同步", "topK": 3, "withContent": True}
+    before = client.post(f"/api/v1/vector-stores/{store_id}/recall", json=recall_req).json()["items"]
+    # leftovers of an in-progress swap are not part of the store
+    leftover = get_vector_store_path(store_id, 0).with_name("shard-00.staging")
+    leftover.mkdir()
+    (leftover / "index.faiss").write_bytes(b"half-written")
+
+    exported = client.get(f"/api/v1/vector-stores/{store_id}/export")
+    shutil.rmtree(leftover)
+    assert exported.status_code == 200
+    snapshot = exported.content
+    with tarfile.open(fileobj=io.BytesIO(snapshot), mode="r:gz") as archive:
+        names = archive.getnames()
+        payload = archive.extractfile("manifest.json").read()
+        signature = archive.extractfile("manifest.sig").read().decode()
+    manifest = json.loads(payload)
+    assert names[:2] == ["manifest.json", "manifest.sig"]
+    assert signature == hmac.new(b"snapshot-key", payload, hashlib.sha256).hexdigest()
+    assert manifest["store"]["id"] == store_id and manifest["store"]["config"]["shards"] == 2
+    assert {f"index/{name}" for name in manifest["files"]} == set(names[2:])
+    assert not any(".staging" in name for name in names)
+    assert manifest["embedding"]["space"] == vector_stores.get_vector_store(store_id).config["embeddingSpace"]
+
+    # simulate a fresh node: forget the store entirely, then seed it from the snapshot
+    with get_session() as session:
+        session.delete(session.exec(select(VectorStoreRecord).where(VectorStoreRecord.store_id == store_id)).one())
+        session.commit()
+    shutil.rmtree(get_vector_store_path(store_id))
+
+    def upload(archive, headers=admin):
+        files = {"file": ("snap.tar.gz", archive, "application/gzip")}
+        return client.post("/api/v1/vector-stores/import", files=files, headers=headers)
+
+    # index files are unpickled on load: importing is for admins only
+    assert upload(io.BytesIO(snapshot), headers={}).status_code == 403
+    imported = upload(io.BytesIO(snapshot))
+    assert imported.status_code == 201
+    assert imported.json()["id"] == store_id and imported.json()["config"]["shards"] == 2
+    after = client.post(f"/api/v1/vector-stores/{store_id}/recall", json=recall_req).json()["items"]
+    assert [item["content"] for item in after] == [item["content"] for item in before]
+
+    assert upload(io.BytesIO(snapshot)).status_code == 409
+
+    def repack(manifest, key=b"snapshot-key", extra=None):
+        packed = io.BytesIO()
+        with tarfile.open(fileobj=io.BytesIO(snapshot), mode="r:gz") as source, tarfile.open(fileobj=packed, mode="w:gz") as target:
+            payload = json.dumps(manifest).encode("utf-8")
+            signed = [("manifest.json", payload)]
+            if key is not None:
+                signed.append(("manifest.sig", hmac.new(key, payload, hashlib.sha256).hexdigest().encode()))
+            for name, content in signed:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                target.addfile(info, io.BytesIO(content))
+            if extra is not None:
+                target.addfile(extra)
+            for member in source.getmembers()[2:]:
+                target.addfile(member, source.extractfile(member))
+        packed.seek(0)
+        return packed
+
+    # unsigned, signed with another key, or signed but smuggling a link: rejected before anything is extracted
+    forged = json.loads(json.dumps(manifest))
+    forged["store"]["id"] = "forged"
+    link = tarfile.TarInfo("index/shard-00/index.pkl")
+    link.type, link.linkname = tarfile.SYMTYPE, "/etc/passwd"
+    for archive in (repack(forged, key=None), repack(forged, key=b"attacker"), repack(forged, extra=link)):
+        assert upload(archive).status_code == 400
+    traversal = json.loads(json.dumps(forged))
+    traversal["files"]["../escape"] = {"size": 1, "sha256": "0" * 64}
+    assert upload(repack(traversal)).status_code == 400
+    assert client.get("/api/v1/vector-stores/forged").status_code == 404
+    monkeypatch.setattr(settings, "snapshot_signing_key", None)
+    assert upload(io.BytesIO(snapshot)).status_code == 403
+    monkeypatch.setattr(settings, "snapshot_signing_key", "snapshot-key")
+
+    # same backend name and model, but vectors from another vector space
+    other_space = json.loads(json.dumps(manifest))
+    other_space["store"]["id"] = "other-space"
+    other_space["embedding"]["space"] = "elsewhere"
+    assert upload(repack(other_space)).status_code == 409
+
+    # a snapshot whose index bytes do not match the manifest is rejected and leaves nothing behind
+    manifest["store"]["id"] = "tampered"
+    first = next(iter(manifest["files"]))
+    manifest["files"][first]["sha256"] = hashlib.sha256(b"other").hexdigest()
+    tampered = repack(manifest)
+    assert upload(tampered).status_code == 400
+    assert not get_vector_store_path("tampered").exists()
+    assert client.get("/api/v1/vector-stores/tampered").status_code == 404
+
+
+def test_document_version_reembeds_only_changed_chunks(client, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    from sqlmodel import select
+
+    from app.models.db import get_session
+    from app.models.entities import DocumentVersion
+    from app.services import vector_stores
+    from app.storage.vector_storage import list_shards, open_vector_store
+    from app.utils import metrics
+
+    paragraphs = [f"第{index}章 制度条款 编号{index * 37 % 101} " * 6 for index in range(30)]
+    filename, data = _create_text_file("\n\n".join(paragraphs), "policy.txt")
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"chunkSize": 120, "overlap": 0, "topK": 3}
+    store_ids = [
+        client.post(
+            "/api/v1/vector-stores",
+            json={"documentTaskId": task_id, "config": {**config, "name": f"版本{shards}", "shards": shards}},
+        ).json()["storeId"]
+        for shards in (1, 3)
+    ]
+    chunks_before = client.get(f"/api/v1/vector-stores/{store_ids[0]}").json()["buildReport"]["chunks"]
+    # listing an unrevised document shows its upload as version 1 without writing anything
+    assert [item["version"] for item in client.get(f"/api/v1/documents/{task_id}/versions").json()] == [1]
+    with get_session() as session:
+        assert not session.exec(select(DocumentVersion).where(DocumentVersion.task_id == task_id)).all()
+
+    revised = paragraphs[:5] + ["第5章 已修订 新增的报销上限说明 " * 6] + paragraphs[6:20] + paragraphs[21:] + ["附则 全新章节 " * 6]
+    embedded_before = metrics.EMBEDDING_TEXTS.value(backend="default", operation="documents")
+    response = client.post(
+        f"/api/v1/documents/{task_id}/versions",
+        files={"file": ("policy-v2.txt", io.BytesIO("\n\n".join(revised).encode("utf-8")), "text/plain")},
+    )
+    assert response.status_code == 201
+    version = response.json()
+    assert version["version"] == 2 and version["fileName"] == "policy-v2.txt" and version["status"] == "ready"
+    changes = {item["storeId"]: item for item in version["stores"]}
+    assert set(changes) == set(store_ids)
+    for change in changes.values():
+        assert change["error"] is None
+        assert 2 <= change["added"] <= 4 and 2 <= change["removed"] <= 4
+        assert change["unchanged"] >= chunks_before - 4
+    embedded = metrics.EMBEDDING_TEXTS.value(backend="default", operation="documents") - embedded_before
+    assert embedded == sum(change["added"] for change in changes.values())
+
+    for store_id in store_ids:
+        contents = []
+        for shard in list_shards(store_id) or [None]:
+            faiss_store = open_vector_store(store_id, vector_stores.get_embeddings(), shard)
+            contents += [doc.page_content for doc in faiss_store.docstore._dict.values()]
+        assert any("新增的报销上限说明" in content for content in contents)
+        assert not any(content.startswith("第20章") for content in contents)
+        report = client.get(f"/api/v1/vector-stores/{store_id}").json()["buildReport"]
+        assert report["chunks"] == len(contents)
+        recalled = client.post(f"/api/v1/vector-stores/{store_id}/recall", json={"query": ("附则 全新章节 " * 6).strip(), "topK": 1})
+        assert recalled.json()["items"][0]["content"].startswith("附则 全新章节")
+
+    history = client.get(f"/api/v1/documents/{task_id}/versions").json()
+    assert [item["version"] for item in history] == [1, 2]
+    assert history[0]["fileName"] == "policy.txt" and history[1]["stores"]
+    assert client.get(f"/api/v1/documents/{task_id}").json()["fileName"] == "policy-v2.txt"
+    assert client.post(
+        "/api/v1/documents/missing/versions", files={"file": ("x.txt", io.BytesIO(data), "text/plain")}
+    ).status_code == 404
+
+    # a store update that fails after the version row exists is recorded on it
+    def broken(store_id, task, segments):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(vector_stores, "update_document_chunks", broken)
+    response = client.post(
+        f"/api/v1/documents/{task_id}/versions",
+        files={"file": ("policy-v3.txt", io.BytesIO(data), "text/plain")},
+    )
+    assert response.json()["status"] == "failed" and response.json()["version"] == 3
+    assert [item["status"] for item in client.get(f"/api/v1/documents/{task_id}/versions").json()] == ["ready", "ready", "failed"]
+    with get_session() as session:
+        session.add(DocumentVersion(version_id="duplicate", task_id=task_id, version=3, file_name="x", file_size=1, file_path="x"))
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+def test_named_lock_excludes_other_processes(test_env):
+    import multiprocessing
+    import threading
+    import time
+
+    from app.utils import locks
+
+    if locks.fcntl is None:
+        pytest.skip("flock is not available")
+    context = multiprocessing.get_context("fork")
+    held, release = context.Event(), context.Event()
+
+    def hold():
+        with locks.named_lock("store-probe"):
+            held.set()
+            release.wait(10)
+
+    child = context.Process(target=hold)
+    child.start()
+    try:
+        assert held.wait(10)
+        threading.Timer(0.3, release.set).start()
+        start = time.monotonic()
+        with locks.named_lock("store-probe"):
+            waited = time.monotonic() - start
+        assert waited >= 0.25
+    finally:
+        release.set()
+        child.join(10)
+
+
+def test_build_drops_exact_and_near_duplicate_chunks(client):
+    from app.utils.dedup import Deduplicator
+
+    disclaimer = (
+        "免责声明：本文件所载信息仅供内部参考，不构成任何形式的承诺或保证。公司保留随时修改本文件内容的权利，恕不另行通知。"
+        "未经信息安全委员会书面批准，任何部门或个人不得将本文件全部或部分内容复制、转发、上传至外部系统或以其他方式披露给第三方。"
+        "违反上述规定造成损失的，公司将依法追究相关责任。本文件最终解释权归人力资源部所有，生效日期为2024年1月1日。"
+    )
+    bodies = [
+        "差旅报销需要在出差结束后十个工作日内提交，附上发票原件与行程单，由部门负责人审批后交财务处理，超标部分自行承担。",
+        "新员工入职第一周需完成信息安全培训、领取工牌与办公设备，并在导师指导下熟悉代码仓库、发布流程和值班制度。",
+        "年度绩效评估分为自评、同事互评与主管面谈三个环节，结果用于调薪与晋升，对评估有异议可在两周内提出复核申请。",
+    ]
+    # the disclaimer as header and footer of policy0, a near-identical footer in policy2, and once in policy1
+    texts = [
+        "\n\n".join([disclaimer, bodies[0], disclaimer]),
+        "\n\n".join([bodies[1], disclaimer]),
+        "\n\n".join([disclaimer, bodies[2], disclaimer.replace("2024年1月1日", "2025年3月1日")]),
+    ]
+
+    def build(dedup, **extra):
+        files = [("files", (f"policy{index}.txt", io.BytesIO(text.encode("utf-8")), "text/plain")) for index, text in enumerate(texts)]
+        config = {"name": "去重", "chunkSize": 200, "overlap": 0, "topK": 8, "dedup": dedup, **extra}
+        batch = client.post("/api/v1/documents/batch", files=files, data={"vectorStoreConfig": json.dumps(config)}).json()
+        return batch, client.get(f"/api/v1/vector-stores/{batch['vectorStoreId']}").json()["buildReport"]
+
+    legacy, plain = build(False)
+    batch, deduped = build(True)
+    _, near = build(True, dedupDistance=4)
+    assert plain["dedup"] == {"exact": 0, "near": 0, "maxDistance": None}
+    # exact duplicates only by default, and never across documents
+    assert deduped["dedup"] == {"exact": 1, "near": 0, "maxDistance": None}
+    assert near["dedup"] == {"exact": 1, "near": 1, "maxDistance": 4}
+    # the repeated disclaimer is embedded once either way: reused within the shard, or dropped before embedding
+    assert plain["embedding"]["cacheHits"] == deduped["embedding"]["cacheHits"] == 3
+    assert deduped["chunks"] == plain["chunks"] - 1 and near["chunks"] == plain["chunks"] - 2
+    assert deduped["tokens"] < plain["tokens"]
+    store_id = batch["vectorStoreId"]
+
+    def disclaimers(document_id=None):
+        filters = {"documentIds": [document_id]} if document_id else None
+        items = client.post(
+            f"/api/v1/vector-stores/{store_id}/recall", json={"query": "免责声明", "topK": 8, "filters": filters}
+        ).json()["items"]
+        return [item["metadata"]["documentId"] for item in items if "免责声明" in item["content"]]
+
+    first, second = batch["items"][0]["taskId"], batch["items"][1]["taskId"]
+    third = batch["items"][2]["taskId"]
+    assert sorted(disclaimers()) == sorted([first, second, third, third])
+    assert disclaimers(second) == [second]
+
+    # a revision repeating the boilerplate within the document does not add it again
+    revised = "远程办公需提前一天在系统中申请，并保证工作时间内即时通讯在线、会议准时参加。\n\n" + disclaimer + "\n\n" + disclaimer
+    version = client.post(
+        f"/api/v1/documents/{second}/versions",
+        files={"file": ("policy1-v2.txt", io.BytesIO(revised.encode("utf-8")), "text/plain")},
+    ).json()
+    change = version["stores"][0]
+    assert change["added"] == 1 and change["deduplicated"] == 1
+
+    # revising policy0 to drop its disclaimer leaves policy1's own copy in place
+    appendix = (
+        "住宿标准按城市分级执行：一线城市每晚不超过六百元，其他城市每晚不超过四百元；"
+        "确需超标的须事先报部门负责人批准，并在报销单中注明原因。市内交通优先选择公共交通，"
+        "加班至晚上九点以后可乘坐出租车并凭票报销，节假日出差按实际天数计发补贴。"
+        "跨部门联合出差由发起部门统一预订交通与住宿，费用按参与人数分摊至各部门预算，年末由财务部汇总核对。"
+    )
+    version = client.post(
+        f"/api/v1/documents/{first}/versions",
+        files={"file": ("policy0-v2.txt", io.BytesIO((bodies[0] + "\n\n" + appendix).encode("utf-8")), "text/plain")},
+    ).json()
+    assert version["stores"][0]["removed"] == 1
+    assert first not in disclaimers() and disclaimers(second) == [second]
+
+    # stores built before dedup existed have no "dedup" key and must keep being rebuilt and updated without it
+    from app.models.db import get_session
+    from app.models.entities import VectorStoreRecord
+    from app.services import vector_stores
+
+    with get_session() as session:
+        record = session.get(VectorStoreRecord, legacy["vectorStoreId"])
+        record.config = {key: value for key, value in record.config.items() if key != "dedup"}
+        session.add(record)
+        session.commit()
+    assert vector_stores.stored_config(vector_stores.get_vector_store(legacy["vectorStoreId"])).dedup is False
+    assert client.get(f"/api/v1/vector-stores/{legacy['vectorStoreId']}").json()["config"]["dedup"] is False
+
+    dedup = Deduplicator(4)
+    assert [dedup.check(text) for text in (disclaimer, disclaimer, disclaimer.replace("人力资源部", "行政管理部"), bodies[0])] == [
+        None,
+        "exact",
+        "near",
+        None,
+    ]
+
+
+def test_coarse_to_fine_recall_narrows_to_top_documents(client, monkeypatch):
+    from app.services import vector_stores
+    from app.storage.vector_storage import load_centroids
+
+    files = [
+        ("files", (f"topic{index}.txt", io.BytesIO((f"主题{index} 专属条款 " * 40).encode("utf-8")), "text/plain"))
+        for index in range(6)
+    ]
+    config = {"name": "两阶段库", "chunkSize": 120, "overlap": 0, "topK": 5, "shards": 2}
+    batch = client.post("/api/v1/documents/batch", files=files, data={"vectorStoreConfig": json.dumps(config)}).json()
+    store_id = batch["vectorStoreId"]
+    document_ids, centroids = load_centroids(store_id)
+    assert sorted(document_ids) == sorted(item["taskId"] for item in batch["items"])
+    assert centroids.shape[0] == 6
+
+    monkeypatch.setattr(vector_stores.settings, "recall_coarse_min_documents", 0)
+    query = {"query": "主题3 专属条款", "topK": 5}
+    narrowed = client.post(f"/api/v1/vector-stores/{store_id}/recall", json={**query, "coarseDocuments": 2}).json()
+    assert 0 < len(narrowed["items"]) <= 5
+    assert len({item["metadata"]["documentId"] for item in narrowed["items"]}) <= 2
+    flat = client.post(f"/api/v1/vector-stores/{store_id}/recall", json={**query, "coarseDocuments": 0}).json()
+    assert len(flat["items"]) == 5
+    assert narrowed["items"][0]["similarity"] <= flat["items"][0]["similarity"]
+
+
+def _pdf_bytes(pages):
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        lines = " ".join(f"({line}) Tj 0 -14 Td" for line in page.split("\n"))
+        stream = f"BT /F1 10 Tf 40 800 Td {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    body, offsets = "%PDF-1.4\n", []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n"
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n" + "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return body.encode("latin-1")
+
+
+def test_recall_filters_by_page_section_document_and_date(client):
+    pages = [
+        "1.1 Scope\n" + "\n".join(f"scope rule {index} applies to every employee" for index in range(8)),
+        "\n".join(f"travel budget {index} is capped per trip" for index in range(8)),
+        "2.1 Meals\n" + "\n".join(f"meal allowance {index} is paid daily" for index in range(8)),
+    ]
+    markdown = "# 总则\n" + "适用范围说明 " * 30 + "\n\n## 报销\n" + "报销流程说明 " * 30
+    files = [
+        ("files", ("policy.pdf", io.BytesIO(_pdf_bytes(pages)), "application/pdf")),
+        ("files", ("guide.md", io.BytesIO(markdown.encode("utf-8")), "text/markdown")),
+    ]
+    config = {"name": "过滤库", "chunkSize": 160, "overlap": 0, "topK": 5, "shards": 2}
+    batch = client.post("/api/v1/documents/batch", files=files, data={"vectorStoreConfig": json.dumps(config)}).json()
+    assert batch["succeeded"] == 2, batch
+    store_id = batch["vectorStoreId"]
+    pdf_id, md_id = (item["taskId"] for item in batch["items"])
+
+    def recall(filters, top_k=50):
+        response = client.post(
+            f"/api/v1/vector-stores/{store_id}/recall", json={"query": "rule", "topK": top_k, "filters": filters}
+        )
+        assert response.status_code == 200
+        return [item["metadata"] for item in response.json()["items"]]
+
+    everything = recall(None)
+    assert {item["page"] for item in everything if item["documentId"] == pdf_id} == {1, 2, 3}
+    assert {item["section"] for item in everything if item["documentId"] == md_id} == {"总则", "报销"}
+    page_two = [item for item in everything if item.get("page") == 2]
+    assert page_two and all(item["section"] == "1.1 Scope" for item in page_two)
+
+    assert {item["page"] for item in recall({"pageFrom": 2, "pageTo": 3})} == {2, 3}
+    assert {item["documentId"] for item in recall({"documentIds": [md_id]})} == {md_id}
+    assert {item["section"] for item in recall({"section": "Meals"})} == {"2.1 Meals"}
+    narrow = recall({"pageFrom": 2}, top_k=2)
+    assert len(narrow) == 2 and all(item["page"] >= 2 for item in narrow)
+    uploaded = everything[0]["uploadedAt"]
+    assert len(recall({"uploadedAfter": uploaded, "documentIds": [pdf_id, md_id]})) >= 1
+    assert recall({"uploadedBefore": "2000-01-01T00:00:00Z"}) == []
+
+
+def test_citation_field_projection_and_compression(client, monkeypatch):
+    import zlib
+
+    from app import middleware
+
+    filename, data = _create_text_file("压缩 投影 引用 " * 200)
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    payload = {"documentTaskId": task_id, "config": {"name": "投影", "chunkSize": 200, "overlap": 0, "topK": 3, "dedup": False}}
+    store_id = client.post("/api/v1/vector-stores", json=payload).json()["storeId"]
+    recall_url = f"/api/v1/vector-stores/{store_id}/recall"
+    recall_req = {"query": "压缩 投影", "topK": 3, "withContent": True}
+
+    full = client.post(recall_url, json=recall_req)
+    assert full.headers["content-encoding"] == "gzip"
+    assert {"content", "metadata"} <= set(full.json()["items"][0])
+    # only the debug block is left out when it was not asked for; the rest of the shape is unchanged
+    assert set(full.json()) == {"storeId", "items"}
+    assert "debug" in client.post(f"{recall_url}?debug=1", json=recall_req).json()
+    slim = client.post(f"{recall_url}?fields=id,title,similarity", json=recall_req).json()["items"]
+    assert [set(item) for item in slim] == [{"id", "title", "similarity"}] * len(full.json()["items"])
+    assert [item["id"] for item in slim] == [item["id"] for item in full.json()["items"]]
+    assert client.post(f"{recall_url}?fields=id,body", json=recall_req).status_code == 400
+
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "投影"}).json()["id"]
+    sent = client.post(
+        f"/api/v1/chat/sessions/{session_id}/messages?fields=id,similarity",
+        json={"message": "压缩 投影", "vectorStoreId": store_id},
+    ).json()
+    assert sent["message"]["citations"]
+    assert all(set(citation) == {"id", "similarity"} for citation in sent["message"]["citations"])
+    detail = client.get(f"/api/v1/chat/sessions/{session_id}?fields=id").json()
+    assert all(set(citation) == {"id"} for message in detail["messages"] for citation in message["citations"])
+
+    class FakeBrotli:
+        class Compressor:
+            def __init__(self, quality):
+                self.inner = zlib.compressobj(quality)
+
+            def process(self, data):
+                return self.inner.compress(data)
+
+            def flush(self):
+                return self.inner.flush(zlib.Z_SYNC_FLUSH)
+
+            def finish(self):
+                return self.inner.flush()
+
+    monkeypatch.setattr(middleware, "brotli", FakeBrotli)
+    raw = client.post(recall_url, json=recall_req, headers={"Accept-Encoding": "br, gzip"})
+    assert raw.headers["content-encoding"] == "br"
+    assert json.loads(zlib.decompress(raw.content))["items"] == full.json()["items"]
+    refused = client.post(recall_url, json=recall_req, headers={"Accept-Encoding": "br;q=0, gzip"})
+    assert refused.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in client.get("/healthz").headers
+
+
+def test_build_report_and_column_migration(client, monkeypatch, tmp_path):
+    from sqlalchemy import inspect, text
+    from sqlmodel import create_engine
+
+    from app.models import db
+
+    paragraph = "构建报告 重复段落 " * 10
+    filename, data = _create_text_file("\n\n".join([paragraph] * 6 + [f"第{index}段 独立内容" * 8 for index in range(10)]))
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "报告库", "chunkSize": 100, "overlap": 0, "topK": 2, "shards": 2, "dedup": False}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+
+    report = client.get(f"/api/v1/vector-stores/{store_id}").json()["buildReport"]
+    assert report["chunks"] > 10 and report["shards"] == 2
+    assert report["characters"] > 0 and report["tokens"] > 0
+    assert report["indexType"] == "IndexFlatL2" and report["dimension"] == 3
+    assert report["memoryBytes"] == report["chunks"] * report["dimension"] * 4
+    assert report["diskBytes"] > report["memoryBytes"]
+    assert set(report["phases"]) == {"extract", "split", "dedup", "embed", "index", "save"}
+    assert report["embedding"]["texts"] == report["chunks"]
+    assert report["embedding"]["cacheHits"] >= 5
+    assert report["embedding"]["apiCalls"] == 0
+
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with legacy.begin() as connection:
+        connection.execute(
+            text("CREATE TABLE vectorstorerecord (store_id VARCHAR PRIMARY KEY, name VARCHAR, failure_reason VARCHAR)")
+        )
+    monkeypatch.setattr(db, "engine", legacy)
+    db.init_db()
+    columns = [column["name"] for column in inspect(legacy).get_columns("vectorstorerecord")]
+    assert columns == ["store_id", "name", "failure_reason", "build_report"]
+    db.init_db()
+
+
+def test_batch_qa_job_streams_results_and_resumes(client, monkeypatch, tmp_path):
+    import time
+
+    from app import cli
+    from app.config import get_settings
+    from app.services import qa_batch
+
+    monkeypatch.setattr(get_settings(), "qa_job_dir", tmp_path / "jobs")
+    filename, data = _create_text_file("\n\n".join(f"批量问答 第{index}条 知识" * 3 for index in range(20)))
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "批量库", "chunkSize": 100, "overlap": 0, "topK": 2}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+    sessions_before = client.get("/api/v1/chat/sessions").json()["total"]
+
+    lines = [json.dumps({"id": f"q{index}", "question": f"第{index}条是什么"}, ensure_ascii=False) for index in range(6)]
+    questions = ("\n".join(lines) + '\n\n"裸字符串问题"\n').encode("utf-8")
+    bad = client.post("/api/v1/qa-jobs", data={"storeId": store_id}, files={"file": ("q.jsonl", b"{oops", "application/json")})
+    assert bad.status_code == 400
+    created = client.post(
+        "/api/v1/qa-jobs",
+        data={"storeId": store_id, "concurrency": "3"},
+        files={"file": ("q.jsonl", questions, "application/json")},
+    )
+    assert created.status_code == 202
+    job = created.json()
+    assert job["total"] == 7
+
+    deadline = time.monotonic() + 20
+    while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = client.get(f"/api/v1/qa-jobs/{job['id']}").json()
+    assert job["status"] == "completed" and job["completed"] == 7 and job["failed"] == 0
+
+    results = [json.loads(line) for line in client.get(job["resultsUrl"]).text.splitlines()]
+    assert sorted(result["id"] for result in results) == sorted([f"q{index}" for index in range(6)] + ["8"])
+    assert all(result["answer"] and len(result["citations"]) == 3 for result in results)
+    assert {"search", "embed_query"} <= set(results[0]["timings"])
+    assert client.get("/api/v1/chat/sessions").json()["total"] == sessions_before
+    assert client.post(f"/api/v1/qa-jobs/{job['id']}/resume").status_code == 409
+    assert client.post(f"/api/v1/qa-jobs/{job['id']}/cancel").status_code == 409
+
+    # an interrupted run: two results written, one failed (asked again) and the last torn mid-line
+    output = tmp_path / "cli.jsonl"
+    written = [*results[:2], {**results[2], "answer": None, "error": "模型请求排队已满，请稍后重试"}]
+    output.write_text("\n".join(json.dumps(result, ensure_ascii=False) for result in written) + '\n{"id": "q', "utf-8")
+    answered = []
+    monkeypatch.setattr(qa_batch, "answer_question", lambda store, question: answered.append(question) or {"answer": "ok"})
+    source = tmp_path / "questions.jsonl"
+    source.write_bytes(questions)
+    assert cli.main(["qa-batch", "--store", store_id, "--input", str(source), "--output", str(output)]) == 0
+    assert len(answered) == 5
+    assert len(output.read_text("utf-8").splitlines()) == 7
+    assert cli.main(["qa-batch", "--store", "missing", "--input", str(source), "--output", str(output)]) == 2
+
+
+def test_batch_qa_records_failed_model_calls_in_its_own_lane(client, monkeypatch, tmp_path):
+    from app.services import chat, qa_batch
+    from app.services.llm_scheduler import CircuitBreaker
+
+    class BrokenModel:
+        def stream(self, messages):
+            raise ConnectionError("upstream unreachable")
+
+    # the batch lane's breaker is open; interactive chat in the other lane still reaches the model
+    open_breaker = CircuitBreaker(0.5, 1, 1, 60)
+    open_breaker.record(False)
+    monkeypatch.setattr(chat.batch_scheduler, "breaker", open_breaker)
+    monkeypatch.setattr(chat.scheduler, "breaker", CircuitBreaker(0.5, 10, 10, 60))
+    with pytest.raises(RuntimeError, match="circuit_open"):
+        qa_batch.answer_question(None, "熔断时的问题")
+    session_id = client.post("/api/v1/chat/sessions", json={"title": "交互"}).json()["id"]
+    url = f"/api/v1/chat/sessions/{session_id}/messages"
+    reply = client.post(url, json={"message": "你好"}, headers={"X-Debug-Timing": "1"}).json()
+    assert "invoke=success" in reply["debug"]["notes"]
+
+    monkeypatch.setattr(chat.batch_scheduler, "breaker", CircuitBreaker(0.5, 10, 10, 60))
+    monkeypatch.setattr(chat, "get_chat_model", lambda: BrokenModel())
+    output = tmp_path / "failed.jsonl"
+    questions = [{"id": "a", "question": "第一问"}, {"id": "b", "question": "第二问"}]
+    assert qa_batch.run_questions(questions, None, output, 2) == (2, 2)
+    lines = [json.loads(line) for line in output.read_text("utf-8").splitlines()]
+    assert all(line["error"].startswith("model call failed: error:") and line["answer"] is None for line in lines)
+
+    monkeypatch.undo()
+    assert qa_batch.run_questions(questions, None, output, 2) == (2, 0)
+    assert [json.loads(line)["error"] for line in output.read_text("utf-8").splitlines()] == [None, None]
+
+    # a job with failed questions stays resumable and the resume asks only those again
+    import time
+
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "qa_job_dir", tmp_path / "jobs")
+    filename, data = _create_text_file("重试 失败问题 " * 40)
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "重试库", "chunkSize": 100, "overlap": 0, "topK": 2}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+    asked = []
+
+    def flaky(store, question):
+        asked.append(question)
+        if question == "第二问" and asked.count(question) == 1:
+            raise RuntimeError("model call failed: circuit_open")
+        return {"answer": "ok"}
+
+    def wait(job):
+        deadline = time.monotonic() + 10
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+            job = client.get(f"/api/v1/qa-jobs/{job['id']}").json()
+        return job
+
+    monkeypatch.setattr(qa_batch, "answer_question", flaky)
+    lines = "\n".join(json.dumps(item, ensure_ascii=False) for item in questions).encode("utf-8")
+    files = {"file": ("q.jsonl", lines, "application/json")}
+    job = wait(client.post("/api/v1/qa-jobs", data={"storeId": store_id}, files=files).json())
+    assert (job["status"], job["completed"], job["failed"]) == ("completed_with_errors", 2, 1)
+    assert "1 个问题失败" in job["message"]
+    job = wait(client.post(f"/api/v1/qa-jobs/{job['id']}/resume").json())
+    assert (job["status"], job["completed"], job["failed"], job["message"]) == ("completed", 2, 0, None)
+    assert sorted(asked) == ["第一问", "第二问", "第二问"]
+    results = [json.loads(line) for line in client.get(job["resultsUrl"]).text.splitlines()]
+    assert sorted((result["id"], result["error"]) for result in results) == [("a", None), ("b", None)]
+    assert client.post(f"/api/v1/qa-jobs/{job['id']}/resume").status_code == 409
+
+
+def test_lazy_singletons_and_warm_up(client, monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.services import vector_stores, warmup
+    from app.utils import metrics
+    from app.utils.lazy import Lazy
+
+    builds = []
+    gate = threading.Event()
+
+    def factory():
+        gate.wait(1)
+        builds.append(1)
+        return object()
+
+    holder = Lazy(factory)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(holder.get) for _ in range(8)]
+        gate.set()
+        values = {id(future.result()) for future in futures}
+    assert builds == [1] and len(values) == 1
+
+    filename, data = _create_text_file("\n\n".join(f"预热 热点知识库 第{index}段" * 3 for index in range(40)))
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "预热库", "chunkSize": 100, "overlap": 0, "topK": 2, "shards": 2}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+
+    monkeypatch.setattr(warmup.settings, "warmup_models", True)
+    monkeypatch.setattr(warmup.settings, "warmup_store_ids_raw", f"{store_id},missing-store")
+    timings = warmup.warm_up()
+    assert {"embeddings", "chat_model", "rag_executor", f"store:{store_id}"} <= set(timings)
+    assert "store:missing-store" not in timings
+
+    hits = metrics.CACHE_LOOKUPS.value(cache="vector_store", result="hit")
+    response = client.post(f"/api/v1/vector-stores/{store_id}/recall", json={"query": "热点", "topK": 2})
+    assert response.status_code == 200
+    assert metrics.CACHE_LOOKUPS.value(cache="vector_store", result="hit") == hits + 2
+    assert vector_stores.preload_store(store_id) == 2
+
+
+def test_logging_is_queued_sampled_and_clipped(client):
+    import logging
+    import queue
+
+    from app.utils import logs
+
+    assert any(isinstance(handler, logs.StructuredQueueHandler) for handler in logging.getLogger().handlers)
+
+    records = queue.Queue()
+    handler = logs.StructuredQueueHandler(records, max_chars=30)
+    handler.addFilter(logs.SamplingFilter({"rag.test": 0.0, "rag.test.kept": 1.0}))
+    logger = logging.getLogger("rag.test")
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        logger.info("sampled out %s", "x")
+        logging.getLogger("rag.test.kept").info("question=%s", "长问题" * 50)
+        state = {"answer": "draft"}
+        logger.warning("state %r", state)
+        state["answer"] = "final"
+        logger.error("failed on %s", "完整上下文" * 50)
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    kept, warned, failed = (records.get_nowait() for _ in range(3))
+    assert records.empty()
+    assert kept.getMessage().startswith("question=" + "长问题" * 10 + "…")
+    assert "…[sha1:" in kept.getMessage() and "(150 chars)" in kept.getMessage()
+    assert warned.getMessage() == "state {'answer': 'draft'}"
+    assert failed.getMessage() == "failed on " + "完整上下文" * 50
+
+    entry = json.loads(logs.JsonFormatter().format(failed))
+    assert entry["level"] == "ERROR" and entry["logger"] == "rag.test"
+    assert entry["message"] == failed.getMessage()
+
+    # a full queue drops the record and counts it instead of blocking the caller
+    full = logs.StructuredQueueHandler(queue.Queue(1), max_chars=30)
+    dropped = logs.LOG_RECORDS_DROPPED.value(level="INFO")
+    logger.addHandler(full)
+    logger.propagate = False
+    try:
+        logger.info("first")
+        logger.info("second")
+    finally:
+        logger.removeHandler(full)
+        logger.propagate = True
+    assert full.queue.get_nowait().getMessage() == "first" and full.queue.empty()
+    assert logs.LOG_RECORDS_DROPPED.value(level="INFO") == dropped + 1
+
+
+def test_profiling_is_admin_gated(client, monkeypatch, tmp_path):
+    import pstats
+
+    from app.config import get_settings
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "profile_dir", tmp_path / "profiles")
+    filename, data = _create_text_file("\n\n".join(f"剖析 第{index}段 内容" * 3 for index in range(20)))
+    task_id = client.post("/api/v1/documents", files={"file": (filename, io.BytesIO(data), "text/plain")}).json()["taskId"]
+    config = {"name": "剖析库", "chunkSize": 100, "overlap": 0, "topK": 2}
+    store_id = client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config}).json()["storeId"]
+    recall_url = f"/api/v1/vector-stores/{store_id}/recall"
+
+    monkeypatch.setattr(settings, "admin_token", None)
+    assert client.get("/api/v1/admin/profiles").status_code == 403
+    assert client.post(recall_url, json={"query": "剖析"}, headers={"X-Profile": "1"}).status_code == 403
+
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    admin = {"X-Admin-Token": "s3cret"}
+    plain = client.post(recall_url, json={"query": "剖析"}, headers=admin)
+    assert plain.status_code == 200 and "x-profile-id" not in plain.headers
+    assert client.post(f"{recall_url}?profile=1", json={"query": "剖析"}, headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    profiled = client.post(f"{recall_url}?profile=1", json={"query": "剖析"}, headers=admin)
+    assert profiled.status_code == 200
+    profile_id = profiled.headers["x-profile-id"]
+    assert profile_id.endswith(".prof") and "-recall-" in profile_id
+
+    monkeypatch.setattr(settings, "profile_builds", True)
+    client.post("/api/v1/vector-stores", json={"documentTaskId": task_id, "config": config})
+    listed = client.get("/api/v1/admin/profiles", headers=admin).json()
+    assert profile_id in {entry["name"] for entry in listed}
+    assert any("-build_vector_store-" in entry["name"] for entry in listed)
+
+    download = client.get(f"/api/v1/admin/profiles/{profile_id}", headers=admin)
+    assert download.status_code == 200
+    saved = tmp_path / "download.prof"
+    saved.write_bytes(download.content)
+    assert pstats.Stats(str(saved)).total_calls > 0
+    assert client.get("/api/v1/admin/profiles/..%2Fdb.prof", headers=admin).status_code == 404
+
+
+def test_maintenance_purges_expired_rows_and_orphaned_files(client, monkeypatch, tmp_path):
+    import time
+    from datetime import datetime, timedelta
+
+    from sqlmodel import select
+
+    from app import cli
+    from app.config import get_settings
+    from app.models.db import get_session
+    from app.models.entities import ChatMessage, ChatSession, DocumentTask
+    from app.services import maintenance
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "qa_job_dir", tmp_path / "qa_jobs")
+    monkeypatch.setattr(settings, "retention_session_days", 30)
+    monkeypatch.setattr(settings, "retention_failed_task_days", 30)
+    monkeypatch.setattr(settings, "admin_token", "s3cret")
+    admin = {"X-Admin-Token": "s3cret"}
+    old = datetime.utcnow() - timedelta(days=60)
+    with get_session() as session:
+        session.add(ChatSession(session_id="stale-session", title="旧会话", created_at=old, updated_at=old))
+        session.add(ChatMessage(message_id="stale-message", session_id="stale-session", role="user", content="你好", timestamp=old))
+        session.add(ChatSession(session_id="fresh-session", title="新会话"))
+        session.add(
+            DocumentTask(
+                task_id="stale-failed", file_name="bad.txt", file_type="txt", file_size=0, status="failed",
+                file_path="bad.txt", updated_at=old,
+            )
+        )
+        session.commit()
+
+    stale = time.time() - 2 * settings.maintenance_min_age_seconds
+    orphan_store = settings.vector_dir / "deleted-store"
+    orphan_store.mkdir()
+    (orphan_store / "index.faiss").write_bytes(b"0" * 100)
+    orphan_document = settings.document_dir / "gone.txt"
+    orphan_document.write_bytes(b"0" * 50)
+    orphan_job = settings.qa_job_dir / "gone-job"
+    orphan_job.mkdir(parents=True)
+    for path in (orphan_store, orphan_document, orphan_job):
+        os.utime(path, (stale, stale))
+    in_flight = settings.vector_dir / ".import-in-flight"
+    in_flight.mkdir()
+
+    assert client.post("/api/v1/admin/maintenance", params={"dryRun": True}).status_code == 403
+    dry = client.post("/api/v1/admin/maintenance", params={"dryRun": True}, headers=admin).json()
+    assert dry["dryRun"] is True and dry["vacuum"] == "skipped"
+    assert (dry["sessions"], dry["messages"], dry["failedTasks"]) == (1, 1, 1)
+    assert dry["orphanedStores"] == ["deleted-store"]
+    assert dry["orphanedDocuments"] == ["gone.txt"] and dry["orphanedQaJobs"] == ["gone-job"]
+    assert dry["freedFileBytes"] == 150
+    assert orphan_store.exists() and orphan_document.exists() and orphan_job.exists()
+
+    report = client.post("/api/v1/admin/maintenance", headers=admin).json()
+    assert (report["sessions"], report["messages"], report["failedTasks"]) == (1, 1, 1)
+    assert report["vacuum"] == "incremental"
+    assert not orphan_store.exists() and not orphan_document.exists() and not orphan_job.exists()
+    assert in_flight.exists()
+    with get_session() as session:
+        assert session.get(ChatSession, "stale-session") is None
+        assert session.get(ChatSession, "fresh-session") is not None
+        assert session.exec(select(ChatMessage).where(ChatMessage.session_id == "stale-session")).first() is None
+        assert session.get(DocumentTask, "stale-failed") is None
+
+    assert client.delete("/api/v1/chat/sessions/fresh-session").status_code == 204
+    assert cli.main(["maintenance", "--dry-run"]) == 0
+
+    # a run holding the lock in another process (scheduled job, CLI, another worker) turns others away
+    if maintenance.fcntl is not None:
+        with (settings.data_dir / maintenance._LOCK_FILE).open("a") as held:
+            maintenance.fcntl.flock(held, maintenance.fcntl.LOCK_EX | maintenance.fcntl.LOCK_NB)
+            assert client.post("/api/v1/admin/maintenance", headers=admin).status_code == 409
+            assert cli.main(["maintenance", "--dry-run"]) == 2
+        assert cli.main(["maintenance", "--dry-run"]) == 0
+    in_flight.rmdir()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork server needs os.fork")
+def test_prefork_server_serves_reloads_and_stops(tmp_path):
+    import signal
+    import socket
+    import subprocess
+    import time
+    import urllib.request
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    env = {
+        **os.environ,
+        "DATA_DIR": str(tmp_path / "db"),
+        "DOCUMENT_DIR": str(tmp_path / "documents"),
+        "VECTOR_DIR": str(tmp_path / "vectors"),
+    }
+    master = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--host", "127.0.0.1", "--port", str(port), "--workers", "2",
+         "--preload-all", "--log-level", "WARNING", "--metrics-interval", "0.2"],
+        cwd=BACKEND_PATH, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+
+    def healthy(timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                    return response.status == 200
+            except OSError:
+                time.sleep(0.1)
+        return False
+
+    def scrape():
+        time.sleep(0.5)  # let every process publish
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            lines = response.read().decode().splitlines()
+        health = 'rag_http_requests_total{method="GET",route="/healthz",status="200"} '
+        served = sum(float(line[len(health):]) for line in lines if line.startswith(health))
+        pids = {line.split('pid="')[1].split('"')[0] for line in lines if 'pid="' in line}
+        return served, pids
+
+    try:
+        assert healthy(30)
+        for _ in range(10):
+            assert healthy(5)
+        served, pids = scrape()
+        # merged over the workers and the job process, whichever worker answers the scrape
+        assert served >= 11 and len(pids) >= 2
+        master.send_signal(signal.SIGHUP)
+        for _ in range(20):
+            assert healthy(5)
+            time.sleep(0.1)
+        # requests served by the replaced workers are still counted
+        assert scrape()[0] >= served + 20
+    finally:
+        master.send_signal(signal.SIGTERM)
+        _, stderr = master.communicate(timeout=30)
+    assert master.returncode == 0, stderr.decode(errors="replace")
+
+
+def test_exited_process_metrics_are_archived(tmp_path):
+    from app.utils import metrics
+
+    labels = {"method": "GET", "route": "/archived", "status": "200"}
+    exited = {
+        "rag_http_requests_total": [[["GET", "/archived", "200"], 3.0]],
+        "rag_http_requests_in_flight": [[[], 2.0]],
+    }
+    (tmp_path / "stale.tmp").write_text("{}", encoding="utf-8")
+    metrics.clear_shared(tmp_path)
+    assert list(tmp_path.iterdir()) == []
+    # the same pid twice: an earlier process and the one that reused its pid keep separate files
+    for start in (1, 2):
+        (tmp_path / f"4242-{start}.json").write_text(json.dumps(exited), encoding="utf-8")
+    metrics.mark_process_dead(tmp_path, 4242)
+    assert [path.name for path in tmp_path.iterdir()] == ["archive.json"]
+    archive = json.loads((tmp_path / "archive.json").read_text(encoding="utf-8"))
+    assert archive == {"rag_http_requests_total": [[["GET", "/archived", "200"], 6.0]]}
+
+    metrics.HTTP_REQUESTS.inc(**labels)
+    shared = metrics._SharedSamples(tmp_path, 1.0)
+    line = 'rag_http_requests_total{method="GET",route="/archived",status="200"} '
+    rendered = metrics.REGISTRY.render(shared.snapshots())
+    totals = [float(row[len(line):]) for row in rendered.splitlines() if row.startswith(line)]
+    assert totals == [6.0 + metrics.HTTP_REQUESTS.value(**labels)]